@@ -0,0 +1,37 @@
+"""Command-name and path completion over large synthetic directories."""
+import os
+
+from common import make_executables, measure, result, saved_env
+
+from pyshell import completion
+
+
+def run(fixtures, quick=False):
+    number = 5 if quick else 50
+    bins = [os.path.join(fixtures, 'completion', f'bin{i}') for i in range(8)]
+    for i, directory in enumerate(bins):
+        make_executables(directory, 500, prefix=f'tool{i}_')
+
+    files = os.path.join(fixtures, 'completion', 'files')
+    os.makedirs(files, exist_ok=True)
+    for i in range(5000):
+        open(os.path.join(files, f'data{i:05d}.csv'), 'w').close()
+
+    with saved_env(PATH=os.pathsep.join(bins)):
+        def cold():
+            completion.index = completion.CommandIndex()
+            return completion.complete_command(None, 'tool3_01')
+
+        cold_time = measure(cold, max(1, number // 5), repeat=3)
+        completion.complete_command(None, 'tool')
+        warm = measure(lambda: completion.complete_command(None, 'tool3_01'), number)
+        completion.index = completion.CommandIndex()
+
+    prefix = os.path.join(files, 'data012')
+    path = measure(lambda: completion.complete_path(prefix), number)
+
+    return [
+        result('completion.command_4000_bins_cold', cold_time),
+        result('completion.command_4000_bins_warm', warm),
+        result('completion.path_5000_files', path),
+    ]
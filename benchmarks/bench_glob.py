@@ -0,0 +1,35 @@
+"""Pathname expansion over a synthetic tree of 100k files."""
+import os
+
+from common import measure, result
+
+from pyshell import globbing
+
+
+def _make_tree(root, dirs, files):
+    for d in range(dirs):
+        sub = os.path.join(root, f'd{d:03d}', 'sub')
+        os.makedirs(sub)
+        for f in range(files):
+            open(os.path.join(root, f'd{d:03d}', f'f{f:04d}.log'), 'w').close()
+            open(os.path.join(sub, f'g{f:04d}.txt'), 'w').close()
+
+
+def run(fixtures, quick=False):
+    number = 1 if quick else 5
+    root = os.path.join(fixtures, 'tree')
+    _make_tree(root, 20 if quick else 100, 500)
+
+    def cold(pattern, globstar=False):
+        return lambda: globbing.glob(os.path.join(root, pattern), globbing.DirCache(), globstar)
+
+    cache = globbing.DirCache()
+    shared = os.path.join(root, '*/*.log')
+    globbing.glob(shared, cache)
+
+    return [
+        result('glob.star_star_log', measure(cold('*/*.log'), number, repeat=3)),
+        result('glob.globstar_txt', measure(cold('**/*.txt', True), number, repeat=3)),
+        result('glob.narrow_pattern', measure(cold('d01*/sub/g01*.txt'), number * 10, repeat=3)),
+        result('glob.star_star_log_cached', measure(lambda: globbing.glob(shared, cache), number, repeat=3)),
+    ]
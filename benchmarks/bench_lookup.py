@@ -0,0 +1,36 @@
+"""PATH lookup of a command found in the last of many PATH directories."""
+import os
+
+from common import make_executables, measure, result, saved_env
+
+from pyshell import command_hash
+from pyshell import builtins
+
+
+def run(fixtures, quick=False):
+    number = 20 if quick else 200
+    dirs = [os.path.join(fixtures, 'lookup', f'dir{i:03d}') for i in range(200)]
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+    make_executables(dirs[-1], 1, prefix='target')
+
+    with saved_env(PATH=os.pathsep.join(dirs)):
+        path_dirs = command_hash.path_dirs()
+        uncached = measure(lambda: command_hash.search_path('target00000', path_dirs), number)
+        command_hash.table.clear()
+        builtins.find_executable('target00000')
+        hashed = measure(lambda: builtins.find_executable('target00000'), number)
+
+        def checked():
+            command_hash.table.expire()
+            builtins.find_executable('target00000')
+        rechecked = measure(checked, number)
+        missing = measure(lambda: builtins.find_executable('no-such-command'), number)
+        command_hash.table.clear()
+
+    return [
+        result('lookup.search_200_dirs_uncached', uncached),
+        result('lookup.find_executable_200_dirs_hashed', hashed),
+        result('lookup.find_executable_200_dirs_hashed_first_per_prompt', rechecked),
+        result('lookup.find_executable_200_dirs_missing', missing),
+    ]
@@ -0,0 +1,45 @@
+"""Lexing, parsing and expansion of long command lines."""
+from common import measure, result
+
+from pyshell import parsing
+
+
+class _Shell:
+    last_exit_code = 0
+    argv = ['pyshell']
+
+
+def long_line(words):
+    parts = []
+    for i in range(words):
+        kind = i % 4
+        if kind == 0:
+            parts.append(f'word{i}')
+        elif kind == 1:
+            parts.append(f'"quoted $HOME {i}"')
+        elif kind == 2:
+            parts.append(f"'single {i}'")
+        else:
+            parts.append(f'$PATH/x{i}')
+    return 'echo ' + ' '.join(parts) + ' < in.txt 2> err.txt >> out.txt'
+
+
+def run(fixtures, quick=False):
+    number = 20 if quick else 200
+    shell = _Shell()
+    line = long_line(500)
+    tokens = parsing.tokenize(line)
+    expanded = parsing.expand_variables(tokens, shell)
+    pipeline = parsing.parse(line)
+
+    return [
+        result('parser.tokenize_500_words', measure(lambda: parsing.tokenize(line), number)),
+        result('parser.expand_variables_500_words',
+               measure(lambda: parsing.expand_variables(tokens, shell), number)),
+        result('parser.parse_redirections_500_words',
+               measure(lambda: parsing.parse_redirections(expanded), number)),
+        result('parser.parse_uncached_500_words', measure(lambda: parsing._parse(line), number)),
+        result('parser.parse_cached_500_words', measure(lambda: parsing.parse(line), number * 10)),
+        result('parser.expand_words_500_words',
+               measure(lambda: parsing.expand_words(pipeline.commands[0].words, shell), number)),
+    ]
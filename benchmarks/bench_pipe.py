@@ -0,0 +1,41 @@
+"""Throughput of multi-stage pipelines over a fixture file."""
+import os
+import time
+
+from common import result
+
+from pyshell.shell import Shell
+
+
+def _throughput(shell, line, size):
+    start = time.perf_counter()
+    shell.run_lines([line])
+    return size / (time.perf_counter() - start) / 1e6
+
+
+def run(fixtures, quick=False):
+    size = (16 if quick else 128) * 1024 * 1024
+    path = os.path.join(fixtures, 'pipe.bin')
+    if not os.path.exists(path) or os.path.getsize(path) != size:
+        chunk = os.urandom(1024 * 1024)
+        with open(path, 'wb') as f:
+            for _ in range(size // len(chunk)):
+                f.write(chunk)
+
+    shell = Shell(interactive=False)
+    lines = {
+        'pipe.builtin_cat_to_file_MBps': f'cat {path} > {os.devnull}',
+        'pipe.builtin_cat_3_stages_MBps': f'cat {path} | cat | cat > {os.devnull}',
+        'pipe.external_cat_3_stages_MBps': f'cat {path} | /bin/cat | /bin/cat > {os.devnull}',
+        'pipe.tee_3_stages_MBps': f'cat {path} | tee {os.devnull} | cat > {os.devnull}',
+        # `set -o bigpipe` stays on in this shell, so these come last
+        'pipe.bigpipe_external_cat_3_stages_MBps':
+            f'set -o bigpipe; cat {path} | /bin/cat | /bin/cat > {os.devnull}',
+        'pipe.bigpipe_tee_3_stages_MBps': f'cat {path} | tee {os.devnull} | cat > {os.devnull}',
+    }
+    results = []
+    for name, line in lines.items():
+        _throughput(shell, line, size)  # warm the page cache and hash table
+        best = max(_throughput(shell, line, size) for _ in range(1 if quick else 3))
+        results.append(result(name, best, unit='MB/s', better='higher'))
+    return results
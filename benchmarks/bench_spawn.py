@@ -0,0 +1,112 @@
+"""Spawn latency and commands-per-second for each launcher backend.
+
+    python benchmarks/bench_spawn.py [-n COUNT] [--json]
+
+Each backend starts `true` from PATH COUNT times, one after another,
+through pyshell.spawn.spawn() and waits for it; then a batch Shell runs
+COUNT lines of its absolute path (plain `true` is a builtin) to give
+end-to-end commands per second.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+
+from common import result
+
+from pyshell import spawn
+from pyshell.shell import Shell
+
+
+def bench_backend(using, argv, count):
+    """Return per-spawn latencies in seconds for one backend"""
+    devnull = os.open(os.devnull, os.O_RDWR)
+    latencies = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            spawn.spawn(argv, stdin=devnull, stdout=devnull, stderr=devnull, using=using).wait()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        os.close(devnull)
+    return latencies
+
+
+def bench_shell(using, program, count):
+    """Return the commands per second of a batch Shell running program lines"""
+    saved = os.environ.get('PYSHELL_SPAWN')
+    os.environ['PYSHELL_SPAWN'] = using
+    try:
+        shell = Shell(interactive=False)
+        start = time.perf_counter()
+        shell.run_lines([program] * count)
+        return count / (time.perf_counter() - start)
+    finally:
+        if saved is None:
+            del os.environ['PYSHELL_SPAWN']
+        else:
+            os.environ['PYSHELL_SPAWN'] = saved
+
+
+def summarize(using, latencies):
+    total = sum(latencies)
+    ordered = sorted(latencies)
+    return {
+        'backend': using,
+        'count': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1e3,
+        'median_ms': statistics.median(latencies) * 1e3,
+        'p95_ms': ordered[int(len(ordered) * 0.95) - 1] * 1e3,
+        'commands_per_sec': len(latencies) / total if total else 0.0,
+    }
+
+
+def backends():
+    return [b for b in spawn.BACKENDS if b != 'posix_spawn' or spawn.HAS_POSIX_SPAWN]
+
+
+def collect(count):
+    program = shutil.which('true') or '/bin/true'
+    summaries = []
+    for using in backends():
+        bench_backend(using, [program], min(20, count))  # warm up
+        summary = summarize(using, bench_backend(using, [program], count))
+        summary['shell_commands_per_sec'] = bench_shell(using, program, count)
+        summaries.append(summary)
+    return summaries
+
+
+def run(fixtures, quick=False):
+    results = []
+    for s in collect(50 if quick else 500):
+        results.append(result(f"spawn.{s['backend']}_median_latency", s['median_ms'] / 1e3))
+        results.append(result(f"spawn.{s['backend']}_commands_per_sec", s['commands_per_sec'],
+                              unit='cmd/s', better='higher'))
+        results.append(result(f"spawn.{s['backend']}_shell_commands_per_sec", s['shell_commands_per_sec'],
+                              unit='cmd/s', better='higher'))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=500)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    opts = parser.parse_args(argv)
+
+    results = collect(opts.count)
+    if opts.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'backend':<12} {'mean ms':>9} {'median ms':>10} {'p95 ms':>8} {'cmds/s':>9} {'shell cmds/s':>13}")
+    for r in results:
+        print(f"{r['backend']:<12} {r['mean_ms']:>9.3f} {r['median_ms']:>10.3f} "
+              f"{r['p95_ms']:>8.3f} {r['commands_per_sec']:>9.1f} {r['shell_commands_per_sec']:>13.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Wall-clock start-up time of `main.py -c true` against a bare interpreter,
+and of the same command sent to a running `main.py --server`."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from common import ROOT, result
+
+from pyshell import client
+
+
+def _time(argv, count):
+    best = None
+    for _ in range(count):
+        start = time.perf_counter()
+        subprocess.run(argv, check=True, stdin=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _server_request(main, fixtures, count):
+    """Best round trip of `-c true` through a server started for the run"""
+    path = os.path.join(fixtures, 'server.sock')
+    server = subprocess.Popen([sys.executable, main, '--server', '-j', '1', path],
+                              stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.perf_counter() + 10
+        while not os.path.exists(path) and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        with open(os.devnull, 'r+') as devnull:
+            fds = [devnull.fileno()] * 3
+            best = None
+            for _ in range(count * 10):
+                start = time.perf_counter()
+                with socket.socket(socket.AF_UNIX) as sock:
+                    sock.connect(path)
+                    client.send_request(sock, {'argv': ['-c', 'true'], 'cwd': fixtures,
+                                               'env': dict(os.environ)}, fds)
+                    client.recv_exact(sock, 2 * client.STATUS.size)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        return best
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run(fixtures, quick=False):
+    count = 3 if quick else 15
+    main = os.path.join(ROOT, 'main.py')
+    bare = _time([sys.executable, '-c', 'pass'], count)
+    shell = _time([sys.executable, main, '-c', 'true'], count)
+    return [
+        result('startup.python_bare', bare),
+        result('startup.pyshell_c_true', shell),
+        result('startup.pyshell_overhead', max(0.0, shell - bare)),
+        result('startup.server_request_c_true', _server_request(main, fixtures, count)),
+    ]
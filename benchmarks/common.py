@@ -0,0 +1,59 @@
+"""Shared helpers for the benchmark modules.
+
+Every module exposes run(fixtures, quick=False), returning a list of result
+dicts made by result(); benchmarks/run.py collects them into one report.
+"""
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def measure(func, number=100, repeat=5):
+    """Return the median per-call time of func over repeat rounds of number calls"""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return statistics.median(rounds)
+
+
+def result(name, value, unit='s', better='lower'):
+    return {'name': name, 'value': value, 'unit': unit, 'better': better}
+
+
+def make_executables(directory, count, prefix='cmd'):
+    """Create count empty executable files in directory"""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        path = os.path.join(directory, f'{prefix}{i:05d}')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(path, 0o755)
+
+
+class saved_env:
+    """Context manager that restores the given environment variables on exit"""
+
+    def __init__(self, **values):
+        self.values = values
+        self.saved = {}
+
+    def __enter__(self):
+        for key, value in self.values.items():
+            self.saved[key] = os.environ.get(key)
+            os.environ[key] = value
+        return self
+
+    def __exit__(self, *exc):
+        for key, value in self.saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
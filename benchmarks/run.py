@@ -0,0 +1,125 @@
+"""Run the PyShell benchmark suite.
+
+    python benchmarks/run.py [--quick] [--only parser,lookup,...] [--json FILE]
+    python benchmarks/run.py --compare BASE.json [--threshold PCT] [NEW.json]
+
+Every benchmark runs offline against fixtures created in a temporary
+directory. --json writes machine-readable results tagged with the current
+git commit; --compare diffs two such files (or a file against a fresh run)
+and exits with status 1 if any benchmark regressed by more than the
+threshold.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import ROOT  # noqa: E402
+
+SUITES = ('parser', 'lookup', 'completion', 'glob', 'spawn', 'pipe', 'startup')
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suites(names, quick):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pyshell-bench-') as fixtures:
+        for name in names:
+            module = importlib.import_module(f'bench_{name}')
+            suite_dir = os.path.join(fixtures, name)
+            os.makedirs(suite_dir)
+            print(f"running {name} ...", file=sys.stderr)
+            results.extend(module.run(suite_dir, quick=quick))
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def _format_value(r):
+    if r['unit'] == 's':
+        return f"{r['value'] * 1e6:12.2f} us"
+    return f"{r['value']:12.2f} {r['unit']}"
+
+
+def print_report(report):
+    print(f"commit {report['commit'] or '?'}  python {report['python']}  {report['platform']}")
+    for r in report['results']:
+        print(f"  {r['name']:<45} {_format_value(r)}")
+
+
+def compare(base, new, threshold):
+    """Print per-benchmark changes; return the names that regressed"""
+    old = {r['name']: r for r in base['results']}
+    regressions = []
+    print(f"{'benchmark':<45} {'base':>15} {'new':>15} {'change':>8}")
+    for r in new['results']:
+        b = old.get(r['name'])
+        if b is None or not b['value']:
+            continue
+        change = (r['value'] - b['value']) / b['value'] * 100
+        worse = change if r['better'] == 'lower' else -change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(r['name'])
+        print(f"{r['name']:<45} {_format_value(b):>15} {_format_value(r):>15} {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='fewer iterations and smaller fixtures')
+    parser.add_argument('--only', help='comma-separated subset of: ' + ', '.join(SUITES))
+    parser.add_argument('--json', metavar='FILE', help='write results to FILE')
+    parser.add_argument('--compare', metavar='BASE', help='compare against a saved result file')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='regression threshold in percent (default: 10)')
+    parser.add_argument('new', nargs='?', help='saved result file to compare instead of running')
+    opts = parser.parse_args(argv)
+
+    names = SUITES
+    if opts.only:
+        names = [n.strip() for n in opts.only.split(',') if n.strip()]
+        unknown = [n for n in names if n not in SUITES]
+        if unknown:
+            parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    if opts.new:
+        with open(opts.new) as f:
+            report = json.load(f)
+    else:
+        report = run_suites(names, opts.quick)
+        print_report(report)
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            base = json.load(f)
+        return 1 if compare(base, report, opts.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
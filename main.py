@@ -1,9 +1,76 @@
-from pyshell.shell import Shell
+import time
+
+_STARTED = time.perf_counter()
+
 import sys
+from pyshell import streams
+from pyshell.shell import Shell
+from pyshell.startup import profile
+
+USAGE = ("usage: main.py [--startup-profile] [--norc] [-q] "
+         "[-c command [name [arg ...]] | script [arg ...]]\n"
+         "       main.py --server [-j workers] [socket]")
+
+
+def main(argv):
+    """Run interactively, or in batch mode for -c, a script file or piped stdin"""
+    quiet = False
+    norc = False
+    while argv and argv[0] in ('--startup-profile', '--norc', '-q', '--quiet'):
+        option = argv.pop(0)
+        if option == '--startup-profile':
+            profile.start(_STARTED)
+            profile.mark('imports')
+        elif option == '--norc':
+            norc = True
+        else:
+            quiet = True
+
+    try:
+        return _run(argv, quiet, norc)
+    finally:
+        profile.mark('exit')
+        profile.report()
+
+
+def _run(argv, quiet, norc):
+    if argv and argv[0] == '-c':
+        if len(argv) < 2:
+            print(f"pyshell: -c: option requires an argument\n{USAGE}", file=sys.stderr)
+            return 2
+        shell = Shell(interactive=False, argv=argv[2:])
+        return shell.run_string(argv[1])
+
+    if argv and argv[0] == '--server':
+        from pyshell import server
+        return server.main(argv[1:])
+
+    if argv and argv[0] in ('-h', '--help'):
+        print(USAGE)
+        return 0
+
+    if argv:
+        try:
+            script = open(argv[0])
+        except OSError as e:
+            print(f"pyshell: {argv[0]}: {e.strerror}", file=sys.stderr)
+            return 127
+        with script:
+            return Shell(interactive=False, argv=argv).run_script(script)
+
+    if not sys.stdin.isatty():
+        # Not sys.stdin, whose read-ahead would take lines meant for `read`
+        # and for the commands the script runs
+        return Shell(interactive=False).run_lines(streams.read_lines(0))
 
-if __name__ == "__main__":
     shell = Shell()
+    shell.run(quiet=quiet, norc=norc)
+    return shell.last_exit_code
+
+
+if __name__ == "__main__":
     try:
-        shell.run()
+        status = main(sys.argv[1:])
     except SystemExit as e:
-        sys.exit(int(getattr(e, 'code', 0) or 0))
\ No newline at end of file
+        status = e.code
+    sys.exit(int(status or 0))
@@ -1,9 +1,15 @@
 import os
+import re
+import signal
+import stat
 import sys
-from .readline_setup import HAS_READLINE, readline
+from . import command_hash
+from . import parsing
+from . import registry
+from . import streams
 
 
-def builtin_cd(shell, args):
+def builtin_cd(shell, args, stdin=None, stdout=None, stderr=None):
     """Change directory"""
     if not args:
         target = os.path.expanduser('~')
@@ -12,156 +18,509 @@ def builtin_cd(shell, args):
 
     try:
         os.chdir(target)
+        command_hash.table.expire()  # an empty PATH entry means the cwd
         return 0
     except FileNotFoundError:
-        print(f"cd: {target}: No such file or directory")
+        print(f"cd: {target}: No such file or directory", file=stderr)
         return 1
     except PermissionError:
-        print(f"cd: {target}: Permission denied")
+        print(f"cd: {target}: Permission denied", file=stderr)
         return 1
     except Exception as e:
-        print(f"cd: {e}")
+        print(f"cd: {e}", file=stderr)
         return 1
 
 
-def builtin_pwd(shell):
+def builtin_pwd(shell, args, stdin=None, stdout=None, stderr=None):
     """Print working directory"""
-    print(os.getcwd())
+    print(os.getcwd(), file=stdout)
     return 0
 
 
-def builtin_echo(shell, args, stdout_redir=None, append=False):
+def builtin_echo(shell, args, stdin=None, stdout=None, stderr=None):
     """Echo arguments"""
-    output = ' '.join(args)
-
-    if stdout_redir:
-        try:
-            mode = 'a' if append else 'w'
-            with open(stdout_redir, mode) as f:
-                f.write(output + '\n')
-        except Exception as e:
-            print(f"echo: {e}")
-            return 1
-    else:
-        print(output)
-
+    print(' '.join(args), file=stdout)
     return 0
 
 
-def builtin_export(shell, args):
-    """Export environment variables"""
+def builtin_export(shell, args, stdin=None, stdout=None, stderr=None):
+    """Export variables to child processes: export [-p] [NAME[=value] ...]"""
+    variables = shell.variables
+    if not args or args == ['-p']:
+        for name, value in variables.exported():
+            print(f'export {name}="{value}"', file=stdout)
+        return 0
+
+    status = 0
     for arg in args:
-        if '=' in arg:
-            key, value = arg.split('=', 1)
-            os.environ[key] = value
-        else:
-            if arg in os.environ:
-                pass  
-            else:
-                os.environ[arg] = ''
+        name, sep, value = arg.partition('=')
+        if not parsing.is_name(name):
+            print(f"export: `{arg}': not a valid identifier", file=stderr)
+            status = 1
+            continue
+        variables.export(name, value if sep else None)
+    return status
+
+
+def builtin_exit(shell, args, stdin=None, stdout=None, stderr=None):
+    """Leave the shell with status N, or 0"""
+    raise SystemExit(int(args[0]) if args else 0)
+
+
+def builtin_true(shell, args, stdin=None, stdout=None, stderr=None):
+    """Do nothing, successfully"""
     return 0
 
 
-def builtin_unset(shell, args):
-    """Unset environment variables"""
+def builtin_false(shell, args, stdin=None, stdout=None, stderr=None):
+    """Do nothing, unsuccessfully"""
+    return 1
+
+
+def builtin_unset(shell, args, stdin=None, stdout=None, stderr=None):
+    """Unset shell variables"""
     for arg in args:
-        if arg in os.environ:
-            del os.environ[arg]
+        shell.variables.unset(arg)
     return 0
 
 
-def builtin_history(shell):
-    """Show command history"""
-    if HAS_READLINE and readline is not None:
-        for i in range(1, readline.get_current_history_length() + 1):
-            print(f"{i:5d}  {readline.get_history_item(i)}")
+def _read_line(fd, raw):
+    """Read one line from fd a byte at a time, so nothing past it is consumed.
+    Returns (line, hit_eof)."""
+    data = bytearray()
+    while True:
+        try:
+            byte = os.read(fd, 1)
+        except InterruptedError:
+            continue
+        except OSError:
+            return data.decode(errors='replace'), True
+        if not byte:
+            return data.decode(errors='replace'), True
+        if byte == b'\n':
+            if not raw and data.endswith(b'\\'):
+                del data[-1]
+                continue
+            return data.decode(errors='replace'), False
+        data += byte
+
+
+def builtin_read(shell, args, stdin=None, stdout=None, stderr=None):
+    """Read a line from stdin into variables: read [-r] [name ...]
+
+    The line is split on whitespace; the last name gets the rest of it,
+    and the whole line goes to REPLY when no name is given.
+    """
+    raw = bool(args) and args[0] == '-r'
+    names = args[1:] if raw else args
+    for name in names:
+        if not parsing.is_name(name):
+            print(f"read: `{name}': not a valid identifier", file=stderr)
+            return 2
+
+    sys.stdout.flush()
+    fd = streams.stream_fd(stdin)
+    line, eof = _read_line(0 if fd is None else fd, raw)
+    if not raw:
+        line = re.sub(r'\\(.)', r'\1', line)
+    if not names:
+        shell.variables.set('REPLY', line)
     else:
-        for i, cmd in enumerate(getattr(shell, 'history', []), 1):
-            print(f"{i:5d}  {cmd}")
-    return 0
+        fields = line.split(None, len(names) - 1)
+        for i, name in enumerate(names):
+            shell.variables.set(name, fields[i].rstrip() if i < len(fields) else '')
+    return 1 if eof and not line else 0
 
 
-def builtin_ls(shell, args, stdout_redir=None, append=False):
-    """List directory contents (cross-platform)"""
-    try:
-        show_all = '-a' in args
-        long_format = '-l' in args
+SET_OPTIONS = {'e': 'errexit', 'f': 'noglob'}
 
-        paths = [arg for arg in args if not arg.startswith('-')]
-        target = paths[0] if paths else '.'
 
-        entries = os.listdir(target)
+def builtin_set(shell, args, stdin=None, stdout=None, stderr=None):
+    """Set or unset shell options: set [-e|+e] [-f|+f] [-o|+o option]"""
+    options = shell.options
+    if not args:
+        for name in sorted(options):
+            print(f"set {'-' if options[name] else '+'}o {name}", file=stdout)
+        return 0
 
-        if not show_all:
-            entries = [e for e in entries if not e.startswith('.')]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ('-o', '+o'):
+            if i + 1 >= len(args):
+                for name in sorted(options):
+                    print(f"{name:15} {'on' if options[name] else 'off'}", file=stdout)
+                return 0
+            name = args[i + 1]
+            if name not in options:
+                print(f"set: {name}: invalid option name", file=stderr)
+                return 2
+            options[name] = arg == '-o'
+            i += 2
+            continue
+        if arg[:1] in ('-', '+') and len(arg) > 1:
+            for flag in arg[1:]:
+                if flag not in SET_OPTIONS:
+                    print(f"set: {arg[0]}{flag}: invalid option", file=stderr)
+                    return 2
+                options[SET_OPTIONS[flag]] = arg[0] == '-'
+            i += 1
+            continue
+        print(f"set: {arg}: invalid option", file=stderr)
+        return 2
+    return 0
 
-        entries.sort()
 
-        if long_format:
-            output = []
-            for entry in entries:
-                full_path = os.path.join(target, entry)
-                try:
-                    stat_info = os.stat(full_path)
-                    size = stat_info.st_size
-                    is_dir = 'd' if os.path.isdir(full_path) else '-'
-                    output.append(f"{is_dir}  {size:>10}  {entry}")
-                except Exception:
-                    output.append(f"-  {'?':>10}  {entry}")
-            result = '\n'.join(output)
-        else:
-            result = '  '.join(entries)
+class LoopControl(Exception):
+    """Raised by `break` and `continue` to unwind to the enclosing loop"""
 
-        if stdout_redir:
-            mode = 'a' if append else 'w'
-            with open(stdout_redir, mode) as f:
-                f.write(result + '\n')
-        else:
-            print(result)
+    def __init__(self, kind, count):
+        super().__init__(kind)
+        self.kind = kind
+        self.count = count
+
+
+class FunctionReturn(Exception):
+    """Raised by `return` to leave the running function"""
 
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def _loop_control(shell, args, kind, stderr):
+    """Leave (or with kind='continue', restart) the N innermost loops"""
+    if not shell.loop_depth:
+        print(f"{kind}: only meaningful in a `for', `while', or `until' loop", file=stderr)
         return 0
-    except FileNotFoundError:
-        print(f"ls: {target}: No such file or directory")
-        return 1
-    except PermissionError:
-        print(f"ls: {target}: Permission denied")
-        return 1
-    except Exception as e:
-        print(f"ls: {e}")
+    try:
+        count = int(args[0]) if args else 1
+    except ValueError:
+        count = 0
+    if count < 1:
+        print(f"{kind}: {args[0]}: loop count out of range", file=stderr)
         return 1
+    raise LoopControl(kind, min(count, shell.loop_depth))
 
 
-def builtin_cat(shell, args, stdout_redir=None, append=False):
-    """Concatenate and print files"""
-    if not args:
-        print("cat: usage: cat file...")
+def builtin_break(shell, args, stdin=None, stdout=None, stderr=None):
+    """Leave the N innermost loops: break [N]"""
+    return _loop_control(shell, args, 'break', stderr)
+
+
+def builtin_continue(shell, args, stdin=None, stdout=None, stderr=None):
+    """Start the next iteration of the Nth innermost loop: continue [N]"""
+    return _loop_control(shell, args, 'continue', stderr)
+
+
+def builtin_return(shell, args, stdin=None, stdout=None, stderr=None):
+    """Return from a function with status N, or that of the last command"""
+    if not shell.function_depth:
+        print("return: can only `return' from a function", file=stderr)
         return 1
+    try:
+        status = int(args[0]) & 0xff if args else shell.last_exit_code
+    except ValueError:
+        print(f"return: {args[0]}: numeric argument required", file=stderr)
+        status = 2
+    raise FunctionReturn(status)
+
+
+def builtin_history(shell, args, stdin=None, stdout=None, stderr=None):
+    """Show command history: all of it, the last N entries, or with -s
+    those containing a pattern (searched through the history index)"""
+    entries = shell.history.entries
+    if args and args[0] == '-s':
+        if len(args) < 2:
+            print("history: -s: option requires an argument", file=stderr)
+            return 2
+        numbers = reversed(shell.history.search(' '.join(args[1:])))
+    elif args:
+        try:
+            count = int(args[0])
+        except ValueError:
+            print(f"history: {args[0]}: numeric argument required", file=stderr)
+            return 2
+        numbers = range(max(0, len(entries) - count), len(entries))
+    else:
+        numbers = range(len(entries))
+
+    for i in numbers:
+        print(f"{i + 1:5d}  {entries[i]}", file=stdout)
+    return 0
+
 
+def _ls_long(name, entry):
+    """Format one `ls -l` line from a DirEntry (type and stat are cached)"""
     try:
-        output = []
-        for filename in args:
-            with open(filename, 'r') as f:
-                output.append(f.read())
+        size = entry.stat().st_size
+        is_dir = 'd' if entry.is_dir() else '-'
+        return f"{is_dir}  {size:>10}  {name}"
+    except OSError:
+        return f"-  {'?':>10}  {name}"
+
+
+def _ls_columns(names, width):
+    """Lay names out in vertical columns that fit in width characters"""
+    if not names:
+        return []
+    lengths = [len(n) for n in names]
+    count = len(names)
+    max_cols = max(1, min(count, width // (min(lengths) + 2)))
+
+    for cols in range(max_cols, 0, -1):
+        rows = -(-count // cols)
+        cols = -(-count // rows)
+        widths = [max(lengths[c * rows:(c + 1) * rows]) + 2 for c in range(cols)]
+        if sum(widths) - 2 <= width or cols == 1:
+            break
+
+    lines = []
+    for r in range(rows):
+        row = []
+        for c in range(cols):
+            i = c * rows + r
+            if i >= count:
+                break
+            last = c == cols - 1 or i + rows >= count
+            row.append(names[i] if last else names[i].ljust(widths[c]))
+        lines.append(''.join(row))
+    return lines
+
+
+def builtin_ls(shell, args, stdin=None, stdout=None, stderr=None):
+    """List directory contents (cross-platform).
+       -a all entries, -l long format, -1 one per line,
+       -f unsorted and streamed as the directory is read (implies -a).
+    """
+    show_all = long_format = one_per_line = unsorted = False
+    paths = []
+    for arg in args:
+        if arg.startswith('-') and arg != '-':
+            for flag in arg[1:]:
+                if flag == 'a':
+                    show_all = True
+                elif flag == 'l':
+                    long_format = True
+                elif flag == '1':
+                    one_per_line = True
+                elif flag == 'f':
+                    unsorted = show_all = True
+                else:
+                    print(f"ls: invalid option -- '{flag}'", file=stderr)
+                    return 2
+        else:
+            paths.append(arg)
+    if not paths:
+        paths = ['.']
 
-        result = ''.join(output)
+    out = stdout if stdout is not None else sys.stdout
+    columns = None
+    if not (long_format or one_per_line or unsorted):
+        try:
+            if out.isatty():
+                import shutil
+                columns = shutil.get_terminal_size().columns
+        except (AttributeError, ValueError, OSError):
+            pass
 
-        if stdout_redir:
-            mode = 'a' if append else 'w'
-            with open(stdout_redir, mode) as f:
-                f.write(result)
+    def emit(items):
+        if long_format:
+            for name, entry in items:
+                out.write(_ls_long(name, entry) + '\n')
+        elif columns:
+            for line in _ls_columns([name for name, _ in items], columns):
+                out.write(line + '\n')
         else:
-            print(result, end='')
+            for name, _ in items:
+                out.write(name + '\n')
 
-        return 0
-    except FileNotFoundError as e:
-        print(f"cat: {e.filename}: No such file or directory")
-        return 1
+    status = 0
+    files = []
+    dirs = []
+    for target in paths:
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            print(f"ls: {target}: No such file or directory", file=stderr)
+            status = 1
+            continue
+        except PermissionError:
+            print(f"ls: {target}: Permission denied", file=stderr)
+            status = 1
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            dirs.append(target)
+        else:
+            files.append((target, _PathEntry(st)))
+
+    try:
+        if files:
+            emit(files if unsorted else sorted(files, key=lambda item: item[0]))
+
+        for n, target in enumerate(dirs):
+            if len(paths) > 1:
+                out.write(('\n' if files or n else '') + f"{target}:\n")
+            try:
+                with os.scandir(target) as it:
+                    entries = ((e.name, e) for e in it if show_all or not e.name.startswith('.'))
+                    if unsorted:
+                        emit(entries)
+                    else:
+                        emit(sorted(entries, key=lambda item: item[0]))
+            except FileNotFoundError:
+                print(f"ls: {target}: No such file or directory", file=stderr)
+                status = 1
+            except PermissionError:
+                print(f"ls: {target}: Permission denied", file=stderr)
+                status = 1
+        out.flush()
+        return status
+    except BrokenPipeError:
+        return 141
     except Exception as e:
-        print(f"cat: {e}")
+        print(f"ls: {e}", file=stderr)
         return 1
 
 
-def builtin_clear(shell):
+class _PathEntry:
+    """DirEntry-like wrapper so file operands of ls format like directory entries"""
+
+    def __init__(self, st):
+        self._stat = st
+
+    def stat(self):
+        return self._stat
+
+    def is_dir(self):
+        return stat.S_ISDIR(self._stat.st_mode)
+
+
+def builtin_cat(shell, args, stdin=None, stdout=None, stderr=None):
+    """Concatenate files to standard output; '-' or no files reads standard input.
+       Data is streamed as bytes with constant memory, in-kernel where the OS allows.
+    """
+    binary = getattr(os, 'O_BINARY', 0)
+    if stdout is None:
+        stdout = sys.stdout
+    stdout.flush()
+    out_fd = streams.stream_fd(stdout)
+
+    out_id = None
+    if out_fd is not None:
+        try:
+            out_st = os.fstat(out_fd)
+            if stat.S_ISREG(out_st.st_mode):
+                out_id = (out_st.st_dev, out_st.st_ino)
+        except OSError:
+            pass
+
+    status = 0
+    for filename in args or ['-']:
+        try:
+            if filename == '-':
+                src = stdin if stdin is not None else sys.stdin
+                src_fd = streams.stream_fd(src)
+                if src_fd is None or out_fd is None:
+                    streams.copy_stream(src, stdout)
+                else:
+                    streams.copy_fd(src_fd, out_fd)
+                continue
+
+            fd = os.open(filename, os.O_RDONLY | binary)
+            try:
+                if out_id is not None:
+                    in_st = os.fstat(fd)
+                    if (in_st.st_dev, in_st.st_ino) == out_id:
+                        print(f"cat: {filename}: input file is output file", file=stderr)
+                        status = 1
+                        continue
+                if out_fd is None:
+                    with open(fd, 'rb', closefd=False) as f:
+                        streams.copy_stream(f, stdout)
+                else:
+                    streams.copy_fd(fd, out_fd)
+            finally:
+                os.close(fd)
+        except BrokenPipeError:
+            return 141
+        except OSError as e:
+            print(f"cat: {filename}: {e.strerror}", file=stderr)
+            status = 1
+
+    return status
+
+
+def builtin_tee(shell, args, stdin=None, stdout=None, stderr=None):
+    """Copy standard input to standard output and to each file: tee [-a] [file ...]
+       Between pipes the data is fanned out in-kernel with tee(2) and splice where the OS allows.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    args = list(args)
+    while args and args[0].startswith('-') and args[0] != '-':
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if arg in ('-a', '--append'):
+            flags = (flags & ~os.O_TRUNC) | os.O_APPEND
+        else:
+            print(f"tee: {arg}: invalid option", file=stderr)
+            print("tee: usage: tee [-a] [file ...]", file=stderr)
+            return 2
+
+    status = 0
+    names = {}
+    for filename in args:
+        try:
+            names[os.open(filename, flags, 0o666)] = filename
+        except OSError as e:
+            print(f"tee: {filename}: {e.strerror}", file=stderr)
+            status = 1
+
+    if stdin is None:
+        stdin = sys.stdin
+    if stdout is None:
+        stdout = sys.stdout
+    stdout.flush()
+    in_fd = streams.stream_fd(stdin)
+    out_fd = streams.stream_fd(stdout)
+    try:
+        if in_fd is None or out_fd is None:
+            # stdout has no fd, e.g. the buffer of a $(...): copy through Python
+            import codecs
+            src = getattr(stdin, 'buffer', stdin)
+            outputs = list(names)
+            # Incremental, so a character split between two reads survives
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                data = src.read(streams.BUFFER_SIZE)
+                if not data:
+                    stdout.write(decoder.decode(b'', final=True))
+                    break
+                if isinstance(data, str):
+                    data = data.encode()
+                stdout.write(decoder.decode(data))
+                for fd in list(outputs):
+                    try:
+                        streams.write_all(fd, data)
+                    except OSError as e:
+                        print(f"tee: {names[fd]}: {e.strerror}", file=stderr)
+                        outputs.remove(fd)
+                        status = 1
+        else:
+            failed = streams.tee_fd(in_fd, [out_fd, *names])
+            for fd, e in failed.items():
+                print(f"tee: {names.get(fd, 'standard output')}: {e.strerror}", file=stderr)
+                status = 1
+    except BrokenPipeError:
+        return 141
+    finally:
+        for fd in names:
+            os.close(fd)
+    return status
+
+
+def builtin_clear(shell, args, stdin=None, stdout=None, stderr=None):
     """Clear the screen"""
     if sys.platform == 'win32':
         os.system('cls')
@@ -173,56 +532,247 @@ def builtin_clear(shell):
 def find_executable(name: str):
     """Find an executable in PATH.
        Returns the full path to the executable if found and executable, otherwise None.
+       Results are remembered in the command hash table (see `hash`).
     """
-    path_sep = ';' if sys.platform == 'win32' else ':'
-    path_dirs = os.environ.get('PATH', '').split(path_sep)
+    return command_hash.table.lookup(name)
 
-    if sys.platform == 'win32':
-        pathext = os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD')
-        exts = [e.lower() for e in pathext.split(';') if e]
-
-    for directory in path_dirs:
-        if not directory:
-            directory = os.getcwd()
-
-        cmd_path = os.path.join(directory, name)
-
-        if sys.platform == 'win32':
-            _, ext = os.path.splitext(name)
-            if ext:
-                full_path = cmd_path
-                if os.path.isfile(full_path) and os.access(full_path, os.X_OK):
-                    return full_path
-            else:
-                for e in exts:
-                    full_path = cmd_path + e
-                    if os.path.isfile(full_path) and os.access(full_path, os.X_OK):
-                        return full_path
-        else:
-            if os.path.isfile(cmd_path) and os.access(cmd_path, os.X_OK):
-                return cmd_path
 
-    return None
+KEYWORDS = ('time',) + tuple(sorted(parsing.RESERVED))
 
 
-def builtin_type(shell, args):
+def builtin_type(shell, args, stdin=None, stdout=None, stderr=None):
     """Show command type"""
     if not args:
-        print("type: usage: type command")
+        print("type: usage: type command", file=stderr)
         return 1
 
-    builtins = ['cd', 'pwd', 'echo', 'exit', 'export', 'unset', 'history', 'type', 'ls', 'cat', 'clear']
-
     for cmd in args:
-        if cmd in builtins:
-            print(f"{cmd} is a shell builtin")
+        if cmd in KEYWORDS:
+            print(f"{cmd} is a shell keyword", file=stdout)
+            continue
+        if cmd in shell.functions:
+            print(f"{cmd} is a function", file=stdout)
+            print(parsing.unparse(shell.functions[cmd]), file=stdout)
+            continue
+        if cmd in registry.table:
+            print(f"{cmd} is a shell builtin", file=stdout)
             continue
 
-        found_path = find_executable(cmd)
-        if found_path:
-            print(f"{cmd} is {found_path}")
+        hashed = command_hash.table.is_hashed(cmd)
+        found_path = command_hash.table.lookup(cmd, count_hit=False)
+        if found_path and hashed:
+            print(f"{cmd} is hashed ({found_path})", file=stdout)
+        elif found_path:
+            print(f"{cmd} is {found_path}", file=stdout)
         else:
-            print(f"{cmd}: not found")
+            print(f"{cmd}: not found", file=stderr)
             return 1
 
     return 0
+
+
+def builtin_hash(shell, args, stdin=None, stdout=None, stderr=None):
+    """Show or manage the remembered locations of commands"""
+    status = 0
+    for arg in args:
+        if arg == '-r':
+            command_hash.table.clear()
+            registry.table.rescan()
+        elif arg.startswith('-'):
+            print(f"hash: {arg}: invalid option", file=stderr)
+            print("hash: usage: hash [-r] [name ...]", file=stderr)
+            return 2
+        elif command_hash.table.lookup(arg, count_hit=False) is None:
+            print(f"hash: {arg}: not found", file=stderr)
+            status = 1
+
+    if not args:
+        entries = sorted(command_hash.table.items())
+        if not entries:
+            print("hash: hash table empty", file=stdout)
+            return 0
+        print("hits\tcommand", file=stdout)
+        for name, full_path, hits in entries:
+            print(f"{hits:4d}\t{full_path}", file=stdout)
+
+    return status
+
+
+def _find_job(shell, name, spec, stderr=None):
+    job = shell.jobs.find(spec)
+    if job is None:
+        print(f"{name}: {spec}: no such job", file=stderr)
+    return job
+
+
+def _give_terminal(pgid):
+    """Hand the controlling terminal to process group pgid, if there is one"""
+    try:
+        fd = sys.stdin.fileno()
+        if not os.isatty(fd):
+            return
+        old = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+        try:
+            os.tcsetpgrp(fd, pgid)
+        finally:
+            signal.signal(signal.SIGTTOU, old)
+    except (AttributeError, OSError, ValueError):
+        pass
+
+
+def builtin_jobs(shell, args, stdin=None, stdout=None, stderr=None):
+    """List background jobs: jobs [-l|-p] [jobspec ...]"""
+    show_pids = '-l' in args
+    pids_only = '-p' in args
+    specs = [arg for arg in args if not arg.startswith('-')]
+
+    shell.jobs.reap()
+    if specs:
+        selected = []
+        for spec in specs:
+            job = _find_job(shell, 'jobs', spec, stderr)
+            if job is None:
+                return 1
+            selected.append(job)
+    else:
+        selected = [shell.jobs.jobs[job_id] for job_id in sorted(shell.jobs.jobs)]
+
+    for job in selected:
+        if pids_only:
+            for pid in job.pids:
+                print(pid, file=stdout)
+            continue
+        line = shell.jobs.format(job)
+        if show_pids and job.pgid is not None:
+            marker = line.index(']') + 2
+            line = f"{line[:marker]} {job.pgid}{line[marker:]}"
+        print(line, file=stdout)
+        if job.state == 'Done':
+            shell.jobs.remove(job)
+    return 0
+
+
+def builtin_wait(shell, args, stdin=None, stdout=None, stderr=None):
+    """Wait for background jobs: wait [jobspec|pid ...]"""
+    if not args:
+        for job in list(shell.jobs.jobs.values()):
+            if job.state != 'Stopped':
+                job.wait()
+                shell.jobs.remove(job)
+        return 0
+
+    status = 0
+    for spec in args:
+        job = shell.jobs.find(spec)
+        if job is None:
+            print(f"wait: {spec}: no such job", file=stderr)
+            status = 127
+            continue
+        if job.state == 'Stopped':
+            status = 128 + signal.SIGTSTP
+            continue
+        status = job.wait()
+        shell.jobs.remove(job)
+    return status
+
+
+def builtin_fg(shell, args, stdin=None, stdout=None, stderr=None):
+    """Move a job to the foreground: fg [jobspec]"""
+    job = _find_job(shell, 'fg', args[0] if args else '%+', stderr)
+    if job is None:
+        return 1
+
+    print(job.command, file=stdout)
+    shell.jobs.touch(job)
+    if shell.interactive and job.pgid is not None:
+        _give_terminal(job.pgid)
+    try:
+        if job.state == 'Stopped':
+            job.signal(signal.SIGCONT)
+            job.state = 'Running'
+        status = job.wait()
+    except ProcessLookupError:
+        status = job.wait()
+    finally:
+        if shell.interactive:
+            _give_terminal(os.getpgrp())
+
+    if status is None:
+        print(f"\n{shell.jobs.format(job)}", file=stdout)
+        return 128 + signal.SIGTSTP
+    shell.jobs.remove(job)
+    return status
+
+
+def builtin_bg(shell, args, stdin=None, stdout=None, stderr=None):
+    """Resume stopped jobs in the background: bg [jobspec ...]"""
+    status = 0
+    for spec in args or ['%+']:
+        job = _find_job(shell, 'bg', spec, stderr)
+        if job is None:
+            status = 1
+            continue
+        if job.state == 'Stopped':
+            try:
+                job.signal(signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+            job.state = 'Running'
+        shell.jobs.touch(job)
+        print(f"[{job.id}]{shell.jobs.marker(job)} {job.command} &", file=stdout)
+    return status
+
+
+def _parse_signal(name):
+    if name.isdigit():
+        return int(name)
+    name = name.upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    sig = getattr(signal, name, None)
+    return int(sig) if isinstance(sig, signal.Signals) else None
+
+
+def builtin_kill(shell, args, stdin=None, stdout=None, stderr=None):
+    """Send a signal to jobs or processes: kill [-s sig | -sig] jobspec|pid ..."""
+    if not args:
+        print("kill: usage: kill [-s sigspec | -sigspec] pid | jobspec ... or kill -l", file=stderr)
+        return 2
+    if args[0] == '-l':
+        names = sorted((int(sig), sig.name) for sig in signal.Signals)
+        print('\n'.join(f"{num:2d}) {name}" for num, name in names), file=stdout)
+        return 0
+
+    sig = signal.SIGTERM
+    if args[0] == '-s' and len(args) > 1:
+        sig, args = _parse_signal(args[1]), args[2:]
+    elif args[0].startswith('-') and len(args[0]) > 1:
+        sig, args = _parse_signal(args[0][1:]), args[1:]
+    if sig is None:
+        print("kill: invalid signal specification", file=stderr)
+        return 1
+
+    status = 0
+    for target in args:
+        try:
+            if target.startswith('%'):
+                job = _find_job(shell, 'kill', target, stderr)
+                if job is None:
+                    status = 1
+                    continue
+                job.signal(sig)
+                if job.state == 'Stopped' and sig not in (signal.SIGSTOP, signal.SIGTSTP, signal.SIGCONT):
+                    job.signal(signal.SIGCONT)
+            elif target.lstrip('-').isdigit():
+                os.kill(int(target), sig)
+            else:
+                print(f"kill: {target}: arguments must be process or job IDs", file=stderr)
+                status = 1
+        except ProcessLookupError:
+            print(f"kill: ({target}) - No such process", file=stderr)
+            status = 1
+        except PermissionError:
+            print(f"kill: ({target}) - Operation not permitted", file=stderr)
+            status = 1
+    shell.jobs.reap()
+    return status
@@ -0,0 +1,117 @@
+# Client for a PyShell server (see server.py). It imports only the
+# standard library, so it starts as fast as Python itself, and passes its
+# own stdin, stdout and stderr to the worker, which writes to them directly.
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+SOCKET_VAR = 'PYSHELL_SOCKET'
+
+# A request is a length-prefixed JSON body sent together with the client's
+# fds 0, 1 and 2; the worker answers with its pid and, once the commands
+# have run, their exit status.
+HEADER = struct.Struct('!I')
+STATUS = struct.Struct('!i')
+MAX_REQUEST = 16 * 1024 * 1024
+
+USAGE = "usage: client.py [-S socket] [-c command [name [arg ...]] | script [arg ...]]"
+
+
+def default_socket_path():
+    """$PYSHELL_SOCKET, else pyshell.sock in $XDG_RUNTIME_DIR or /tmp"""
+    path = os.environ.get(SOCKET_VAR)
+    if path:
+        return path
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'pyshell.sock')
+    return f'/tmp/pyshell-{os.getuid()}.sock'
+
+
+def recv_exact(sock, size):
+    """Read exactly size bytes from sock; raise EOFError if it closes first"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def send_request(sock, request, fds=(0, 1, 2)):
+    """Send a request dict, with fds attached"""
+    body = json.dumps(request).encode()
+    data = HEADER.pack(len(body)) + body
+    sent = socket.send_fds(sock, [data], list(fds))
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def recv_request(sock):
+    """Receive a request; returns (request dict, list of fds)"""
+    data, fds, _, _ = socket.recv_fds(sock, 64 * 1024, 3)
+    try:
+        if len(data) < HEADER.size:
+            data += recv_exact(sock, HEADER.size - len(data))
+        size, = HEADER.unpack_from(data)
+        if size > MAX_REQUEST:
+            raise ValueError(f"request of {size} bytes is too large")
+        body = data[HEADER.size:]
+        if len(body) < size:
+            body += recv_exact(sock, size - len(body))
+        return json.loads(body), fds
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def run(path, argv):
+    """Run argv (as given to main.py) on the server at path; return its status"""
+    request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        send_request(sock, request)
+        pid, = STATUS.unpack(recv_exact(sock, STATUS.size))
+
+        # The worker leads its own process group; signals meant for this
+        # foreground client go to it and the commands it is running.
+        def forward(sig, frame):
+            try:
+                os.killpg(pid, sig)
+            except OSError:
+                pass
+        for sig in (signal.SIGINT, signal.SIGQUIT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(sig, forward)
+
+        status, = STATUS.unpack(recv_exact(sock, STATUS.size))
+        return status
+
+
+def main(argv):
+    path = default_socket_path()
+    if argv[:1] == ['-S']:
+        if len(argv) < 2:
+            print(f"client: -S: option requires an argument\n{USAGE}", file=sys.stderr)
+            return 2
+        path, argv = argv[1], argv[2:]
+    if argv[:1] == ['-c'] and len(argv) < 2:
+        print(f"client: -c: option requires an argument\n{USAGE}", file=sys.stderr)
+        return 2
+    if argv[:1] in (['-h'], ['--help']):
+        print(USAGE)
+        return 0
+    try:
+        return run(path, argv)
+    except (OSError, EOFError) as e:
+        print(f"client: {path}: {e.strerror if isinstance(e, OSError) and e.strerror else e}",
+              file=sys.stderr)
+        return 126
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
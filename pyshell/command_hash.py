@@ -0,0 +1,137 @@
+import os
+import sys
+
+
+def path_dirs():
+    """Return the directories listed in PATH, in search order"""
+    path_sep = ';' if sys.platform == 'win32' else ':'
+    return os.environ.get('PATH', '').split(path_sep)
+
+
+def _dir_mtime(directory):
+    try:
+        return os.stat(directory or os.getcwd()).st_mtime_ns
+    except OSError:
+        return None
+
+
+def search_path(name: str, dirs):
+    """Search dirs for an executable called name.
+       Returns (full_path, index of the directory it was found in), or (None, -1).
+    """
+    if sys.platform == 'win32':
+        pathext = os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD')
+        exts = [e.lower() for e in pathext.split(';') if e]
+
+    for index, directory in enumerate(dirs):
+        if not directory:
+            directory = os.getcwd()
+
+        cmd_path = os.path.join(directory, name)
+
+        if sys.platform == 'win32':
+            _, ext = os.path.splitext(name)
+            if ext:
+                full_path = cmd_path
+                if os.path.isfile(full_path) and os.access(full_path, os.X_OK):
+                    return full_path, index
+            else:
+                for e in exts:
+                    full_path = cmd_path + e
+                    if os.path.isfile(full_path) and os.access(full_path, os.X_OK):
+                        return full_path, index
+        else:
+            if os.path.isfile(cmd_path) and os.access(cmd_path, os.X_OK):
+                return cmd_path, index
+
+    return None, -1
+
+
+class CommandHash:
+    """Remembered command locations, like the bash `hash` table.
+
+    The table is dropped when PATH changes. A hit costs no system calls:
+    the directories up to and including the one holding a command are
+    re-stat'ed at most once between calls to expire(), which the
+    interactive shell makes before each prompt. If any of their mtimes
+    moved (a command was added, removed or shadowed) the table is dropped
+    and the lookup falls back to a full PATH search. A hashed command
+    that has gone is searched for again with rehash().
+    """
+
+    def __init__(self):
+        self._path = None
+        self._dirs = []
+        self._mtimes = {}
+        self._checked = -1  # directories up to this index were checked since expire()
+        self._entries = {}  # name -> [full_path, dir_index, hits]
+
+    def clear(self):
+        self._entries.clear()
+        self._mtimes.clear()
+        self._checked = -1
+
+    def expire(self):
+        """Have the next lookups check the hashed directories again"""
+        self._checked = -1
+
+    def _check_path(self):
+        path = os.environ.get('PATH', '')
+        if path != self._path:
+            self._path = path
+            self._dirs = path_dirs()
+            self.clear()
+
+    def _dirs_unchanged(self, upto):
+        if upto <= self._checked:
+            return True
+        for directory in self._dirs[self._checked + 1:upto + 1]:
+            if _dir_mtime(directory) != self._mtimes.get(directory):
+                return False
+        self._checked = upto
+        return True
+
+    def lookup(self, name: str, count_hit=True):
+        """Return the full path of name, consulting the table first"""
+        self._check_path()
+
+        entry = self._entries.get(name)
+        if entry is not None:
+            if self._dirs_unchanged(entry[1]):
+                if count_hit:
+                    entry[2] += 1
+                return entry[0]
+            self.clear()
+
+        full_path, index = search_path(name, self._dirs)
+        if full_path is None:
+            return None
+
+        if os.sep not in name and (os.altsep is None or os.altsep not in name):
+            for directory in self._dirs[:index + 1]:
+                if directory not in self._mtimes:
+                    self._mtimes[directory] = _dir_mtime(directory)
+            self._entries[name] = [full_path, index, 1 if count_hit else 0]
+        return full_path
+
+    def rehash(self, name: str):
+        """Forget name and search PATH for it again, for a hashed location
+        that could not be executed; returns the new full path or None"""
+        old = self._entries.pop(name, None)
+        if old is None:
+            return None
+        full_path = self.lookup(name)
+        return full_path if full_path != old[0] else None
+
+    def is_hashed(self, name: str):
+        self._check_path()
+        return name in self._entries
+
+    def items(self):
+        """Yield (name, full_path, hits) for every remembered command"""
+        self._check_path()
+        for name, (full_path, _, hits) in self._entries.items():
+            yield name, full_path, hits
+
+
+table = CommandHash()
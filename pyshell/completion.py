@@ -1,13 +1,20 @@
 import os
 import sys
-from .readline_setup import readline
+import bisect
+import threading
+from . import command_hash
+from . import readline_setup
+from . import registry
+
+# Reserved words that can start a command
+COMPLETED_KEYWORDS = ('case', 'for', 'function', 'if', 'time', 'until', 'while')
 
 
 def completer(shell, text, state):
     """Tab completion for commands and files; designed to be called by readline."""
     if state == 0:
         try:
-            begin_idx = readline.get_begidx()
+            begin_idx = readline_setup.readline.get_begidx()
         except Exception:
             begin_idx = 0
 
@@ -24,30 +31,99 @@ def completer(shell, text, state):
     return None
 
 
+class CommandIndex:
+    """Sorted, prefix-searchable index of the executables found in PATH.
+
+    Each PATH directory is scanned once and remembered together with its
+    mtime; `refresh` only rescans directories whose mtime changed, and
+    `matches` bisects into the merged name list, so a lookup costs time
+    proportional to the number of matches rather than the size of PATH.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._dirs = {}  # directory -> (mtime_ns, set of names)
+        self._names = []
+
+    @staticmethod
+    def _scan(directory):
+        names = set()
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                f = entry.name
+                if sys.platform == 'win32':
+                    if any(f.lower().endswith(ext) for ext in ['.exe', '.bat', '.cmd', '.com']):
+                        name = os.path.splitext(f)[0] if f.lower().endswith('.exe') else f
+                        names.add(name)
+                elif os.access(entry.path, os.X_OK):
+                    names.add(f)
+        return names
+
+    def refresh(self):
+        """Rescan PATH directories that are new or whose mtime changed"""
+        with self._lock:
+            path = os.environ.get('PATH', '')
+            dirs = [d for d in command_hash.path_dirs() if d]
+            changed = path != self._path
+
+            cached = {}
+            for directory in dirs:
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+                old = self._dirs.get(directory)
+                if old is not None and old[0] == mtime:
+                    cached[directory] = old
+                    continue
+                try:
+                    cached[directory] = (mtime, self._scan(directory))
+                except OSError:
+                    continue
+                changed = True
+
+            if changed or len(cached) != len(self._dirs):
+                names = set()
+                for _, dir_names in cached.values():
+                    names.update(dir_names)
+                self._names = sorted(names)
+            self._dirs = cached
+            self._path = path
+
+    def matches(self, prefix):
+        """Return the sorted indexed names starting with prefix"""
+        names = self._names
+        i = bisect.bisect_left(names, prefix)
+        result = []
+        while i < len(names) and names[i].startswith(prefix):
+            result.append(names[i])
+            i += 1
+        return result
+
+    def warm(self):
+        """Build the index in a background thread"""
+        thread = threading.Thread(target=self.refresh, name='pyshell-command-index', daemon=True)
+        thread.start()
+        return thread
+
+
+index = CommandIndex()
+
+
 def complete_command(shell, text):
     """Complete command names"""
-    builtins = ['cd', 'pwd', 'echo', 'exit', 'export', 'unset', 'history', 'type', 'ls', 'cat', 'clear']
-
-    commands = set(builtins)
-    path_sep = ';' if sys.platform == 'win32' else ':'
-    path_dirs = os.environ.get('PATH', '').split(path_sep)
-
-    for directory in path_dirs:
-        if os.path.isdir(directory):
-            try:
-                for f in os.listdir(directory):
-                    full_path = os.path.join(directory, f)
-                    if os.path.isfile(full_path):
-                        if sys.platform == 'win32':
-                            if any(f.lower().endswith(ext) for ext in ['.exe', '.bat', '.cmd', '.com']):
-                                name = os.path.splitext(f)[0] if f.lower().endswith('.exe') else f
-                                commands.add(name)
-                        elif os.access(full_path, os.X_OK):
-                            commands.add(f)
-            except Exception:
-                pass
-
-    return sorted([cmd for cmd in commands if cmd.startswith(text)])
+    index.refresh()
+    commands = set(index.matches(text))
+    commands.update(b for b in registry.table.names() if b.startswith(text))
+    commands.update(k for k in COMPLETED_KEYWORDS if k.startswith(text))
+    commands.update(f for f in getattr(shell, 'functions', ()) if f.startswith(text))
+    return sorted(commands)
 
 
 def complete_path(text):
@@ -1,44 +1,56 @@
-import subprocess
+import io
+import os
+import signal
+import sys
+import threading
+from functools import partial
 from . import parsing
 from . import builtins
+from . import command_hash
+from . import jobs
+from . import redirection
+from . import registry
+from . import spawn
+from . import streams
 
 
-def execute_external(shell, tokens, stdin_redir, stdout_redir, stderr_redir, append):
-    """Execute external command with redirections"""
-    stdin = None
-    stdout = None
-    stderr = None
-    
-    if not tokens:
-        return 1
+class Errexit(Exception):
+    """Raised when a command fails under `set -e`, to stop the shell"""
 
-    prog = tokens[0]
-    full_path = builtins.find_executable(prog)
-    if full_path is None:
-        print(f"{prog}: command not found")
-        return 127
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
 
-    tokens = [full_path] + tokens[1:]
 
-    try:
-        if stdin_redir:
-            stdin = open(stdin_redir, 'r')
+def execute_external(shell, tokens, redirects=(), assignments=()):
+    """Execute an external command with its redirections.
 
-        if stdout_redir:
-            mode = 'a' if append else 'w'
-            stdout = open(stdout_redir, mode)
+    assignments are NAME=value pairs written before the command, which go
+    into its environment only.
+    """
+    if not tokens:
+        return 1
 
-        if stderr_redir:
-            stderr = open(stderr_redir, 'w')
+    redirections = None
+    if redirects:
+        redirections = _resolve(shell, redirects)
+        if redirections is None:
+            return 1
 
-        result = subprocess.run(
-            tokens,
-            stdin=stdin,
-            stdout=stdout,
-            stderr=stderr
-        )
+    try:
+        prog = tokens[0]
+        full_path = builtins.find_executable(prog)
+        if full_path is None:
+            print(f"{prog}: command not found")
+            return 127
 
-        return result.returncode
+        sys.stdout.flush()
+        proc = _spawn_hashed(tokens, full_path,
+                             env=shell.variables.environ(assignments),
+                             fds=redirections.fds if redirections is not None else None)
+        status = spawn.exit_status(proc.wait())
+        _note_rusage(shell, proc)
+        return status
 
     except FileNotFoundError:
         print(f"{tokens[0]}: command not found")
@@ -47,131 +59,835 @@ def execute_external(shell, tokens, stdin_redir, stdout_redir, stderr_redir, app
         print(f"Error: {e}")
         return 1
     finally:
-        if stdin:
-            stdin.close()
-        if stdout:
-            stdout.close()
-        if stderr:
-            stderr.close()
+        if redirections is not None:
+            redirections.close()
 
 
-def execute_command(shell, cmd_line):
-    """Execute a single command with redirections and builtins"""
-    tokens = parsing.tokenize(cmd_line)
-    if not tokens:
-        return 0
+def _spawn_hashed(tokens, full_path, **kwargs):
+    """spawn.spawn() tokens with the program at full_path. If that has gone
+    since it was hashed, search PATH again, as bash does, and spawn what
+    is found there instead."""
+    try:
+        return spawn.spawn([full_path] + tokens[1:], **kwargs)
+    except FileNotFoundError:
+        full_path = command_hash.table.rehash(tokens[0])
+        if full_path is None:
+            raise
+        return spawn.spawn([full_path] + tokens[1:], **kwargs)
 
-    clean_tokens = []
-    for token in tokens:
-        if token.startswith('#'):
-            break
-        clean_tokens.append(token)
 
-    if not clean_tokens:
+def execute_line(shell, line):
+    """Parse and execute one or more complete command lines"""
+    try:
+        node = parsing.parse(line)
+    except parsing.ParseError as e:
+        print(f"Syntax error: {e}")
+        return 2
+
+    if node is None:
         return 0
+    return execute_node(shell, node)
+
+
+def execute_node(shell, node):
+    """Execute a parsed AST node and return its exit status.
+
+    Nodes come from the parse cache and are never modified, so a loop body
+    or function is walked as it is on every run, without re-parsing.
+    """
+    return _EXECUTORS[node.__class__](shell, node)
+
+
+def _interrupted(shell, status):
+    """Abandon the command list when an interactive child died of ^C"""
+    if status == 128 + signal.SIGINT and shell.interactive:
+        raise KeyboardInterrupt
+
+
+def _condition(shell, node):
+    """Run node as a condition, which `set -e` does not stop the shell for"""
+    shell.condition_depth += 1
+    try:
+        return execute_node(shell, node)
+    finally:
+        shell.condition_depth -= 1
+
+
+def _execute_pipeline(shell, pipeline):
+    if pipeline.background:
+        status = run_background(shell, pipeline)
+    elif pipeline.timed is not None:
+        status = run_timed(shell, pipeline)
+    else:
+        status = run_pipeline(shell, pipeline)
+    if pipeline.negated:
+        status = 0 if status else 1
+    shell.last_exit_code = status
+    if status and not pipeline.negated and not shell.condition_depth and shell.options.get('errexit'):
+        raise Errexit(status)
+    return status
+
+
+def _execute_and_or(shell, node):
+    # Only the last pipeline of `a && b || c` can stop the shell under set -e
+    status = _condition(shell, node.first)
+    last = len(node.rest) - 1
+    for i, (op, pipeline) in enumerate(node.rest):
+        if (status == 0) != (op == '&&'):
+            continue
+        status = execute_node(shell, pipeline) if i == last else _condition(shell, pipeline)
+    shell.last_exit_code = status
+    return status
+
+
+def _execute_sequence(shell, node):
+    status = 0
+    for item in node.items:
+        status = execute_node(shell, item)
+        _interrupted(shell, status)
+    return status
+
+
+def _execute_if(shell, node):
+    for condition, body in node.clauses:
+        if _condition(shell, condition) == 0:
+            return execute_node(shell, body)
+    if node.else_body is not None:
+        return execute_node(shell, node.else_body)
+    return 0
+
+
+def _run_loop_body(shell, body):
+    """Run one iteration; return (status, False to leave the loop)"""
+    try:
+        status = execute_node(shell, body)
+    except builtins.LoopControl as e:
+        if e.count > 1:
+            e.count -= 1
+            raise
+        return 0, e.kind == 'continue'
+    _interrupted(shell, status)
+    return status, True
+
+
+def _execute_for(shell, node):
+    if node.words is None:
+        values = shell.argv[1:]
+    else:
+        try:
+            values = parsing.expand_words(node.words, shell)
+        except parsing.ExpansionError as e:
+            print(f"pyshell: {e}")
+            return 2
+
+    status = 0
+    shell.loop_depth += 1
+    try:
+        for value in values:
+            shell.variables.set(node.name, value)
+            status, again = _run_loop_body(shell, node.body)
+            if not again:
+                break
+    finally:
+        shell.loop_depth -= 1
+    return status
+
+
+def _execute_while(shell, node):
+    status = 0
+    shell.loop_depth += 1
+    try:
+        while True:
+            try:
+                failed = _condition(shell, node.condition) != 0
+            except builtins.LoopControl as e:
+                if e.count > 1:
+                    e.count -= 1
+                    raise
+                if e.kind == 'break':
+                    break
+                continue
+            if failed != node.until:
+                break
+            status, again = _run_loop_body(shell, node.body)
+            if not again:
+                break
+    finally:
+        shell.loop_depth -= 1
+    return status
+
+
+def _execute_case(shell, node):
+    try:
+        word = parsing.expand_word(node.word, shell)
+        for patterns, body in node.items:
+            for pattern in patterns:
+                if parsing.fnmatchcase(word, parsing.expand_pattern(pattern, shell)):
+                    return 0 if body is None else execute_node(shell, body)
+    except parsing.ExpansionError as e:
+        print(f"pyshell: {e}")
+        return 2
+    return 0
+
+
+def _execute_group(shell, node):
+    if not node.subshell:
+        return execute_node(shell, node.body)
+    proc = fork_subshell(shell, partial(execute_node, shell, node.body))
+    status = spawn.exit_status(proc.wait())
+    _note_rusage(shell, proc)
+    return status
+
+
+def _execute_function(shell, node):
+    shell.functions[node.name] = node
+    return 0
+
+
+def call_function(shell, name, args):
+    """Run the shell function name with args as its positional parameters"""
+    function = shell.functions[name]
+    saved_argv = shell.argv
+    saved_loops = shell.loop_depth
+    shell.argv = [saved_argv[0]] + list(args)
+    shell.loop_depth = 0
+    shell.function_depth += 1
+    try:
+        return execute_node(shell, function.body)
+    except builtins.FunctionReturn as e:
+        return e.status
+    except RecursionError:
+        print(f"{name}: maximum function nesting level exceeded")
+        return 1
+    finally:
+        shell.function_depth -= 1
+        shell.loop_depth = saved_loops
+        shell.argv = saved_argv
 
-    tokens = parsing.expand_variables(clean_tokens, shell)
-    tokens, stdin_redir, stdout_redir, stderr_redir, append = parsing.parse_redirections(tokens)
 
-    if tokens is None:
+def _resolve(shell, redirects, base=None, owned=()):
+    """redirection.resolve(), printing the error and returning None if it fails"""
+    try:
+        return redirection.resolve(redirects, shell, base, owned)
+    except (redirection.RedirectionError, parsing.ExpansionError) as e:
+        print(f"pyshell: {e}")
+        return None
+
+
+def _redirect_shell(shell, redirects):
+    """Apply redirects to the shell's own fds, for builtins, functions and
+    compound commands, whose commands all inherit them. Returns what
+    redirection.restore() needs to undo it, or None if they failed."""
+    redirections = _resolve(shell, redirects)
+    if redirections is None:
+        return None
+    try:
+        return redirection.redirect_shell(redirections)
+    finally:
+        redirections.close()
+
+
+def _execute_redirected(shell, node):
+    saved = _redirect_shell(shell, node.redirects)
+    if saved is None:
         return 1
+    try:
+        return execute_node(shell, node.node)
+    finally:
+        redirection.restore(saved)
+
+
+def fork_subshell(shell, run, stdin=None, stdout=None, stderr=None, pgroup=None, fds=None):
+    """Run run() in a forked copy of the shell; return the child as a spawn.Process.
+
+    stdin/stdout/stderr are fds to install in the child (None inherits)
+    and fds a further map as for spawn.spawn(); the caller keeps ownership
+    of them all. pgroup is as for spawn.spawn().
+    The child exits with run()'s status and never returns.
+    """
+    mapping = {target: fd for target, fd in enumerate((stdin, stdout, stderr)) if fd is not None}
+    if fds:
+        mapping.update(fds)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        if pgroup is not None:
+            try:
+                os.setpgid(pid, pgroup or pid)
+            except OSError:
+                pass
+        return spawn.Process(pid)
+
+    status = 1
+    try:
+        if pgroup is not None:
+            try:
+                os.setpgid(0, pgroup)
+            except OSError:
+                pass
+        redirection.apply(mapping)
+        # Drop the pipe ends the shell and its builtin threads hold, so
+        # readers downstream of this child still see EOF.
+        for fd in range(3, redirection.FIRST_PRIVATE_FD):
+            if fd not in mapping:
+                _close_fd(fd)
+        os.closerange(redirection.FIRST_PRIVATE_FD, _MAX_FD)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if hasattr(signal, 'SIGCHLD'):
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        shell.interactive = False
+        shell.jobs = shell.jobs.inherited()
+        status = run()
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else (e.code is not None)
+    except Errexit as e:
+        status = e.status
+    except builtins.FunctionReturn as e:
+        status = e.status
+    except builtins.LoopControl:
+        status = 0
+    except KeyboardInterrupt:
+        status = 128 + signal.SIGINT
+    except BaseException as e:
+        print(f"Error: {e}")
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(status & 0xff)
+
+
+try:
+    _MAX_FD = os.sysconf('SC_OPEN_MAX')
+except (AttributeError, ValueError, OSError):
+    _MAX_FD = 256
+
+
+def _note_rusage(shell, proc):
+    """Hand a reaped child's rusage to the running `time`, if any"""
+    timer = getattr(shell, 'timer', None)
+    if timer is not None:
+        timer.add_child(getattr(proc, 'rusage', None))
+
+
+def run_timed(shell, pipeline):
+    """Run a pipeline prefixed with the `time` keyword and report its cost"""
+    options = pipeline.timed
+    command = parsing.unparse(pipeline._replace(timed=None, negated=False))
+
+    from . import timing
+
+    outer = getattr(shell, 'timer', None)
+    shell.timer = timing.Timer()
+    try:
+        status = run_pipeline(shell, pipeline._replace(timed=None)) if pipeline.commands else 0
+        report = shell.timer.stop(command, status)
+    finally:
+        if outer is not None:
+            outer.children.extend(shell.timer.children)
+        shell.timer = outer
+
+    text = timing.render(report, options, shell.variables.get('TIMEFORMAT'))
+    if text is None:
+        return status
+    if '-o' in options:
+        path = options[options.index('-o') + 1]
+        try:
+            with open(path, 'a') as f:
+                f.write(text + '\n')
+        except OSError as e:
+            print(f"time: {path}: {e.strerror}")
+    else:
+        sys.stdout.flush()
+        print(text, file=sys.stderr)
+    return status
+
+
+def execute_command(shell, cmd_line):
+    """Execute a single command line with redirections and builtins"""
+    return execute_line(shell, cmd_line)
+
+
+def _expand_command(shell, command):
+    """Expand a Command node to (tokens, redirects, assignments), or None on
+    error. Redirection targets are expanded when they are performed."""
+    try:
+        assignments, words = parsing.split_assignments(command.words, shell)
+        tokens = parsing.expand_words(words, shell)
+    except parsing.ExpansionError as e:
+        print(f"pyshell: {e}")
+        return None
+    return tokens, command.redirects, assignments
+
+
+def _expand_stage(shell, node):
+    """Expand a pipeline stage: a Command as for _expand_command, while a
+    compound command is passed through to run in a subshell"""
+    if node.__class__ is parsing.Command:
+        return _expand_command(shell, node)
+    return node
+
+
+def run_command(shell, command):
+    """Execute a parsed Command"""
+    shell.substitution_status = 0
+    expanded = _expand_command(shell, command)
+    if expanded is None:
+        return 2
+    tokens, redirects, assignments = expanded
 
     if not tokens:
-        return 0
+        if redirects:
+            # `> file` alone creates or truncates file
+            redirections = _resolve(shell, redirects)
+            if redirections is None:
+                return 1
+            redirections.close()
+        for name, value in assignments:
+            shell.variables.set(name, value)
+        # `x=$(cmd)` has the status of cmd
+        return shell.substitution_status
+    return run_expanded(shell, tokens, redirects, assignments)
+
+
+def run_expanded(shell, tokens, redirects=(), assignments=()):
+    """Run an expanded command: a function, a builtin or an external program.
+
+    Functions and builtins run in the shell, with redirects applied to the
+    shell's own fds for their duration; external programs get them as the
+    fds they are spawned with.
+    """
+    cmd = tokens[0]
+    if cmd not in shell.functions and cmd not in registry.table:
+        return execute_external(shell, tokens, redirects, assignments)
+    if not redirects:
+        return run_builtin(shell, tokens)
+    saved = _redirect_shell(shell, redirects)
+    if saved is None:
+        return 1
+    try:
+        return run_builtin(shell, tokens)
+    finally:
+        redirection.restore(saved)
+
 
+def run_builtin(shell, tokens):
+    """Run a function or builtin in the shell process.
+
+    Builtin output goes through a buffered streams.OutputSink on fd 1,
+    so it reaches files and pipes in large writes.
+    """
     cmd = tokens[0]
     args = tokens[1:]
 
-    if cmd == 'exit':
-        exit_code = int(args[0]) if args else 0
-        raise SystemExit(exit_code)
-    elif cmd == 'cd':
-        return builtins.builtin_cd(shell, args)
-    elif cmd == 'pwd':
-        return builtins.builtin_pwd(shell)
-    elif cmd == 'echo':
-        return builtins.builtin_echo(shell, args, stdout_redir, append)
-    elif cmd == 'export':
-        return builtins.builtin_export(shell, args)
-    elif cmd == 'unset':
-        return builtins.builtin_unset(shell, args)
-    elif cmd == 'history':
-        return builtins.builtin_history(shell)
-    elif cmd == 'type':
-        return builtins.builtin_type(shell, args)
-    elif cmd == 'ls':
-        return builtins.builtin_ls(shell, args, stdout_redir, append)
-    elif cmd == 'cat':
-        return builtins.builtin_cat(shell, args, stdout_redir, append)
-    elif cmd == 'clear':
-        return builtins.builtin_clear(shell)
-
-    return execute_external(shell, tokens, stdin_redir, stdout_redir, stderr_redir, append)
+    if cmd in shell.functions:
+        return call_function(shell, cmd, args)
+
+    builtin = registry.table.get(cmd)
+    sys.stdout.flush()
+    stdout = streams.OutputSink(1)
+    try:
+        status = builtin(shell, args, stdout=stdout)
+        stdout.flush()
+    except registry.BuiltinLoadError as e:
+        print(f"pyshell: {e}", file=sys.stderr)
+        return 126
+    except BrokenPipeError:
+        return 141
+    except OSError as e:
+        print(f"pyshell: {cmd}: write error: {e.strerror}", file=sys.stderr)
+        return 1
+    return status
+
+
+def _stage_builtin(shell, tokens):
+    """Return the Builtin that runs tokens as a pipeline stage on a thread,
+    or None when it must be forked or spawned"""
+    if tokens[0] in shell.functions:
+        return None
+    builtin = registry.table.get(tokens[0])
+    try:
+        return builtin if builtin is not None and builtin.stage else None
+    except registry.BuiltinLoadError:
+        return None
+
+
+class BuiltinStage(threading.Thread):
+    """A builtin running on a thread as one stage of a pipeline.
+
+    The stage reads and writes the sources its Redirections give fds 0
+    and 1, with output through a buffered streams.OutputSink, and closes
+    the Redirections when the builtin returns, so the next stage sees EOF
+    exactly as it would from a process.
+    """
+
+    def __init__(self, shell, builtin, args, redirections):
+        super().__init__(name=f'pyshell-{builtin.name}', daemon=True)
+        self.shell = shell
+        self.builtin = builtin
+        self.args = args
+        self.redirections = redirections
+        self.returncode = None
+
+    def run(self):
+        stdin_fd = self.redirections.source(0)
+        stdin = open(stdin_fd, 'r', closefd=False) if stdin_fd is not None else None
+        stdout = streams.OutputSink(self.redirections.source(1))
+        stderr_fd = self.redirections.source(2)
+        stderr = streams.OutputSink(stderr_fd) if stderr_fd not in (None, 2) else None
+        try:
+            self.returncode = self.builtin(self.shell, self.args, stdin=stdin,
+                                           stdout=stdout, stderr=stderr)
+            stdout.flush()
+        except BrokenPipeError:
+            self.returncode = 141
+        except Exception as e:
+            print(f"{self.builtin.name}: {e}", file=sys.stderr)
+            self.returncode = 1
+        finally:
+            if stderr is not None:
+                try:
+                    stderr.flush()
+                except OSError:
+                    pass
+            if stdin is not None:
+                try:
+                    stdin.close()
+                except OSError:
+                    pass
+            self.redirections.close()
+
+    def wait(self):
+        self.join()
+        return self.returncode
+
+
+def _close_fd(fd):
+    if fd is not None:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
 
 
 def execute_pipeline(shell, commands):
-    """Execute a pipeline of commands"""
-    if len(commands) == 1:
-        return execute_command(shell, commands[0])
+    """Execute a pipeline given as a list of command strings"""
+    return execute_line(shell, ' | '.join(commands))
+
+
+def run_pipeline(shell, pipeline):
+    """Execute a parsed Pipeline and record PIPESTATUS.
+
+    Stages are connected with explicit pipes. Builtins listed in
+    stage builtins run in-process on a thread, compound commands and
+    functions in a forked subshell, and everything else is spawned.
+    A pipeline of one stage runs in the shell itself.
+    With `set -o pipefail` the status is that of the last stage to fail.
+    """
+    if len(pipeline.commands) == 1:
+        command = pipeline.commands[0]
+        if command.__class__ is parsing.Command:
+            status = run_command(shell, command)
+        else:
+            status = execute_node(shell, command)
+        shell.pipestatus = [status]
+        return status
+
+    parsed = []
+    for command in pipeline.commands:
+        expanded = _expand_stage(shell, command)
+        if expanded is None:
+            shell.pipestatus = [2]
+            return 2
+        parsed.append(expanded)
+
+    statuses = _wait_stages(shell, _start_stages(shell, parsed))
+    shell.pipestatus = statuses
+    return _pipeline_status(shell, statuses)
+
+
+def _pipeline_status(shell, statuses):
+    if shell.options.get('pipefail'):
+        for status in reversed(statuses):
+            if status:
+                return status
+        return 0
+    return statuses[-1]
 
-    processes = []
 
-    for i, cmd in enumerate(commands):
-        tokens = parsing.tokenize(cmd)
-        if not tokens:
-            return 1
+def _is_plain(node):
+    """Whether node is a pipeline that _start_stages can run as it is"""
+    return (node.__class__ is parsing.Pipeline and not node.background
+            and node.timed is None and not node.negated)
 
-        clean_tokens = []
-        for token in tokens:
-            if token.startswith('#'):
-                break
-            clean_tokens.append(token)
 
-        if not clean_tokens:
-            return 1
+def run_captured(shell, node, stdin_fd=None, stdout_fd=None, stderr_fd=None):
+    """Run a parsed node with its ends attached to the given fds.
 
-        tokens = parsing.expand_variables(clean_tokens, shell)
-        tokens, stdin_r, stdout_r, stderr_r, append = parsing.parse_redirections(tokens)
+    Every stage of a pipeline is started through the pipeline machinery,
+    builtins included, and any other node runs in a subshell, so this is
+    safe to call from worker threads. The caller keeps ownership of the
+    fds; shell state such as PIPESTATUS is left untouched.
+    """
+    if not _is_plain(node):
+        proc = fork_subshell(shell, partial(execute_node, shell, node), stdin_fd, stdout_fd, stderr_fd)
+        return spawn.exit_status(proc.wait())
 
-        if tokens is None:
-            return 1
-        
-        if i == 0:
-            stdin = subprocess.PIPE if stdin_r else None
-        else:
-            stdin = processes[i - 1].stdout
-        
-        if i == len(commands) - 1:
-            stdout = subprocess.PIPE if stdout_r else None
-        else:
-            stdout = subprocess.PIPE
+    parsed = []
+    for command in node.commands:
+        expanded = _expand_stage(shell, command)
+        if expanded is None:
+            return 2
+        parsed.append(expanded)
+
+    stages = _start_stages(shell, parsed, stdin=stdin_fd, stdout=stdout_fd, stderr=stderr_fd)
+    return _pipeline_status(shell, _wait_stages(shell, stages))
+
+
+def start_command(shell, tokens, stdin=None, stdout=None, stderr=None):
+    """Start an expanded command the way a pipeline stage is started, with
+    its ends on the given fds (None inherits the shell's own), which the
+    caller keeps. Returns a function that waits for the command and returns
+    its exit status."""
+    stages = _start_stages(shell, [(tokens, (), ())], stdin=stdin, stdout=stdout, stderr=stderr)
+    return lambda: _wait_stages(shell, stages)[0]
 
-        try:
-            prog = tokens[0]
-            full_path = builtins.find_executable(prog)
-            if full_path is None:
-                print(f"{prog}: command not found")
-                return 127
-            tokens = [full_path] + tokens[1:]
-
-            proc = subprocess.Popen(
-                tokens,
-                stdin=stdin,
-                stdout=stdout,
-                stderr=subprocess.PIPE
-            )
-            processes.append(proc)
-
-            if i > 0:
-                processes[i - 1].stdout.close()
-        except FileNotFoundError:
-            print(f"{tokens[0]}: command not found")
-            return 127
-        except Exception as e:
-            print(f"Error: {e}")
-            return 1
 
-    for proc in processes:
-        proc.wait()
+def command_substitution(shell, text):
+    """Run the commands in text for $(...) and return their output with
+    trailing newlines removed; the status goes to shell.substitution_status.
+
+    A lone stage builtin runs in-process and writes straight
+    into a buffer, without a fork or a pipe. Anything else runs through the
+    pipeline machinery with stdout on a pipe that is drained as it fills,
+    so only the final value is held in memory. Lists and compound
+    commands run in a subshell writing to the pipe.
+    """
+    try:
+        node = parsing.parse(text)
+    except parsing.ParseError as e:
+        print(f"Syntax error: {e}")
+        shell.substitution_status = 2
+        return ''
+    if node is None:
+        return ''
+
+    parsed = []
+    for command in node.commands if _is_plain(node) else ():
+        expanded = _expand_stage(shell, command)
+        if expanded is None:
+            shell.substitution_status = 2
+            return ''
+        parsed.append(expanded)
+
+    if len(parsed) == 1 and parsed[0].__class__ is tuple:
+        tokens, redirects, _ = parsed[0]
+        builtin = _stage_builtin(shell, tokens) if tokens and not redirects else None
+        if builtin is not None:
+            buffer = io.StringIO()
+            try:
+                status = builtin(shell, tokens[1:], stdout=buffer)
+            except Exception as e:
+                print(f"{tokens[0]}: {e}", file=sys.stderr)
+                status = 1
+            shell.substitution_status = status
+            return buffer.getvalue().rstrip('\n')
+
+    read_fd, write_fd = os.pipe()
+    try:
+        if parsed:
+            stages = _start_stages(shell, parsed, stdout=write_fd)
+        else:
+            stages = [fork_subshell(shell, partial(execute_node, shell, node), stdout=write_fd)]
+    finally:
+        os.close(write_fd)
 
-    return processes[-1].returncode
+    chunks = []
+    try:
+        while True:
+            data = os.read(read_fd, streams.BUFFER_SIZE)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        os.close(read_fd)
+    shell.substitution_status = _pipeline_status(shell, _wait_stages(shell, stages))
+    return b''.join(chunks).decode(errors='replace').rstrip('\n')
+
+
+def run_background(shell, pipeline):
+    """Start a parsed Pipeline as a background job and return at once"""
+    parsed = []
+    for command in pipeline.commands:
+        expanded = _expand_stage(shell, command)
+        if expanded is None:
+            return 2
+        parsed.append(expanded)
+
+    stages = _start_stages(shell, parsed, background=True)
+    pids = [stage.pid for stage in stages if hasattr(stage, 'pid')]
+    command = parsing.unparse(pipeline._replace(background=False))
+
+    job = shell.jobs.add(stages, command, pids[0] if pids else None)
+    if pids:
+        shell.last_background_pid = pids[-1]
+    if shell.interactive:
+        print(f"[{job.id}] {pids[-1] if pids else ''}".rstrip())
+    return 0
+
+
+def _start_stages(shell, parsed, background=False, stdin=None, stdout=None, stderr=None):
+    """Start every stage of a pipeline.
+
+    stdin/stdout are fds for the two ends of the pipeline and stderr an fd
+    for every stage; None inherits the shell's own. Each stage gets its own
+    duplicates of them, so the caller keeps ownership and may close them as
+    soon as this returns, while builtin stages are still running. Each
+    stage's own redirections are applied on top. Background pipelines get
+    their own process group; without a terminal to arbitrate, their first
+    stage reads from the null device. With `set -o bigpipe` the pipes
+    between stages are grown to the system's maximum pipe size.
+    parsed holds _expand_stage results: expanded Commands, and compound
+    commands that run in a forked subshell.
+    Returns a list holding a BuiltinStage, a spawned process, or an int exit
+    status for a stage that could not be started.
+    """
+    stages = []
+    sys.stdout.flush()
+    pgid = None
+    prev_read = None
+    pipe_size = streams.pipe_max_size() if shell.options.get('bigpipe') else 0
+    try:
+        for i, stage in enumerate(parsed):
+            last = i == len(parsed) - 1
+            if stage.__class__ is tuple:
+                tokens, redirects, assignments = stage
+            else:
+                tokens, redirects, assignments = None, (), ()
+
+            # The fds the pipeline gives this stage, before its own redirections
+            base = {}
+            owned = []
+            if prev_read is not None:
+                base[0] = prev_read
+                owned.append(prev_read)
+                prev_read = None
+            elif i == 0 and stdin is not None:
+                base[0] = os.dup(stdin)
+                owned.append(base[0])
+            elif i == 0 and background and not shell.interactive:
+                base[0] = os.open(os.devnull, os.O_RDONLY)
+                owned.append(base[0])
+            if not last:
+                prev_read, base[1] = streams.pipe(pipe_size)
+                owned.append(base[1])
+            elif stdout is not None:
+                base[1] = os.dup(stdout)
+                owned.append(base[1])
+            if stderr is not None:
+                base[2] = os.dup(stderr)
+                owned.append(base[2])
+
+            redirections = _resolve(shell, redirects, base, owned)
+            if redirections is None:
+                stages.append(1)
+                continue
+            if tokens is not None and not tokens:
+                redirections.close()
+                stages.append(0)
+                continue
+
+            prog = tokens[0] if tokens else None
+            builtin = _stage_builtin(shell, tokens) if tokens else None
+            if builtin is not None:
+                stage = BuiltinStage(shell, builtin, tokens[1:], redirections)
+                stage.start()
+                stages.append(stage)
+                continue
+
+            try:
+                run = None
+                if tokens is None:
+                    run = partial(execute_node, shell, stage)
+                elif prog in shell.functions or prog in registry.table:
+                    run = partial(run_builtin, shell, tokens)
+                else:
+                    full_path = builtins.find_executable(prog)
+                    if full_path is None:
+                        print(f"{prog}: command not found")
+                        stages.append(127)
+                        continue
+
+                pgroup = (pgid or 0) if background else None
+                if run is not None:
+                    proc = fork_subshell(shell, run, pgroup=pgroup, fds=redirections.fds)
+                else:
+                    proc = _spawn_hashed(tokens, full_path,
+                                         env=shell.variables.environ(assignments),
+                                         pgroup=pgroup, fds=redirections.fds)
+                if background and pgid is None:
+                    pgid = proc.pid
+                stages.append(proc)
+            except Exception as e:
+                print(f"Error: {e}")
+                stages.append(1)
+            finally:
+                redirections.close()
+    finally:
+        _close_fd(prev_read)
+    return stages
+
+
+def _wait_stages(shell, stages):
+    """Wait for every stage and return their exit statuses.
+
+    Processes are reaped in the order they exit, by polling a pidfd for each
+    child where the platform has them, so an early-exiting stage does not
+    linger as a zombie behind a long-running one.
+    """
+    statuses = [stage if isinstance(stage, int) else None for stage in stages]
+    procs = {i: stage for i, stage in enumerate(stages)
+             if statuses[i] is None and not isinstance(stage, BuiltinStage)}
+
+    if procs and hasattr(os, 'pidfd_open'):
+        import selectors
+
+        with selectors.DefaultSelector() as selector:
+            for i, proc in procs.items():
+                try:
+                    selector.register(os.pidfd_open(proc.pid), selectors.EVENT_READ, i)
+                except OSError:
+                    pass
+            while selector.get_map():
+                for key, _ in selector.select():
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    statuses[key.data] = spawn.exit_status(procs[key.data].wait())
+                    _note_rusage(shell, procs[key.data])
+
+    for i, stage in enumerate(stages):
+        if statuses[i] is None:
+            if isinstance(stage, BuiltinStage):
+                statuses[i] = stage.wait()
+            else:
+                statuses[i] = spawn.exit_status(stage.wait())
+                _note_rusage(shell, stage)
+    return statuses
+
+
+_EXECUTORS = {
+    parsing.Command: run_command,
+    parsing.Pipeline: _execute_pipeline,
+    parsing.AndOr: _execute_and_or,
+    parsing.Sequence: _execute_sequence,
+    parsing.If: _execute_if,
+    parsing.For: _execute_for,
+    parsing.While: _execute_while,
+    parsing.Case: _execute_case,
+    parsing.Group: _execute_group,
+    parsing.Function: _execute_function,
+    parsing.Redirected: _execute_redirected,
+}
@@ -0,0 +1,157 @@
+import os
+import re
+from fnmatch import translate
+from functools import lru_cache
+
+_MAGIC = re.compile(r'[*?[]')
+
+
+def has_magic(text):
+    """Whether text contains a glob character"""
+    return _MAGIC.search(text) is not None
+
+
+def escape(text):
+    """Quote the glob characters in text so they only match themselves"""
+    return _MAGIC.sub(r'[\g<0>]', text)
+
+
+@lru_cache(maxsize=256)
+def _matcher(component):
+    return re.compile(translate(component)).match
+
+
+def _join(directory, name):
+    if not directory:
+        return name
+    if directory.endswith('/'):
+        return directory + name
+    return directory + '/' + name
+
+
+class Listing:
+    """The entries of one directory: all names, and which are directories/symlinks"""
+
+    __slots__ = ('names', 'dirs', 'links')
+
+    def __init__(self, names, dirs, links):
+        self.names = names
+        self.dirs = dirs
+        self.links = links
+
+
+class DirCache:
+    """Directory listings read while expanding one command's words.
+
+    Each directory is scanned with os.scandir at most once, so several
+    patterns over the same tree (`ls src/*.py src/*.pyi`) share the reads.
+    """
+
+    def __init__(self):
+        self._listings = {}
+
+    def listing(self, directory):
+        """Return the Listing of directory ('' is the cwd); empty if unreadable"""
+        listing = self._listings.get(directory)
+        if listing is None:
+            names = []
+            dirs = set()
+            links = set()
+            try:
+                with os.scandir(directory or '.') as it:
+                    for entry in it:
+                        name = entry.name
+                        names.append(name)
+                        try:
+                            if entry.is_dir():
+                                dirs.add(name)
+                                if entry.is_symlink():
+                                    links.add(name)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+            listing = self._listings[directory] = Listing(names, dirs, links)
+        return listing
+
+
+def _visible(names):
+    return [name for name in names if name[0] != '.']
+
+
+def _subdirectories(directory, cache):
+    """Yield the directories below directory, recursively, as `**` matches them.
+
+    Hidden directories and symbolic links to directories are not entered.
+    """
+    listing = cache.listing(directory)
+    for name in _visible(listing.dirs - listing.links):
+        path = _join(directory, name)
+        yield path
+        yield from _subdirectories(path, cache)
+
+
+def _everything(directory, cache, dir_only):
+    """What a trailing ** matches: directory itself and everything below it"""
+    if directory:
+        yield directory
+    for sub in (directory, *_subdirectories(directory, cache)):
+        listing = cache.listing(sub)
+        for name in _visible(listing.dirs if dir_only else listing.names):
+            yield _join(sub, name)
+
+
+def _walk(directory, components, cache, globstar, dir_only):
+    component = components[0]
+    rest = components[1:]
+
+    if globstar and component == '**':
+        if not rest:
+            yield from _everything(directory, cache, dir_only)
+            return
+        yield from _walk(directory, rest, cache, globstar, dir_only)
+        for sub in _subdirectories(directory, cache):
+            yield from _walk(sub, rest, cache, globstar, dir_only)
+        return
+
+    if not has_magic(component):
+        path = _join(directory, component)
+        if rest:
+            if os.path.isdir(path):
+                yield from _walk(path, rest, cache, globstar, dir_only)
+        elif os.path.isdir(path) if dir_only else os.path.lexists(path):
+            yield path
+        return
+
+    listing = cache.listing(directory)
+    names = filter(_matcher(component), listing.dirs if rest or dir_only else listing.names)
+    if component[0] != '.':
+        names = _visible(names)
+    for name in names:
+        if rest:
+            yield from _walk(_join(directory, name), rest, cache, globstar, dir_only)
+        else:
+            yield _join(directory, name)
+
+
+def iglob(pattern, cache=None, globstar=False):
+    """Yield the paths matching pattern as they are found.
+
+    Supports `*`, `?` and `[...]` in any component, and `**` as any number
+    of directories when globstar is set. Names starting with `.` are only
+    matched by a component that starts with `.` itself.
+    """
+    if cache is None:
+        cache = DirCache()
+    components = [c for c in pattern.split('/') if c]
+    root = '/' if pattern.startswith('/') else ''
+    dir_only = pattern.endswith('/')
+    if not components:
+        return
+    for path in _walk(root, components, cache, globstar, dir_only):
+        yield path + '/' if dir_only else path
+
+
+def glob(pattern, cache=None, globstar=False):
+    """Return the sorted paths matching pattern"""
+    return sorted(iglob(pattern, cache, globstar))
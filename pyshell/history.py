@@ -0,0 +1,175 @@
+import bisect
+import os
+import threading
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Entries kept in the history file and in memory, and how far past that
+# the file may grow before it is compacted back down.
+HISTORY_SIZE = 100000
+COMPACT_SLACK = HISTORY_SIZE // 10
+
+# Entries appended since the search index was last built; beyond this the
+# index is rebuilt rather than searched past.
+INDEX_TAIL = 1024
+
+
+class HistoryIndex:
+    """Substring and prefix index over history entries.
+
+    Indexed entries are kept joined into one newline-separated string with
+    an array of the offset each entry starts at, so a search is a C-speed
+    str.rfind over the whole history plus a bisect per hit to map the match
+    back to its entry. Entries added since the last build are searched
+    directly until there are INDEX_TAIL of them.
+    """
+
+    def __init__(self):
+        self._text = '\n'
+        self._starts = array('q')
+
+    def build(self, entries):
+        self._text = '\n' + '\n'.join(entries) + '\n'
+        self._starts = array('q')
+        offset = 1
+        for entry in entries:
+            self._starts.append(offset)
+            offset += len(entry) + 1
+
+    @property
+    def size(self):
+        return len(self._starts)
+
+    def search(self, entries, pattern, prefix=False):
+        """Yield the numbers of the entries matching pattern, newest first"""
+        if '\n' in pattern:
+            return
+        if not pattern:
+            yield from range(len(entries) - 1, -1, -1)
+            return
+        for i in range(len(entries) - 1, self.size - 1, -1):
+            entry = entries[i]
+            if entry.startswith(pattern) if prefix else pattern in entry:
+                yield i
+
+        # A prefix match is the pattern right after an entry's separator.
+        needle = '\n' + pattern if prefix else pattern
+        skip = 1 if prefix else 0
+        text = self._text
+        end = len(text)
+        while True:
+            pos = text.rfind(needle, 0, end)
+            if pos < 0:
+                return
+            i = bisect.bisect_right(self._starts, pos + skip) - 1
+            yield i
+            end = self._starts[i] - 1 + skip
+
+
+class HistoryStore:
+    """Command history shared by every session through one append-only file.
+
+    Each command is appended to the file as soon as it is entered, under an
+    exclusive lock on a side lock file, so concurrent shells interleave
+    their commands instead of overwriting each other's history and a crash
+    loses nothing. Once the file grows COMPACT_SLACK past HISTORY_SIZE
+    lines, a background thread rewrites it to the newest HISTORY_SIZE under
+    the same lock.
+    """
+
+    def __init__(self, path, size=HISTORY_SIZE):
+        self.path = path
+        self.size = size
+        self.entries = []
+        self.index = HistoryIndex()
+        self._file_lines = 0
+        self._compacting = None
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _locked(self, operation):
+        """Run operation() holding the history lock file"""
+        if fcntl is None:
+            return operation()
+        try:
+            fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return operation()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return operation()
+        finally:
+            os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8', errors='replace') as f:
+                return f.read().splitlines()
+        except OSError:
+            return []
+
+    def load(self):
+        """Read the history file, keeping the newest `size` entries"""
+        lines = self._read()
+        self._file_lines = len(lines)
+        self.entries = [line for line in lines[-self.size:] if line] if self.size else []
+        self.index.build(self.entries)
+        self._maybe_compact()
+
+    def add(self, line):
+        """Record line in memory and append it to the history file"""
+        if not line or '\n' in line:
+            return
+        self.entries.append(line)
+        if len(self.entries) > self.size + COMPACT_SLACK:
+            del self.entries[:len(self.entries) - self.size]
+            self.index.build(self.entries)
+        elif len(self.entries) - self.index.size > INDEX_TAIL:
+            self.index.build(self.entries)
+
+        def append():
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        try:
+            self._locked(append)
+            self._file_lines += 1
+        except OSError:
+            return
+        self._maybe_compact()
+
+    def search(self, pattern, prefix=False):
+        """Return the numbers (0-based) of entries containing pattern, newest first"""
+        return list(self.index.search(self.entries, pattern, prefix))
+
+    def _maybe_compact(self):
+        if self._file_lines <= self.size + COMPACT_SLACK:
+            return
+        if self._compacting is not None and self._compacting.is_alive():
+            return
+        self._compacting = threading.Thread(target=self.compact, daemon=True)
+        self._compacting.start()
+
+    def compact(self):
+        """Rewrite the history file to its newest `size` lines"""
+        def rewrite():
+            lines = self._read()
+            if len(lines) <= self.size:
+                return len(lines)
+            keep = lines[-self.size:]
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(keep) + '\n')
+            os.replace(tmp, self.path)
+            return len(keep)
+        try:
+            self._file_lines = self._locked(rewrite)
+        except OSError:
+            pass
@@ -0,0 +1,217 @@
+import os
+import signal
+import threading
+
+from . import spawn
+
+# Done jobs kept for `jobs`/`wait` before the oldest are forgotten.
+MAX_DONE_JOBS = 1024
+
+
+class Job:
+    """A background pipeline: its stages, process group and state.
+
+    stages holds what execute._start_stages returned: spawned processes,
+    threads running in-process builtins, and ints for stages that never
+    started.
+    """
+
+    def __init__(self, job_id, stages, command, pgid):
+        self.id = job_id
+        self.stages = stages
+        self.command = command
+        self.pgid = pgid
+        self.state = 'Running'
+        self.statuses = [stage if isinstance(stage, int) else None for stage in stages]
+        self.notified = False
+
+    @property
+    def pids(self):
+        return [stage.pid for stage in self.stages if hasattr(stage, 'pid')]
+
+    @property
+    def done(self):
+        return all(status is not None for status in self.statuses)
+
+    @property
+    def status(self):
+        return self.statuses[-1] if self.done else None
+
+    def describe(self):
+        if self.state == 'Done':
+            status = self.status
+            return 'Done' if status == 0 else f'Exit {status}'
+        return self.state
+
+    def _record(self, i, proc, wait_status):
+        if os.WIFSTOPPED(wait_status):
+            self.state = 'Stopped'
+            return
+        if os.WIFCONTINUED(wait_status):
+            self.state = 'Running'
+            return
+        proc.returncode = os.waitstatus_to_exitcode(wait_status)
+        self.statuses[i] = spawn.exit_status(proc.returncode)
+
+    def _poll_stage(self, i, block):
+        stage = self.stages[i]
+        if isinstance(stage, threading.Thread):
+            if block:
+                stage.join()
+            if not stage.is_alive():
+                self.statuses[i] = stage.returncode
+            return
+
+        if stage.returncode is not None:
+            self.statuses[i] = spawn.exit_status(stage.returncode)
+            return
+        flags = os.WUNTRACED | (0 if block else os.WNOHANG | os.WCONTINUED)
+        while True:
+            try:
+                pid, wait_status = os.waitpid(stage.pid, flags)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                # Reaped elsewhere, e.g. by the SIGCHLD handler mid-wait.
+                if stage.returncode is not None:
+                    self.statuses[i] = spawn.exit_status(stage.returncode)
+                else:
+                    self.statuses[i] = 0
+                return
+        if pid:
+            self._record(i, stage, wait_status)
+
+    def poll(self):
+        """Collect state changes without blocking"""
+        for i, status in enumerate(self.statuses):
+            if status is None:
+                self._poll_stage(i, block=False)
+        if self.done:
+            self.state = 'Done'
+
+    def wait(self):
+        """Block until the job finishes or stops; return its status or None if stopped"""
+        for i in range(len(self.stages)):
+            while self.statuses[i] is None:
+                self._poll_stage(i, block=True)
+                if self.state == 'Stopped':
+                    return None
+        self.state = 'Done'
+        return self.status
+
+    def signal(self, sig):
+        """Send sig to the job's process group"""
+        if self.pgid is None:
+            raise ProcessLookupError("job has no processes")
+        os.killpg(self.pgid, sig)
+
+
+class JobTable:
+    """Background jobs of one shell.
+
+    Children are reaped from a SIGCHLD handler (installed when the first
+    job starts) as well as whenever the table is consulted, so finished
+    jobs never linger as zombies. Done jobs stay listed until reported.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._order = []
+        self._handler_installed = False
+        self._inherited = set()  # ids of a parent shell's jobs, see inherited()
+
+    def inherited(self):
+        """A table for a forked subshell. It lists the parent's jobs as they
+        last were, for `jobs | ...` and $(jobs), but never polls them: they
+        are not the subshell's children."""
+        table = JobTable()
+        table.jobs = dict(self.jobs)
+        table._order = list(self._order)
+        table._inherited = set(self.jobs)
+        return table
+
+    def _install_reaper(self):
+        if self._handler_installed or not hasattr(signal, 'SIGCHLD'):
+            return
+        try:
+            signal.signal(signal.SIGCHLD, lambda sig, frame: self.reap())
+            self._handler_installed = True
+        except ValueError:
+            pass
+
+    def add(self, stages, command, pgid):
+        # As in bash, a subshell forgets its parent's jobs once it starts one
+        for job_id in self._inherited:
+            if job_id in self.jobs:
+                self.remove(self.jobs[job_id])
+        self._inherited = set()
+        job_id = max(self.jobs, default=0) + 1
+        job = Job(job_id, stages, command, pgid)
+        self.jobs[job_id] = job
+        self._order.append(job_id)
+        self._install_reaper()
+        self._trim()
+        return job
+
+    def remove(self, job):
+        self.jobs.pop(job.id, None)
+        if job.id in self._order:
+            self._order.remove(job.id)
+
+    def _trim(self):
+        done = [job for job in self.jobs.values() if job.state == 'Done']
+        for job in done[:max(0, len(done) - MAX_DONE_JOBS)]:
+            self.remove(job)
+
+    def reap(self):
+        for job in list(self.jobs.values()):
+            if job.state != 'Done' and job.id not in self._inherited:
+                job.poll()
+
+    def marker(self, job):
+        if self._order and self._order[-1] == job.id:
+            return '+'
+        if len(self._order) > 1 and self._order[-2] == job.id:
+            return '-'
+        return ' '
+
+    def format(self, job):
+        suffix = ' &' if job.state == 'Running' else ''
+        return f"[{job.id}]{self.marker(job)}  {job.describe():<24}{job.command}{suffix}"
+
+    def notify(self, stdout=None):
+        """Report and forget finished jobs, as done before each prompt"""
+        self.reap()
+        for job_id in list(self._order):
+            job = self.jobs[job_id]
+            if job.state == 'Done':
+                print(self.format(job), file=stdout)
+                self.remove(job)
+
+    def find(self, spec):
+        """Return the job for a %n, %%, %+, %-, %name spec or a pid, or None"""
+        if spec in ('%', '%%', '%+'):
+            return self.jobs.get(self._order[-1]) if self._order else None
+        if spec == '%-':
+            return self.jobs.get(self._order[-2]) if len(self._order) > 1 else None
+        if spec.startswith('%'):
+            body = spec[1:]
+            if body.isdigit():
+                return self.jobs.get(int(body))
+            for job_id in reversed(self._order):
+                if self.jobs[job_id].command.startswith(body):
+                    return self.jobs[job_id]
+            return None
+        if spec.isdigit():
+            pid = int(spec)
+            for job in self.jobs.values():
+                if pid in job.pids:
+                    return job
+        return None
+
+    def touch(self, job):
+        """Make job the current (+) job"""
+        if job.id in self._order:
+            self._order.remove(job.id)
+        self._order.append(job.id)
@@ -0,0 +1,419 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import builtins
+from . import execute
+from . import registry
+from . import streams
+
+USAGE = ("memo: usage: memo [-i file]... [-e name]... [-H] [--] command [arg ...]\n"
+         "       memo --stats | --clear")
+
+# Where outputs are kept and how much of them, in bytes; PYSHELL_MEMO_SIZE
+# takes a K, M or G suffix.
+DIR_VAR = 'PYSHELL_MEMO_DIR'
+SIZE_VAR = 'PYSHELL_MEMO_SIZE'
+DEFAULT_SIZE = 256 * 1024 * 1024
+
+# Eviction removes least recently used entries until the cache is this
+# fraction of its limit, so it does not run again on the next store.
+EVICT_TO = 0.9
+
+_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def default_dir():
+    path = os.environ.get(DIR_VAR)
+    if path:
+        return path
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache, 'pyshell', 'memo')
+
+
+def _parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in _UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * _UNITS[unit])
+
+
+class MemoCache:
+    """Command outputs on disk, addressed by content, evicted least recently used.
+
+    Each entry is a small key file named by the hash of what identifies a
+    run (see memo_key) and recording the exit status and the output blob.
+    Blobs are named by the SHA-256 of their content, so identical outputs
+    are stored once. A hit touches the key file, and eviction removes the
+    key files with the oldest mtimes, then the blobs no key refers to.
+    Stores, eviction and the hit/miss counters are serialised by a lock file.
+    """
+
+    def __init__(self, root, limit=DEFAULT_SIZE):
+        self.root = root
+        self.limit = limit
+        self._keys = os.path.join(root, 'keys')
+        self._objects = os.path.join(root, 'objects')
+        self._tmp = os.path.join(root, 'tmp')
+        self._stats = os.path.join(root, 'stats.json')
+
+    def _locked(self, operation):
+        """Run operation() holding the cache lock file"""
+        os.makedirs(self.root, exist_ok=True)
+        if fcntl is None:
+            return operation()
+        fd = os.open(os.path.join(self.root, 'lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return operation()
+        finally:
+            os.close(fd)
+
+    def _key_path(self, key):
+        return os.path.join(self._keys, key + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest[2:])
+
+    def _read_stats(self):
+        try:
+            with open(self._stats) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+    def _write_stats(self, stats):
+        tmp = f"{self._stats}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp, self._stats)
+
+    def _count(self, name):
+        def update():
+            stats = self._read_stats()
+            stats[name] = stats.get(name, 0) + 1
+            self._write_stats(stats)
+        try:
+            self._locked(update)
+        except OSError:
+            pass
+
+    def lookup(self, key):
+        """Return (blob path, exit status) for key, or None on a miss"""
+        path = self._key_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            blob = self._blob_path(entry['blob'])
+            os.utime(path)
+            os.stat(blob)
+        except (OSError, ValueError, KeyError):
+            self._count('misses')
+            return None
+        self._count('hits')
+        return blob, entry['status']
+
+    def new_output(self):
+        """Return a binary file to write an output into, for store()"""
+        os.makedirs(self._tmp, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self._tmp, delete=False)
+
+    def store(self, key, output, digest, status, argv):
+        """Keep the closed file from new_output(), whose SHA-256 is digest,
+        as the output of key"""
+        size = os.path.getsize(output)
+        if size > self.limit:
+            os.unlink(output)
+            return
+
+        def add():
+            blob = self._blob_path(digest)
+            stats = self._read_stats()
+            if os.path.exists(blob):
+                os.unlink(output)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(output, blob)
+                stats['bytes'] = stats.get('bytes', 0) + size
+            os.makedirs(self._keys, exist_ok=True)
+            tmp = f"{self._key_path(key)}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump({'argv': argv, 'status': status, 'blob': digest, 'size': size}, f)
+            os.replace(tmp, self._key_path(key))
+            if stats['bytes'] > self.limit:
+                self._evict(stats)
+            self._write_stats(stats)
+        self._locked(add)
+
+    def _entries(self):
+        """Yield (mtime, key path, blob digest) for every entry"""
+        try:
+            names = os.listdir(self._keys)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self._keys, name)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                with open(path) as f:
+                    yield mtime, path, json.load(f)['blob']
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def _blobs(self):
+        """Yield (digest, path, size) for every stored blob"""
+        try:
+            prefixes = os.listdir(self._objects)
+        except OSError:
+            return
+        for prefix in prefixes:
+            directory = os.path.join(self._objects, prefix)
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        yield prefix + entry.name, entry.path, entry.stat().st_size
+            except OSError:
+                continue
+
+    def _evict(self, stats):
+        """Drop least recently used entries until under EVICT_TO of the limit"""
+        entries = sorted(self._entries())
+        live = {}
+        for _, _, digest in entries:
+            live[digest] = live.get(digest, 0) + 1
+        sizes = {digest: size for digest, _, size in self._blobs()}
+        total = sum(sizes.values())
+        target = self.limit * EVICT_TO
+        for _, path, digest in entries:
+            if total <= target:
+                break
+            os.unlink(path)
+            stats['evictions'] = stats.get('evictions', 0) + 1
+            live[digest] -= 1
+            if not live[digest]:
+                total -= sizes.get(digest, 0)
+        for digest, path, _ in self._blobs():
+            if not live.get(digest):
+                os.unlink(path)
+        stats['bytes'] = total
+
+    def stats(self):
+        """Return the counters and sizes for `memo --stats`"""
+        def read():
+            stats = self._read_stats()
+            stats['entries'] = sum(1 for _ in self._entries())
+            stats['bytes'] = sum(size for _, _, size in self._blobs())
+            return stats
+        return self._locked(read)
+
+    def clear(self):
+        """Remove every entry and output, keeping the counters"""
+        def remove():
+            for _, path, _ in self._entries():
+                os.unlink(path)
+            for _, path, _ in self._blobs():
+                os.unlink(path)
+            stats = self._read_stats()
+            stats['bytes'] = 0
+            self._write_stats(stats)
+        self._locked(remove)
+
+
+def _input_id(path, by_hash):
+    """What identifies one declared input file in a key"""
+    st = os.stat(path)
+    if not by_hash:
+        return [path, st.st_mtime_ns, st.st_size]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(streams.BUFFER_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return [path, digest.hexdigest()]
+
+
+def memo_key(shell, argv, inputs=(), names=(), by_hash=False):
+    """The cache key of a run: SHA-256 over argv, the command it resolves
+    to, the cwd, the selected variables and the declared input files"""
+    prog = argv[0]
+    if prog in shell.functions or prog in registry.table:
+        resolved = prog
+    else:
+        resolved = builtins.find_executable(prog)
+    identity = {
+        'argv': argv,
+        'command': resolved,
+        'cwd': os.getcwd(),
+        'env': {name: shell.variables.get(name) for name in names},
+        'inputs': [_input_id(os.path.abspath(path), by_hash) for path in inputs],
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def _parse_args(args):
+    """Return (inputs, names, by_hash, argv), or an error message"""
+    inputs = []
+    names = []
+    by_hash = False
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        opt = args[i]
+        if opt == '--':
+            i += 1
+            break
+        if opt in ('-i', '-e'):
+            if i + 1 >= len(args):
+                return f"memo: {opt}: option requires an argument"
+            (inputs if opt == '-i' else names).append(args[i + 1])
+            i += 2
+            continue
+        if opt in ('-H', '--hash'):
+            by_hash = True
+        else:
+            return f"memo: {opt}: invalid option"
+        i += 1
+    if i >= len(args):
+        return USAGE
+    return inputs, names, by_hash, args[i:]
+
+
+def _writer(stdout):
+    """Return a function writing bytes to stdout"""
+    fd = streams.stream_fd(stdout)
+    if fd is not None:
+        stdout.flush()
+        return lambda data: streams.write_all(fd, data)
+    return lambda data: stdout.write(data.decode(errors='replace'))
+
+
+def _replay(blob, stdout):
+    out_fd = streams.stream_fd(stdout)
+    with open(blob, 'rb') as f:
+        if out_fd is None:
+            streams.copy_stream(f, stdout)
+        else:
+            stdout.flush()
+            streams.copy_fd(f.fileno(), out_fd)
+
+
+def _run(shell, cache, key, argv, stdin, stdout, stderr):
+    """Run argv, copying its output to stdout and into the cache as it comes.
+
+    The run is only stored if the command finished and its whole output
+    was kept: not after a signal (^C included) or a failed write.
+    """
+    write = _writer(stdout)
+    stderr.flush()
+    read_fd, write_fd = os.pipe()
+    try:
+        # start_command gives the command its own copy of write_fd
+        wait = execute.start_command(shell, argv, stdin=streams.stream_fd(stdin),
+                                     stdout=write_fd, stderr=streams.stream_fd(stderr))
+    finally:
+        os.close(write_fd)
+
+    output = cache.new_output()
+    digest = hashlib.sha256()
+    broken = False
+    failed = False
+    try:
+        with os.fdopen(read_fd, 'rb', buffering=0) as pipe:
+            while True:
+                data = pipe.read(streams.BUFFER_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+                output.write(data)
+                if not broken:
+                    try:
+                        write(data)
+                    except BrokenPipeError:
+                        broken = True  # keep reading, so the whole output is kept
+                    except OSError as e:
+                        print(f"memo: write error: {e.strerror}", file=stderr)
+                        broken = failed = True
+    except OSError as e:
+        print(f"memo: {e.strerror}", file=stderr)
+        failed = True
+    finally:
+        output.close()
+        status = wait()
+
+    if status < 128 and not failed:
+        try:
+            cache.store(key, output.name, digest.hexdigest(), status, argv)
+        except OSError as e:
+            print(f"memo: cannot store output: {e.strerror}", file=stderr)
+    if os.path.exists(output.name):
+        os.unlink(output.name)
+    if failed:
+        return status or 1
+    return 141 if broken else status
+
+
+def builtin_memo(shell, args, stdin=None, stdout=None, stderr=None):
+    """Run a command, or replay its output and status if it has run before:
+    memo [-i file]... [-e name]... [-H] [--] command [arg ...]
+
+    The key is argv, the command it resolves to, the cwd, the variables
+    named with -e and each -i input file's mtime and size (its SHA-256 with
+    -H). Only stdout is kept; stderr goes straight through and stdin is not
+    part of the key. `memo --stats` shows the cache, `memo --clear` empties it.
+    """
+    stdout = stdout if stdout is not None else sys.stdout
+    stderr = stderr if stderr is not None else sys.stderr
+    try:
+        limit = _parse_size(os.environ.get(SIZE_VAR, '')) if os.environ.get(SIZE_VAR) else DEFAULT_SIZE
+    except (ValueError, IndexError):
+        print(f"memo: {SIZE_VAR}: invalid size", file=stderr)
+        return 2
+    cache = MemoCache(default_dir(), limit)
+
+    try:
+        if args in (['--stats'], ['--clear']):
+            if args[0] == '--clear':
+                cache.clear()
+                return 0
+            stats = cache.stats()
+            lookups = stats.get('hits', 0) + stats.get('misses', 0)
+            rate = stats.get('hits', 0) * 100 / lookups if lookups else 0.0
+            print(f"directory  {cache.root}\n"
+                  f"entries    {stats['entries']}\n"
+                  f"size       {stats['bytes']} / {cache.limit} bytes\n"
+                  f"hits       {stats.get('hits', 0)} ({rate:.1f}%)\n"
+                  f"misses     {stats.get('misses', 0)}\n"
+                  f"evictions  {stats.get('evictions', 0)}", file=stdout)
+            return 0
+
+        parsed = _parse_args(args)
+        if isinstance(parsed, str):
+            print(parsed, file=stderr)
+            return 2
+        inputs, names, by_hash, argv = parsed
+        try:
+            key = memo_key(shell, argv, inputs, names, by_hash)
+        except OSError as e:
+            print(f"memo: {e.filename}: {e.strerror}", file=stderr)
+            return 1
+
+        hit = cache.lookup(key)
+        if hit is not None:
+            blob, status = hit
+            _replay(blob, stdout)
+            return status
+        return _run(shell, cache, key, argv, stdin, stdout, stderr)
+    except BrokenPipeError:
+        return 141
+    except OSError as e:
+        print(f"memo: {cache.root}: {e.strerror}", file=stderr)
+        return 1
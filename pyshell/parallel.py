@@ -0,0 +1,184 @@
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import parsing
+from . import execute
+from . import streams
+
+USAGE = "parallel: usage: parallel [-j N] [-k] [-a file] command [args ...] [::: arg ...]"
+
+# GNU parallel caps its failure count exit status here.
+MAX_FAILURE_STATUS = 101
+
+
+def _quote(arg):
+    return "'" + arg.replace("'", "'\\''") + "'"
+
+
+def command_line(template, arg):
+    """Build the command line for one input line.
+
+    A single-word template is a command line of its own and gets the quoted
+    arg substituted for {}. A template of several words is an argv: {} is
+    replaced inside each word and every word is quoted. Without any {} the
+    arg is appended.
+    """
+    if len(template) == 1:
+        line = template[0]
+        if '{}' in line:
+            return line.replace('{}', _quote(arg))
+        return f"{line} {_quote(arg)}"
+
+    words = [_quote(word.replace('{}', arg)) for word in template]
+    if not any('{}' in word for word in template):
+        words.append(_quote(arg))
+    return ' '.join(words)
+
+
+def _run_job(shell, line):
+    """Run one command line with stdout and stderr captured to temp files"""
+    out = tempfile.TemporaryFile()
+    err = tempfile.TemporaryFile()
+    try:
+        pipeline = parsing.parse(line)
+    except parsing.ParseError as e:
+        err.write(f"Syntax error: {e}\n".encode())
+        return 2, out, err
+    if pipeline is None:
+        return 0, out, err
+
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    try:
+        status = execute.run_captured(shell, pipeline, devnull, out.fileno(), err.fileno())
+    finally:
+        os.close(devnull)
+    return status, out, err
+
+
+def _emit(captured, dst, dst_fd):
+    captured.seek(0)
+    if dst_fd is None:
+        streams.copy_stream(captured, dst)
+    else:
+        streams.copy_fd(captured.fileno(), dst_fd)
+    captured.close()
+
+
+def _parse_args(args):
+    """Return (jobs, keep_order, arg_file, template, inline_args) or an error string"""
+    jobs = os.cpu_count() or 1
+    keep_order = False
+    arg_file = None
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        opt = args[i]
+        if opt == '--':
+            i += 1
+            break
+        if opt == '-k':
+            keep_order = True
+        elif opt in ('-j', '-a'):
+            if i + 1 >= len(args):
+                return f"parallel: {opt}: option requires an argument"
+            i += 1
+            if opt == '-a':
+                arg_file = args[i]
+            elif not args[i].isdigit() or int(args[i]) < 1:
+                return f"parallel: -j: invalid job count '{args[i]}'"
+            else:
+                jobs = int(args[i])
+        elif opt.startswith('-j') and opt[2:].isdigit() and int(opt[2:]) > 0:
+            jobs = int(opt[2:])
+        else:
+            return f"parallel: {opt}: invalid option"
+        i += 1
+
+    rest = args[i:]
+    inline = None
+    if ':::' in rest:
+        split = rest.index(':::')
+        rest, inline = rest[:split], rest[split + 1:]
+    if not rest:
+        return USAGE
+    return jobs, keep_order, arg_file, rest, inline
+
+
+def builtin_parallel(shell, args, stdin=None, stdout=None, stderr=None):
+    """Run a command template once per input line on a bounded worker pool.
+
+    Input lines come from stdin, `-a file` or the words after `:::`; each is
+    substituted for {} in the template (see command_line). At most -j commands
+    (default: CPU count) run at once. Each job's stdout and stderr are
+    printed together when it finishes, in input order with -k. Returns the
+    number of failed jobs, capped at 101.
+    """
+    parsed = _parse_args(args)
+    if isinstance(parsed, str):
+        print(parsed, file=stderr)
+        return 2
+    jobs, keep_order, arg_file, template, inline = parsed
+
+    source = None
+    if inline is not None:
+        lines = iter(inline)
+    else:
+        try:
+            source = open(arg_file) if arg_file else (stdin if stdin is not None else sys.stdin)
+        except OSError as e:
+            print(f"parallel: {arg_file}: {e.strerror}", file=stderr)
+            return 1
+        lines = (line.rstrip('\n') for line in source)
+
+    out = stdout if stdout is not None else sys.stdout
+    err = stderr if stderr is not None else sys.stderr
+    out.flush()
+    err.flush()
+    out_fd = streams.stream_fd(out)
+    err_fd = streams.stream_fd(err)
+    lock = threading.Lock()
+    failures = 0
+
+    def finish(future):
+        nonlocal failures
+        status, captured_out, captured_err = future.result()
+        with lock:
+            _emit(captured_out, out, out_fd)
+            _emit(captured_err, err, err_fd)
+        if status:
+            failures += 1
+
+    limit = jobs * 2 if keep_order else jobs
+    running = []
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='pyshell-parallel') as pool:
+            for arg in lines:
+                if not arg:
+                    continue
+                while len(running) >= limit:
+                    if keep_order:
+                        finish(running.pop(0))
+                    else:
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            running.remove(future)
+                            finish(future)
+                running.append(pool.submit(_run_job, shell, command_line(template, arg)))
+
+            while running:
+                if keep_order:
+                    finish(running.pop(0))
+                else:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.remove(future)
+                        finish(future)
+    except BrokenPipeError:
+        return 141
+    finally:
+        if arg_file and source is not None:
+            source.close()
+
+    return min(failures, MAX_FAILURE_STATUS)
@@ -1,65 +1,1340 @@
 import os
+import re
+from collections import namedtuple
+from fnmatch import fnmatchcase
+from functools import lru_cache
 
+from . import globbing
 
-def tokenize(line: str):
-    """Simple tokenizer - split on whitespace, respecting quotes"""
-    tokens = []
-    current = ""
-    in_quote = None
-    escaped = False
-
-    for char in line:
-        if escaped:
-            current += char
-            escaped = False
+
+class ParseError(Exception):
+    """Raised for malformed command lines"""
+
+
+class IncompleteInput(ParseError):
+    """Raised when input ends inside a quote or an unfinished construct,
+    so that reading another line may complete it"""
+
+
+# --- AST -----------------------------------------------------------------
+#
+# Nodes are immutable so that a parsed line can be cached and executed any
+# number of times.  A Word keeps its quoting: `parts` is a tuple of
+# (text, quote) pairs where quote is '' for unquoted text, "'" or '"' for
+# quoted text and '\\' for a backslash-escaped character.
+
+Word = namedtuple('Word', 'parts')
+Redirect = namedtuple('Redirect', 'fd op target')
+Command = namedtuple('Command', 'words redirects')
+# commands holds Commands and compound nodes
+Pipeline = namedtuple('Pipeline', 'commands background timed negated', defaults=(False, None, False))
+# `a && b || c`: rest is a tuple of ('&&' or '||', Pipeline) pairs
+AndOr = namedtuple('AndOr', 'first rest')
+# commands separated by `;`, `&` or newlines
+Sequence = namedtuple('Sequence', 'items')
+# if/elif: clauses is a tuple of (condition, body) pairs
+If = namedtuple('If', 'clauses else_body')
+# words is None for a bare `for NAME`, which loops over "$@"
+For = namedtuple('For', 'name words body')
+While = namedtuple('While', 'condition body until')
+# items is a tuple of (patterns, body) pairs; body is None for an empty item
+Case = namedtuple('Case', 'word items')
+# `{ list; }`, or `( list )` when subshell is set
+Group = namedtuple('Group', 'body subshell')
+Function = namedtuple('Function', 'name body')
+# a compound command followed by redirections
+Redirected = namedtuple('Redirected', 'node redirects')
+
+
+def word_text(word):
+    """Return the literal text of a word with its quotes removed"""
+    return ''.join(text for text, _ in word.parts)
+
+
+# --- Lexer ---------------------------------------------------------------
+
+# Operators, longest first, with the fd they apply to when no IO number
+# is written in front of them.
+OPERATORS = {
+    '&>>': 1, '&>': 1, '>>': 1, '>&': 1, '>': 1, '<<<': 0, '<&': 0, '<': 0,
+    '&&': None, '||': None, '|': None, '&': None,
+    ';;': None, ';': None, '(': None, ')': None, '\n': None,
+}
+# Redirection operators: `N>&M` and `N<&M` duplicate fd M (`-` closes N),
+# `&>file` sends both stdout and stderr to file and `<<< word` feeds word
+# to stdin as a here-string.
+REDIRECT_OPERATORS = frozenset(('>', '>>', '<', '>&', '<&', '&>', '&>>', '<<<'))
+# Operators that cannot take an IO number
+_NO_IO_NUMBER = frozenset(('&>', '&>>'))
+
+_BLANK = re.compile(r'(?:[ \t]|\\\n)*')
+_OPERATOR = re.compile(r'(\d*)(&>>|&>|&&|>>|>&|>|<<<|<&|<|\|\||\||&|;;|;|\(|\)|\n)')
+_PLAIN = re.compile(r'[^ \t\n|&<>;()\'"\\$`]+')
+_ARG_PLAIN = re.compile(r'[^\'"\\$`]+')
+_DQUOTED = re.compile(r'[^"\\$`]+')
+_DQUOTE_ESCAPABLE = '$`"\\\n'
+
+
+def _merge(parts):
+    merged = []
+    for text, quote in parts:
+        if merged and merged[-1][1] == quote:
+            merged[-1] = (merged[-1][0] + text, quote)
+        else:
+            merged.append((text, quote))
+    return tuple(merged)
+
+
+def _brace_end(line, i):
+    """Return the index just past the `}` closing a `${` whose body starts at i"""
+    depth = 1
+    n = len(line)
+    while i < n:
+        char = line[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char in ('"', "'"):
+            j = line.find(char, i + 1)
+            if j < 0:
+                break
+            i = j + 1
+            continue
+        if char == '$' and line[i + 1:i + 2] == '{':
+            depth += 1
+            i += 2
+            continue
+        if char == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise IncompleteInput("unexpected EOF while looking for matching `}'")
+
+
+def _paren_end(line, i):
+    """Return the index just past the `)` closing a `$(` whose body starts at i"""
+    depth = 1
+    n = len(line)
+    while i < n:
+        char = line[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char in ('"', "'", '`'):
+            j = line.find(char, i + 1)
+            if j < 0:
+                break
+            i = j + 1
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise IncompleteInput("unexpected EOF while looking for matching `)'")
+
+
+def _backquote_end(line, i):
+    """Return the index just past the backquote closing one opened at i - 1"""
+    n = len(line)
+    while i < n:
+        if line[i] == '\\':
+            i += 2
+            continue
+        if line[i] == '`':
+            return i + 1
+        i += 1
+    raise IncompleteInput("unexpected EOF while looking for matching ``'")
+
+
+def _expansion_end(line, i):
+    """For the `$` or backquote at line[i], return the index just past the
+    ${...}, $(...) or `...` it starts, or i + 1 for any other `$`"""
+    if line[i] == '`':
+        return _backquote_end(line, i + 1)
+    nxt = line[i + 1:i + 2]
+    if nxt == '{':
+        return _brace_end(line, i + 2)
+    if nxt == '(':
+        return _paren_end(line, i + 2)
+    return i + 1
+
+
+def _scan_word(line, i, plain=_PLAIN):
+    """Scan the word starting at line[i]; return its (text, quote) parts and end.
+
+    plain matches runs of ordinary characters; the scan stops at the first
+    character that is neither ordinary nor a quote, backslash, `$` or
+    backquote.  Expansions are kept whole in the text of their part.
+    """
+    n = len(line)
+    parts = []
+    while i < n:
+        m = plain.match(line, i)
+        if m:
+            parts.append((m.group(), ''))
+            i = m.end()
+            continue
+
+        char = line[i]
+        if char in ('$', '`'):
+            j = _expansion_end(line, i)
+            parts.append((line[i:j], ''))
+            i = j
+        elif char == "'":
+            j = line.find("'", i + 1)
+            if j < 0:
+                raise IncompleteInput("unexpected EOF while looking for matching `''")
+            parts.append((line[i + 1:j], "'"))
+            i = j + 1
+        elif char == '"':
+            i += 1
+            quoted = []
+            while True:
+                m = _DQUOTED.match(line, i)
+                if m:
+                    quoted.append((m.group(), '"'))
+                    i = m.end()
+                if i >= n:
+                    raise IncompleteInput("unexpected EOF while looking for matching `\"'")
+                if line[i] == '"':
+                    i += 1
+                    break
+                if line[i] in ('$', '`'):
+                    j = _expansion_end(line, i)
+                    quoted.append((line[i:j], '"'))
+                    i = j
+                    continue
+                # backslash inside double quotes
+                nxt = line[i + 1:i + 2]
+                if nxt and nxt in _DQUOTE_ESCAPABLE:
+                    if nxt != '\n':
+                        quoted.append((nxt, '\\'))
+                    i += 2
+                else:
+                    quoted.append(('\\', '"'))
+                    i += 1
+            parts.extend(quoted or [('', '"')])
         elif char == '\\':
-            escaped = True
-        elif char in ('"', "'"):
-            if in_quote == char:
-                in_quote = None
-            elif in_quote is None:
-                in_quote = char
+            nxt = line[i + 1:i + 2]
+            if nxt == '\n':
+                i += 2
+                continue
+            parts.append((nxt or '\\', '\\'))
+            i += 2
+        else:
+            break
+    return _merge(parts), i
+
+
+def lex(line: str):
+    """Split line into tokens in a single pass.
+
+    Yields ('word', Word) and ('op', operator, fd) tuples.  Text is sliced
+    out of line rather than built up a character at a time.
+    """
+    i = 0
+    n = len(line)
+
+    while True:
+        i = _BLANK.match(line, i).end()
+        if i >= n:
+            return
+        if line[i] == '#':
+            i = line.find('\n', i)
+            if i < 0:
+                return
+
+        m = _OPERATOR.match(line, i)
+        if m:
+            op = m.group(2)
+            if m.group(1) and (OPERATORS[op] is None or op in _NO_IO_NUMBER):
+                m = None
             else:
-                current += char
-        elif char in (' ', '\t') and in_quote is None:
-            if current:
-                tokens.append(current)
-                current = ""
+                fd = int(m.group(1)) if m.group(1) else OPERATORS[op]
+                yield ('op', op, fd)
+                i = m.end()
+                continue
+
+        parts, i = _scan_word(line, i)
+        yield ('word', Word(parts))
+
+
+# --- Parser --------------------------------------------------------------
+
+# Options of the `time` keyword; those in the second set take an argument.
+TIME_OPTIONS = ('-p', '-j', '-o')
+TIME_OPTIONS_WITH_ARG = ('-o',)
+
+
+# Reserved words, recognised only where a command name could start.
+RESERVED = frozenset(('if', 'then', 'elif', 'else', 'fi', 'for', 'in', 'do', 'done',
+                      'while', 'until', 'case', 'esac', 'function', '{', '}', '!'))
+# Words that end the list inside a compound command.
+_LIST_END = frozenset(('then', 'elif', 'else', 'fi', 'do', 'done', 'esac', '}'))
+
+
+def _reserved(token):
+    """Return the reserved word token is, or None"""
+    if token is not None and token[0] == 'word':
+        parts = token[1].parts
+        if len(parts) == 1 and parts[0][1] == '' and parts[0][0] in RESERVED:
+            return parts[0][0]
+    return None
+
+
+def _describe(token):
+    if token is None:
+        return 'newline'
+    if token[0] == 'op':
+        return 'newline' if token[1] == '\n' else token[1]
+    return word_text(token[1])
+
+
+class _Parser:
+    """Recursive-descent parser from lex() tokens to AST nodes.
+
+    Running out of tokens inside a construct raises IncompleteInput, so
+    interactive and script input can read on until the command is whole.
+    """
+
+    def __init__(self, text):
+        self.tokens = list(lex(text))
+        self.pos = 0
+
+    # -- token helpers
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise IncompleteInput("unexpected end of file")
+        self.pos += 1
+        return token
+
+    def at_op(self, *ops):
+        token = self.peek()
+        return token is not None and token[0] == 'op' and token[1] in ops
+
+    def at_word(self, *words):
+        return _reserved(self.peek()) in words
+
+    def unexpected(self):
+        token = self.peek()
+        if token is None:
+            raise IncompleteInput("unexpected end of file")
+        raise ParseError(f"near unexpected token `{_describe(token)}'")
+
+    def expect_word(self, word):
+        if not self.at_word(word):
+            self.unexpected()
+        self.pos += 1
+
+    def expect_op(self, op):
+        if not self.at_op(op):
+            self.unexpected()
+        self.pos += 1
+
+    def linebreak(self):
+        while self.at_op('\n'):
+            self.pos += 1
+
+    # -- grammar
+
+    def program(self):
+        self.linebreak()
+        if self.peek() is None:
+            return None
+        node = self.sequence()
+        if self.peek() is not None:
+            self.unexpected()
+        return node
+
+    def sequence(self):
+        """and_or lists separated by ; & or newlines, up to a list terminator"""
+        items = []
+        while True:
+            self.linebreak()
+            token = self.peek()
+            if token is None or _reserved(token) in _LIST_END or self.at_op(')', ';;'):
+                break
+            item = self.and_or()
+            if self.at_op('&'):
+                self.pos += 1
+                item = _background(item)
+            elif self.at_op(';'):
+                self.pos += 1
+            elif not self.at_op('\n') and self.peek() is not None and not self.at_op(')', ';;') \
+                    and _reserved(self.peek()) not in _LIST_END:
+                self.unexpected()
+            items.append(item)
+        if not items:
+            self.unexpected()
+        return items[0] if len(items) == 1 else Sequence(tuple(items))
+
+    def and_or(self):
+        first = self.pipeline()
+        rest = []
+        while self.at_op('&&', '||'):
+            op = self.next()[1]
+            self.linebreak()
+            rest.append((op, self.pipeline()))
+        return AndOr(first, tuple(rest)) if rest else first
+
+    def pipeline(self):
+        negated = False
+        timed = None
+        if self.at_word('!'):
+            self.pos += 1
+            negated = True
+        token = self.peek()
+        if token is not None and token[0] == 'word' and token[1].parts == (('time', ''),):
+            self.pos += 1
+            timed = ()
+            while True:
+                token = self.peek()
+                option = word_text(token[1]) if token is not None and token[0] == 'word' else None
+                if option not in TIME_OPTIONS:
+                    break
+                self.pos += 1
+                if option in TIME_OPTIONS_WITH_ARG:
+                    arg = self.peek()
+                    if arg is None or arg[0] != 'word':
+                        raise ParseError(f"time: {option}: option requires an argument")
+                    self.pos += 1
+                    timed += (option, word_text(arg[1]))
+                else:
+                    timed += (option,)
+            token = self.peek()
+            if token is None or self.at_op('\n', ';', '&'):
+                return Pipeline((), False, timed, negated)
+
+        commands = [self.command()]
+        while self.at_op('|'):
+            self.pos += 1
+            self.linebreak()
+            commands.append(self.command())
+        return Pipeline(tuple(commands), False, timed, negated)
+
+    def command(self):
+        token = self.peek()
+        word = _reserved(token)
+        if word == 'if':
+            node = self.if_clause()
+        elif word in ('while', 'until'):
+            node = self.while_clause()
+        elif word == 'for':
+            node = self.for_clause()
+        elif word == 'case':
+            node = self.case_clause()
+        elif word == '{':
+            node = self.brace_group()
+        elif word == 'function':
+            self.pos += 1
+            name = self.next()
+            if name[0] != 'word' or not is_name(word_text(name[1])):
+                raise ParseError(f"`{_describe(name)}': not a valid identifier")
+            if self.at_op('('):
+                self.pos += 1
+                self.expect_op(')')
+            return self.function_body(word_text(name[1]))
+        elif self.at_op('('):
+            self.pos += 1
+            node = Group(self.sequence(), True)
+            self.expect_op(')')
+        elif word is not None and word != '!' and word not in ('in',):
+            self.unexpected()
+        elif token is not None and token[0] == 'word' and self._at_function():
+            name = word_text(token[1])
+            self.pos += 3
+            return self.function_body(name)
         else:
-            current += char
+            return self.simple_command()
 
-    if current:
-        tokens.append(current)
+        redirects = self.redirects()
+        return Redirected(node, redirects) if redirects else node
 
-    return tokens
+    def _at_function(self):
+        nxt = self.tokens[self.pos + 1:self.pos + 3]
+        return (len(nxt) == 2 and nxt[0][:2] == ('op', '(') and nxt[1][:2] == ('op', ')')
+                and is_name(word_text(self.peek()[1])))
 
+    def function_body(self, name):
+        self.linebreak()
+        body = self.command()
+        if isinstance(body, (Command, Function)):
+            raise ParseError(f"{name}: function body must be a compound command")
+        return Function(name, body)
 
-def expand_variables(tokens: list, shell):
-    """Expand environment variables in tokens"""
-    expanded = []
-    for token in tokens:
-        if '$' in token:
-            parts = []
-            i = 0
-            while i < len(token):
-                if token[i] == '$':
-                    if i + 1 < len(token) and token[i + 1] == '?':
-                        parts.append(str(getattr(shell, 'last_exit_code', 0)))
-                        i += 2
+    def redirect(self, op, fd):
+        target = self.peek()
+        if target is None or target[0] != 'word':
+            if target is None or self.at_op('\n'):
+                raise ParseError(f"expected filename after '{op}'")
+            self.unexpected()
+        self.pos += 1
+        return Redirect(fd, op, target[1])
+
+    def redirects(self):
+        redirects = []
+        while self.at_op(*REDIRECT_OPERATORS):
+            _, op, fd = self.next()
+            redirects.append(self.redirect(op, fd))
+        return tuple(redirects)
+
+    def simple_command(self):
+        words = []
+        redirects = []
+        while True:
+            token = self.peek()
+            if token is None:
+                break
+            if token[0] == 'word':
+                words.append(token[1])
+                self.pos += 1
+            elif token[1] in REDIRECT_OPERATORS:
+                self.pos += 1
+                redirects.append(self.redirect(token[1], token[2]))
+            else:
+                break
+        if not words and not redirects:
+            self.unexpected()
+        return Command(tuple(words), tuple(redirects))
+
+    def if_clause(self):
+        self.expect_word('if')
+        clauses = []
+        condition = self.sequence()
+        self.expect_word('then')
+        clauses.append((condition, self.sequence()))
+        else_body = None
+        while True:
+            if self.at_word('elif'):
+                self.pos += 1
+                condition = self.sequence()
+                self.expect_word('then')
+                clauses.append((condition, self.sequence()))
+            elif self.at_word('else'):
+                self.pos += 1
+                else_body = self.sequence()
+            else:
+                break
+        self.expect_word('fi')
+        return If(tuple(clauses), else_body)
+
+    def while_clause(self):
+        until = self.next()[1].parts[0][0] == 'until'
+        condition = self.sequence()
+        return While(condition, self.do_group(), until)
+
+    def do_group(self):
+        self.expect_word('do')
+        body = self.sequence()
+        self.expect_word('done')
+        return body
+
+    def for_clause(self):
+        self.expect_word('for')
+        name = self.next()
+        if name[0] != 'word' or not is_name(word_text(name[1])):
+            raise ParseError(f"`{_describe(name)}': not a valid identifier")
+        words = None
+        self.linebreak()
+        if self.at_word('in'):
+            self.pos += 1
+            words = []
+            while self.peek() is not None and self.peek()[0] == 'word':
+                words.append(self.next()[1])
+            words = tuple(words)
+            if not self.at_op(';', '\n'):
+                self.unexpected()
+            self.pos += 1
+        elif self.at_op(';'):
+            self.pos += 1
+        self.linebreak()
+        return For(word_text(name[1]), words, self.do_group())
+
+    def case_clause(self):
+        self.expect_word('case')
+        word = self.next()
+        if word[0] != 'word':
+            raise ParseError(f"near unexpected token `{_describe(word)}'")
+        self.linebreak()
+        self.expect_word('in')
+        items = []
+        while True:
+            self.linebreak()
+            if self.at_word('esac'):
+                self.pos += 1
+                break
+            if self.at_op('('):
+                self.pos += 1
+            patterns = []
+            while True:
+                token = self.next()
+                if token[0] != 'word':
+                    raise ParseError(f"near unexpected token `{_describe(token)}'")
+                patterns.append(token[1])
+                if self.at_op('|'):
+                    self.pos += 1
+                    continue
+                self.expect_op(')')
+                break
+            self.linebreak()
+            body = None
+            if not self.at_op(';;') and not self.at_word('esac'):
+                body = self.sequence()
+            items.append((tuple(patterns), body))
+            if self.at_op(';;'):
+                self.pos += 1
+            elif not self.at_word('esac'):
+                self.unexpected()
+        return Case(word[1], tuple(items))
+
+    def brace_group(self):
+        self.expect_word('{')
+        body = self.sequence()
+        self.expect_word('}')
+        return Group(body, False)
+
+
+def _background(node):
+    """Mark node, an and_or list, to run in the background"""
+    if isinstance(node, Pipeline) and not node.negated and node.timed is None:
+        return node._replace(background=True)
+    return Pipeline((node,), True)
+
+
+def _parse(text: str):
+    return _Parser(text).program()
+
+
+def _unparse_word(word):
+    out = []
+    for text, quote in word.parts:
+        if quote == '':
+            out.append(text)
+        elif quote == "'":
+            out.append(f"'{text}'")
+        elif quote == '"':
+            out.append(f'"{text}"')
+        else:
+            out.append('\\' + text)
+    return ''.join(out)
+
+
+def _unparse_redirects(redirects):
+    return ''.join(
+        f" {'' if r.fd == OPERATORS[r.op] else r.fd}{r.op}"
+        f"{'' if r.op in ('>&', '<&') else ' '}{_unparse_word(r.target)}"
+        for r in redirects
+    )
+
+
+def _terminated(node):
+    """node as a list item, followed by `;` unless it already ends in `&`"""
+    text = unparse(node)
+    return text if text.endswith('&') else text + ';'
+
+
+def unparse(node):
+    """Render an AST node back as shell source on one line"""
+    kind = node.__class__
+    if kind is Command:
+        return ' '.join(_unparse_word(word) for word in node.words) + _unparse_redirects(node.redirects)
+    if kind is Pipeline:
+        text = ' | '.join(unparse(command) for command in node.commands)
+        if node.timed is not None:
+            text = ' '.join(('time',) + node.timed + ((text,) if text else ()))
+        if node.negated:
+            text = '! ' + text
+        return text + ' &' if node.background else text
+    if kind is AndOr:
+        return ' '.join([unparse(node.first)] + [f"{op} {unparse(item)}" for op, item in node.rest])
+    if kind is Sequence:
+        return ' '.join(_terminated(item) for item in node.items[:-1]) + ' ' + unparse(node.items[-1])
+    if kind is If:
+        text = ' '.join(
+            f"{'if' if i == 0 else 'elif'} {_terminated(condition)} then {_terminated(body)}"
+            for i, (condition, body) in enumerate(node.clauses)
+        )
+        if node.else_body is not None:
+            text += f" else {_terminated(node.else_body)}"
+        return text + ' fi'
+    if kind is For:
+        words = '' if node.words is None else ' in ' + ' '.join(_unparse_word(w) for w in node.words)
+        return f"for {node.name}{words}; do {_terminated(node.body)} done"
+    if kind is While:
+        keyword = 'until' if node.until else 'while'
+        return f"{keyword} {_terminated(node.condition)} do {_terminated(node.body)} done"
+    if kind is Case:
+        items = ' '.join(
+            f"{' | '.join(_unparse_word(p) for p in patterns)}) "
+            f"{unparse(body) + ' ' if body is not None else ''};;"
+            for patterns, body in node.items
+        )
+        return f"case {_unparse_word(node.word)} in {items} esac"
+    if kind is Group:
+        if node.subshell:
+            return f"( {unparse(node.body)} )"
+        return f"{{ {_terminated(node.body)} }}"
+    if kind is Function:
+        return f"{node.name}() {unparse(node.body)}"
+    if kind is Redirected:
+        return unparse(node.node) + _unparse_redirects(node.redirects)
+    raise TypeError(f"not an AST node: {node!r}")
+
+
+PARSE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse(line: str):
+    """Parse one or more complete commands into an AST node, or None for a
+    blank line.  A lone pipeline comes back as a Pipeline, a list of
+    commands as a Sequence, and so on.
+
+    Results are cached by source text, so lines repeated from history or
+    scripts skip lexing and parsing entirely, and a loop body is parsed
+    once however often it runs.  Raises ParseError, or IncompleteInput if
+    the text ends inside a command.
+    """
+    return _parse(line)
+
+
+def is_complete(text):
+    """Whether text holds whole commands, rather than stopping inside a
+    quote or compound command, after `|`/`&&`/`||` or at a backslash"""
+    stripped = text.rstrip('\n')
+    if (len(stripped) - len(stripped.rstrip('\\'))) % 2:
+        return False
+    try:
+        parse(text)
+    except IncompleteInput:
+        return False
+    except ParseError:
+        pass
+    return True
+
+
+# The reserved word or operator that closes each compound command; '()'
+# stands for the parentheses of a function definition
+_CLOSERS = {'if': 'fi', 'for': 'done', 'while': 'done', 'until': 'done',
+            'case': 'esac', '{': '}', '(': ')', '()': ')'}
+# Reserved words after which another command can start
+_COMMAND_PREFIXES = frozenset(('if', 'then', 'elif', 'else', 'while', 'until', 'do', '{', '!'))
+# The reserved words, besides openers and its closer, that may start a
+# command inside each compound command
+_ALLOWED_IN = {'if': ('then', 'elif', 'else', '!'), 'for': ('do', '!'), 'while': ('do', '!'),
+               'until': ('do', '!')}
+# What may follow the words of a case or function definition
+_EXPECT_AFTER = {'case': 'case-in', 'case-in': 'pattern', 'function': 'command'}
+
+
+class InputBuffer:
+    """Gathers the lines of a script until they hold whole commands.
+
+    Each line is lexed once, on its own, and the compound commands it
+    opens and closes are kept on a stack. The whole buffer is parsed only
+    when nothing is left open, or when a reserved word is out of place and
+    parse() should report the error, so a loop body of n lines costs one
+    parse rather than n. A line that ends inside a quote or an expansion,
+    or at a backslash, is lexed again together with the lines that follow
+    it until the fragment is whole.
+
+    The stack only decides when parse() is worth calling. Where it does
+    not follow the grammar (a compound command after `time`, say) it errs
+    towards closing constructs early, which costs extra parses but never
+    runs a command late.
+    """
+
+    def __init__(self):
+        self._lines = []
+        self._fragment = ''  # trailing lines not yet lexed
+        self._open = []  # compound commands left open, innermost last
+        # What the next word may be: 'command', 'closed' (just after a
+        # compound command), 'other', 'pattern' (in a case), 'function' (a
+        # function name) or 'case'/'case-in' (the words before `in`)
+        self._expect = 'command'
+        self._last_op = None
+        self._misplaced = False
+
+    def add(self, line):
+        """Append line; return whether the buffer now holds whole commands"""
+        line = line if line.endswith('\n') else line + '\n'
+        self._lines.append(line)
+        self._fragment += line
+        stripped = self._fragment[:-1]
+        if (len(stripped) - len(stripped.rstrip('\\'))) % 2:
+            return False
+        try:
+            tokens = list(lex(self._fragment))
+        except IncompleteInput:
+            return False
+        self._fragment = ''
+        for token in tokens:
+            if token[0] == 'op':
+                self._operator(token[1])
+            else:
+                self._word(_reserved(token))
+        if self._open and not self._misplaced or self._last_op in ('|', '&&', '||'):
+            return False
+        self._misplaced = False
+        return is_complete(self.text)
+
+    @property
+    def text(self):
+        """The lines gathered so far"""
+        return ''.join(self._lines)
+
+    def take(self):
+        """Return the buffered text and start again with an empty buffer"""
+        text = self.text
+        self.__init__()
+        return text
+
+    def _operator(self, op):
+        top = self._open[-1] if self._open else None
+        if op != '\n':
+            self._last_op = op
+        if self._expect in ('pattern', 'case', 'case-in'):
+            if op == ')' and self._expect == 'pattern':
+                self._expect = 'command'
+            else:
+                self._misplaced |= op not in ('\n', '(', '|')
+        elif op == ';;':
+            self._misplaced |= top != 'case'
+            self._expect = 'pattern' if top == 'case' else 'command'
+        elif op == '\n':
+            self._expect = 'command'
+        elif op == '(':
+            self._open.append('(' if self._expect == 'command' else '()')
+            self._expect = 'command'
+        elif op == ')':
+            if top in ('(', '()'):
+                self._open.pop()
+            else:
+                self._misplaced = True
+            self._expect = 'closed' if top == '(' else 'command'
+        elif op in (';', '&', '&&', '||', '|'):
+            self._expect = 'command'
+        else:
+            self._expect = 'other'
+
+    def _word(self, word):
+        """Note a word, which is the reserved word given or None"""
+        top = self._open[-1] if self._open else None
+        self._last_op = None
+        expect = self._expect
+        if expect == 'pattern':
+            if word == 'esac' and top == 'case':
+                self._open.pop()
+                self._expect = 'closed'
+            return
+        if expect == 'closed' and word not in _LIST_END:
+            # only the end of an enclosing command may follow a compound one
+            self._misplaced = True
+            self._expect = 'other'
+        elif expect not in ('command', 'closed') or word is None:
+            self._misplaced |= expect == 'case-in' and word != 'in'
+            self._expect = _EXPECT_AFTER.get(expect, 'other')
+        elif word in _CLOSERS:
+            self._open.append(word)
+            self._expect = 'case' if word == 'case' else 'command' if word in _COMMAND_PREFIXES else 'other'
+        elif top is not None and _CLOSERS[top] == word:
+            self._open.pop()
+            self._expect = 'closed'
+        elif word == 'function':
+            self._expect = 'function'
+        else:
+            self._misplaced |= word not in _ALLOWED_IN.get(top, ('!',))
+            self._expect = 'command' if word in _COMMAND_PREFIXES else 'other'
+
+
+# --- Expansion -----------------------------------------------------------
+#
+# The text of each unquoted or double-quoted word part is compiled once
+# into a template: a tuple of literal strings and Param nodes, one per $NAME
+# or ${...}.  Templates are cached by text, and parsed lines are cached
+# too, so re-running a line only looks the parameters up again.
+
+class ExpansionError(Exception):
+    """Raised for a bad ${...} substitution or an unset ${NAME:?message}"""
+
+
+# name: the parameter; op: None, 'length', 'index' or the ${NAME<op>arg}
+# operator; arg: the text after the operator (or the index).
+Param = namedtuple('Param', 'name op arg', defaults=(None, None))
+# $(command) or `command`
+Subst = namedtuple('Subst', 'command')
+
+_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_EXPANSION_START = re.compile(r'[$`]')
+_SPECIAL = '?!#@*$0123456789'
+_BRACED = re.compile(r'([A-Za-z_][A-Za-z0-9_]*|\d+|[?!#@*$])(?:\[([^\]]*)\])?')
+_BRACE_OPERATOR = re.compile(r':-|-|:=|=|:\?|\?|:\+|\+|##|#|%%|%|//|/|:')
+TEMPLATE_CACHE_SIZE = 4096
+
+
+def is_name(text):
+    """Whether text is a valid variable name"""
+    return _NAME.fullmatch(text) is not None
+
+
+def _compile_braced(body):
+    if body == '#':
+        return Param('#')
+    if body.startswith('#') and _BRACED.fullmatch(body, 1):
+        return Param(body[1:], 'length')
+    m = _BRACED.match(body)
+    if not m:
+        raise ExpansionError(f"${{{body}}}: bad substitution")
+    if m.group(2) is not None:
+        if m.end() != len(body):
+            raise ExpansionError(f"${{{body}}}: bad substitution")
+        return Param(m.group(1), 'index', m.group(2))
+    if m.end() == len(body):
+        return Param(m.group(1))
+    op = _BRACE_OPERATOR.match(body, m.end())
+    if not op:
+        raise ExpansionError(f"${{{body}}}: bad substitution")
+    return Param(m.group(1), op.group(), body[op.end():])
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text: str):
+    """Compile text into a tuple of literal strings, Param and Subst nodes"""
+    segments = []
+    i = 0
+    n = len(text)
+    while i < n:
+        m = _EXPANSION_START.search(text, i)
+        if m is None:
+            segments.append(text[i:])
+            break
+        j = m.start()
+        if j > i:
+            segments.append(text[i:j])
+        nxt = text[j + 1:j + 2]
+        if text[j] == '`':
+            k = _backquote_end(text, j + 1)
+            segments.append(Subst(re.sub(r'\\([$`\\])', r'\1', text[j + 1:k - 1])))
+            i = k
+        elif nxt == '(':
+            k = _paren_end(text, j + 2)
+            segments.append(Subst(text[j + 2:k - 1]))
+            i = k
+        elif nxt == '{':
+            k = _brace_end(text, j + 2)
+            segments.append(_compile_braced(text[j + 2:k - 1]))
+            i = k
+        elif nxt and nxt in _SPECIAL:
+            segments.append(Param(nxt))
+            i = j + 2
+        else:
+            m = _NAME.match(text, j + 1)
+            if m:
+                segments.append(Param(m.group()))
+                i = m.end()
+            else:
+                segments.append('$')
+                i = j + 1
+    return tuple(segments)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _arg_word(text: str):
+    """The word after a ${NAME<op>} operator, with its quotes and $s"""
+    return Word(_scan_word(text, 0, _ARG_PLAIN)[0])
+
+
+def _positional(name, shell):
+    """Expand $0-$9, $#, $@ and $* from the shell's argv"""
+    argv = getattr(shell, 'argv', None) or ['pyshell']
+    if name == '#':
+        return str(len(argv) - 1)
+    if name in ('@', '*'):
+        return ' '.join(argv[1:])
+    index = int(name)
+    return argv[index] if index < len(argv) else None
+
+
+def _lookup(name, shell):
+    """Return the value of a parameter, or None if it is unset"""
+    if name == '?':
+        return str(getattr(shell, 'last_exit_code', 0))
+    if name == '!':
+        pid = getattr(shell, 'last_background_pid', None)
+        return None if pid is None else str(pid)
+    if name == '$':
+        return str(os.getpid())
+    if name[0].isdigit() or name in ('#', '@', '*'):
+        return _positional(name, shell)
+    if name == 'PIPESTATUS':
+        return ' '.join(str(n) for n in getattr(shell, 'pipestatus', [0]))
+    variables = getattr(shell, 'variables', None)
+    if variables is None:
+        return os.environ.get(name)
+    return variables.get(name)
+
+
+def _assign(name, value, shell):
+    if not _NAME.fullmatch(name):
+        raise ExpansionError(f"${name}: cannot assign in this way")
+    variables = getattr(shell, 'variables', None)
+    if variables is None:
+        os.environ[name] = value
+    else:
+        variables.set(name, value)
+
+
+def _glob_regex(pattern):
+    """Translate a shell pattern into an unanchored regular expression"""
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        char = pattern[i]
+        if char == '*':
+            out.append('.*')
+        elif char == '?':
+            out.append('.')
+        elif char == '[':
+            j = pattern.find(']', i + 2)
+            if j < 0:
+                out.append(r'\[')
+            else:
+                body = pattern[i + 1:j]
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', r'\\') + ']')
+                i = j
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return ''.join(out)
+
+
+def _trim(value, op, pattern):
+    """${NAME#pat}, ${NAME##pat}, ${NAME%pat} and ${NAME%%pat}"""
+    n = len(value)
+    if op[0] == '#':
+        ends = range(n + 1) if op == '#' else range(n, -1, -1)
+        for k in ends:
+            if fnmatchcase(value[:k], pattern):
+                return value[k:]
+    else:
+        starts = range(n, -1, -1) if op == '%' else range(n + 1)
+        for k in starts:
+            if fnmatchcase(value[k:], pattern):
+                return value[:k]
+    return value
+
+
+def _replace(value, op, arg, shell):
+    """${NAME/pat/rep} and ${NAME//pat/rep}; pat may start with # or % to anchor"""
+    pattern, _, replacement = arg.partition('/')
+    anchor = ''
+    if pattern[:1] in ('#', '%'):
+        anchor, pattern = pattern[0], pattern[1:]
+    pattern = expand_word(_arg_word(pattern), shell)
+    replacement = expand_word(_arg_word(replacement), shell)
+    if not pattern:
+        return value
+    regex = _glob_regex(pattern)
+    if anchor == '#':
+        regex = '^' + regex
+    elif anchor == '%':
+        regex = regex + '$'
+    return re.sub(regex, lambda m: replacement, value, count=0 if op == '//' else 1, flags=re.S)
+
+
+def _substring(name, value, arg):
+    """${NAME:offset} and ${NAME:offset:length}"""
+    try:
+        fields = [int(field) for field in arg.split(':', 1)]
+    except ValueError:
+        raise ExpansionError(f"${{{name}:{arg}}}: bad substitution") from None
+    start = fields[0] if fields[0] >= 0 else max(0, len(value) + fields[0])
+    if len(fields) == 1:
+        return value[start:]
+    length = fields[1]
+    end = start + length if length >= 0 else len(value) + length
+    if end < start:
+        raise ExpansionError(f"{arg.split(':', 1)[1]}: substring expression < 0")
+    return value[start:end]
+
+
+def _index(param, value, shell):
+    """${NAME[n]}, ${NAME[@]}: PIPESTATUS is an array, other names scalars"""
+    if param.name == 'PIPESTATUS':
+        items = [str(n) for n in getattr(shell, 'pipestatus', [0])]
+    else:
+        items = [] if value is None else [value]
+    if param.arg in ('@', '*'):
+        return ' '.join(items)
+    try:
+        index = int(param.arg)
+    except ValueError:
+        raise ExpansionError(f"{param.arg}: bad array subscript") from None
+    return items[index] if -len(items) <= index < len(items) else ''
+
+
+def expand_param(param, shell):
+    """Return the expansion of one Param"""
+    value = _lookup(param.name, shell)
+    op = param.op
+    if op is None:
+        return '' if value is None else value
+    if op == 'length':
+        return str(len(value or ''))
+    if op == 'index':
+        return _index(param, value, shell)
+
+    if op in (':-', '-', ':=', '=', ':?', '?', ':+', '+'):
+        missing = value is None or (op[0] == ':' and value == '')
+        kind = op[-1]
+        if kind == '+':
+            return '' if missing else expand_word(_arg_word(param.arg), shell)
+        if not missing:
+            return value
+        word = expand_word(_arg_word(param.arg), shell)
+        if kind == '=':
+            _assign(param.name, word, shell)
+        elif kind == '?':
+            raise ExpansionError(f"{param.name}: {word or 'parameter null or not set'}")
+        return word
+
+    value = value or ''
+    if op in ('#', '##', '%', '%%'):
+        return _trim(value, op, expand_word(_arg_word(param.arg), shell))
+    if op in ('/', '//'):
+        return _replace(value, op, param.arg, shell)
+    return _substring(param.name, value, param.arg)
+
+
+def substitute(command, shell):
+    """Run command and return its output with trailing newlines removed"""
+    from . import execute
+    return execute.command_substitution(shell, command)
+
+
+def _expand_segment(segment, shell):
+    if segment.__class__ is Param:
+        return expand_param(segment, shell)
+    return substitute(segment.command, shell)
+
+
+def _expand_text(text: str, shell):
+    """Expand $NAME, ${...}, the special parameters and command substitutions in text"""
+    if '$' not in text and '`' not in text:
+        return text
+    return ''.join(
+        segment if segment.__class__ is str else _expand_segment(segment, shell)
+        for segment in compile_template(text)
+    )
+
+
+def expand_word(word, shell):
+    """Expand variables in the unquoted and double-quoted parts of word"""
+    return ''.join(
+        _expand_text(text, shell) if quote in ('', '"') else text
+        for text, quote in word.parts
+    )
+
+
+_DEFAULT_IFS = ' \t\n'
+
+
+@lru_cache(maxsize=16)
+def _ifs_split(ifs):
+    return re.compile('[' + re.escape(ifs) + ']+').split
+
+
+def _ifs_splitter(shell):
+    """Return the function splitting expansion results on $IFS, or None"""
+    ifs = _lookup('IFS', shell)
+    if ifs == '':
+        return None
+    return _ifs_split(_DEFAULT_IFS if ifs is None else ifs)
+
+
+def _word_fields(word, shell, split):
+    """Expand word into fields, each a list of (text, quoted) pieces.
+
+    The results of unquoted expansions are split into separate fields with
+    split (from _ifs_splitter), and "$@" becomes one field per positional
+    parameter.  A word that expands to no text and had no quotes yields no
+    fields at all.
+    """
+    fields = []
+    current = []
+    started = False
+    for text, quote in word.parts:
+        if quote == '"':
+            if text in ('$@', '${@}'):
+                args = (getattr(shell, 'argv', None) or ['pyshell'])[1:]
+                for n, arg in enumerate(args):
+                    if n:
+                        fields.append(current)
+                        current = []
+                    current.append((arg, True))
+                    started = True
+                continue
+            current.append((_expand_text(text, shell), True))
+            started = True
+        elif quote:
+            current.append((text, True))
+            started = True
+        elif '$' not in text and '`' not in text:
+            current.append((text, False))
+            started = True
+        else:
+            for segment in compile_template(text):
+                if segment.__class__ is str:
+                    current.append((segment, False))
+                    started = True
+                    continue
+                value = _expand_segment(segment, shell)
+                pieces = split(value) if split is not None and value else (value,)
+                if pieces[0]:
+                    current.append((pieces[0], False))
+                    started = True
+                for piece in pieces[1:]:
+                    if started:
+                        fields.append(current)
+                        current = []
+                        started = False
+                    if piece:
+                        current.append((piece, False))
+                        started = True
+    if started:
+        fields.append(current)
+    return fields
+
+
+def expand_words(words, shell):
+    """Expand a command's words into argv.
+
+    Unquoted expansions are split into fields on $IFS, and a word that is
+    entirely unquoted and expands to nothing is dropped.  Fields with
+    unquoted glob characters are replaced by the sorted paths they match,
+    or kept as they are if nothing matches; directories read for one
+    command are cached across its words.
+    """
+    options = getattr(shell, 'options', None) or {}
+    noglob = options.get('noglob', False)
+    globstar = options.get('globstar', False)
+    cache = None
+    split = _ifs_splitter(shell)
+    # With the default IFS no literal unquoted text can hold a separator,
+    # so a whole unquoted word can be expanded first and split after.
+    default_ifs = split is _ifs_split(_DEFAULT_IFS)
+
+    argv = []
+    for word in words:
+        if len(word.parts) == 1:
+            # Fast paths for the common single-part words
+            text, quote = word.parts[0]
+            if quote == '':
+                if '$' in text or '`' in text:
+                    if not default_ifs:
+                        fields = _word_fields(word, shell, split)
                     else:
-                        j = i + 1
-                        while j < len(token) and (token[j].isalnum() or token[j] == '_'):
-                            j += 1
-                        var_name = token[i + 1:j]
-                        parts.append(os.environ.get(var_name, ''))
-                        i = j
+                        value = _expand_text(text, shell)
+                        if ' ' in value or '\t' in value or '\n' in value:
+                            fields = [[(piece, False)] for piece in split(value) if piece]
+                        elif value:
+                            fields = [[(value, False)]]
+                        else:
+                            continue
+                elif noglob or not globbing.has_magic(text):
+                    argv.append(text)
+                    continue
                 else:
-                    parts.append(token[i])
-                    i += 1
-            expanded.append(''.join(parts))
+                    fields = [[(text, False)]]
+            elif quote == '"' and text not in ('$@', '${@}'):
+                argv.append(_expand_text(text, shell))
+                continue
+            elif quote != '"':
+                argv.append(text)
+                continue
+            else:
+                fields = _word_fields(word, shell, split)
         else:
-            expanded.append(token)
-    return expanded
+            fields = _word_fields(word, shell, split)
+
+        for field in fields:
+            if len(field) == 1:
+                value, quoted = field[0]
+                if quoted or noglob or not globbing.has_magic(value):
+                    argv.append(value)
+                    continue
+                pattern = value
+            else:
+                value = ''.join(text for text, _ in field)
+                if noglob or not any(not quoted and globbing.has_magic(text) for text, quoted in field):
+                    argv.append(value)
+                    continue
+                pattern = ''.join(text if not quoted else globbing.escape(text) for text, quoted in field)
+            if cache is None:
+                cache = globbing.DirCache()
+            matches = globbing.glob(pattern, cache, globstar)
+            argv.extend(matches or (value,))
+    return argv
+
+
+def expand_pattern(word, shell):
+    """Expand word as a `case` pattern: quoted parts only match themselves"""
+    return ''.join(
+        _expand_text(text, shell) if quote == '' else
+        globbing.escape(_expand_text(text, shell) if quote == '"' else text)
+        for text, quote in word.parts
+    )
+
+
+_ASSIGNMENT = re.compile(r'[A-Za-z_][A-Za-z0-9_]*=')
+
+
+def split_assignments(words, shell):
+    """Split leading NAME=value words off a command.
+
+    Returns ([(name, expanded value), ...], remaining words).  Only a word
+    whose name and `=` are unquoted is an assignment.
+    """
+    assignments = []
+    for i, word in enumerate(words):
+        text, quote = word.parts[0] if word.parts else ('', "'")
+        m = _ASSIGNMENT.match(text) if quote == '' else None
+        if m is None:
+            return assignments, words[i:]
+        value = Word(((text[m.end():], ''),) + word.parts[1:])
+        assignments.append((m.group()[:-1], expand_word(value, shell)))
+    return assignments, ()
+
+
+# --- Token-list helpers --------------------------------------------------
+
+def tokenize(line: str):
+    """Split a line into words and operators, respecting quotes"""
+    tokens = []
+    for token in lex(line):
+        if token[0] == 'word':
+            tokens.append(word_text(token[1]))
+        else:
+            _, op, fd = token
+            tokens.append(op if fd == OPERATORS[op] else f"{fd}{op}")
+    return tokens
+
+
+def expand_variables(tokens: list, shell):
+    """Expand environment variables in tokens"""
+    return [_expand_text(token, shell) for token in tokens]
 
 
 def parse_redirections(tokens: list):
@@ -0,0 +1,354 @@
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from . import readline_setup
+
+DEFAULT_PS1 = '\\w \\$ '
+
+# How long a prompt waits for its expensive segments before it is shown
+# with their last known values, which are filled in when they arrive.
+BUDGET = 0.05
+
+# Directories searched for prompt segment plugins, separated like PATH;
+# each NAME.py in them provides the segment \{NAME}.
+SEGMENT_PATH_VAR = 'PYSHELL_SEGMENTS'
+DEFAULT_SEGMENT_PATH = '~/.pyshell/segments'
+
+# Sent by the segment thread to the main thread to redraw a prompt that is
+# already on screen.
+REFRESH_SIGNAL = getattr(signal, 'SIGUSR1', None)
+
+
+class Segment:
+    """A named piece of the prompt, used in PS1 as \\{name}.
+
+    function(shell, cwd) returns its text. An expensive segment runs on
+    the segment thread, and its last value for each directory is shown
+    until a fresh one is ready.
+    """
+
+    __slots__ = ('name', 'function', 'expensive')
+
+    def __init__(self, name, function, expensive=False):
+        self.name = name
+        self.function = function
+        self.expensive = expensive
+
+
+_segments = {}
+
+
+def register(name, function, expensive=False):
+    """Add or replace the segment \\{name}"""
+    _segments[name] = Segment(name, function, expensive)
+
+
+def _plugin_segment(name):
+    """Load \\{name} from NAME.py in a segment directory, if there is one"""
+    from . import registry
+    path = os.environ.get(SEGMENT_PATH_VAR, DEFAULT_SEGMENT_PATH)
+    for directory in path.split(os.pathsep):
+        filename = os.path.join(os.path.expanduser(directory), name + '.py')
+        if not directory or not os.path.isfile(filename):
+            continue
+        try:
+            module = registry._load_file(f'pyshell_segment_{name}', filename)
+            register(name, module.render, bool(getattr(module, 'EXPENSIVE', True)))
+        except Exception as e:
+            print(f"pyshell: prompt segment {name}: {e}", file=sys.stderr)
+            register(name, lambda shell, cwd: '')
+        return _segments[name]
+    return None
+
+
+def segment(name):
+    """Return the Segment called name; an unknown name renders as nothing"""
+    found = _segments.get(name)
+    if found is None:
+        found = _plugin_segment(name)
+        if found is None:
+            _segments[name] = found = Segment(name, lambda shell, cwd: '')
+    return found
+
+
+def _home_relative(cwd):
+    home = os.path.expanduser('~')
+    if cwd == home or cwd.startswith(home.rstrip('/') + '/'):
+        return '~' + cwd[len(home):]
+    return cwd
+
+
+def _status(shell, cwd):
+    return str(shell.last_exit_code) if shell.last_exit_code else ''
+
+
+def _jobs(shell, cwd):
+    return str(len(shell.jobs.jobs)) if shell.jobs.jobs else ''
+
+
+def _git_dir(cwd):
+    directory = cwd
+    while True:
+        candidate = os.path.join(directory, '.git')
+        if os.path.exists(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def _git(shell, cwd):
+    """The current branch (or short commit), with * when there are changes"""
+    git_dir = _git_dir(cwd)
+    if git_dir is None:
+        return ''
+    if os.path.isfile(git_dir):
+        # A worktree or submodule: .git names the real directory
+        try:
+            with open(git_dir) as f:
+                git_dir = os.path.join(os.path.dirname(git_dir), f.read().split('gitdir:', 1)[1].strip())
+        except (OSError, IndexError):
+            return ''
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+    except OSError:
+        return ''
+    branch = head[len('ref: refs/heads/'):] if head.startswith('ref: refs/heads/') else head[:7]
+
+    import subprocess
+    try:
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                 cwd=cwd, capture_output=True, timeout=2).stdout
+    except (OSError, subprocess.SubprocessError):
+        changes = b''
+    return branch + ('*' if changes else '')
+
+
+register('status', _status)
+register('jobs', _jobs)
+register('git', _git, expensive=True)
+
+
+def _clock(fmt):
+    return lambda shell, cwd: time.strftime(fmt)
+
+
+# The bash PS1 escapes, as functions of (shell, cwd)
+ESCAPES = {
+    'u': lambda shell, cwd: _user(),
+    'h': lambda shell, cwd: _host().split('.')[0],
+    'H': lambda shell, cwd: _host(),
+    'w': lambda shell, cwd: _home_relative(cwd),
+    'W': lambda shell, cwd: '~' if _home_relative(cwd) == '~' else os.path.basename(cwd) or '/',
+    '$': lambda shell, cwd: '#' if hasattr(os, 'geteuid') and os.geteuid() == 0 else '$',
+    '?': _status,
+    'j': lambda shell, cwd: str(len(shell.jobs.jobs)),
+    's': lambda shell, cwd: 'pyshell',
+    't': _clock('%H:%M:%S'),
+    'T': _clock('%I:%M:%S'),
+    '@': _clock('%I:%M %p'),
+    'A': _clock('%H:%M'),
+    'd': _clock('%a %b %d'),
+}
+
+# Escapes that stand for fixed text; \[ and \] mark non-printing text for readline.
+LITERALS = {'n': '\n', '\\': '\\', 'e': '\x1b', 'a': '\a', '[': '\001', ']': '\002'}
+
+
+@lru_cache(maxsize=None)
+def _user():
+    import getpass
+    try:
+        return getpass.getuser()
+    except Exception:
+        return ''
+
+
+@lru_cache(maxsize=None)
+def _host():
+    import socket
+    return socket.gethostname()
+
+
+@lru_cache(maxsize=32)
+def compile_ps1(ps1):
+    """Split PS1 into literal text and the escapes and segments it uses:
+    a tuple of strings and ('escape', char) / ('segment', name) pairs"""
+    parts = []
+    pos = 0
+    while True:
+        start = ps1.find('\\', pos)
+        if start < 0 or start + 1 == len(ps1):
+            break
+        parts.append(ps1[pos:start])
+        code = ps1[start + 1]
+        pos = start + 2
+        if code in LITERALS:
+            parts.append(LITERALS[code])
+        elif code in ESCAPES:
+            parts.append(('escape', code))
+        elif code == '{' and ps1[pos:ps1.find('}', pos)].isidentifier():
+            end = ps1.index('}', pos)
+            parts.append(('segment', ps1[pos:end]))
+            pos = end + 1
+        else:
+            parts.append(ps1[start:pos])
+    parts.append(ps1[pos:])
+    return tuple(part for part in parts if part)
+
+
+class PromptEngine:
+    """Renders the prompt from $PS1 without waiting on slow segments.
+
+    Expensive segments run on one background thread, each at most once at
+    a time per directory. render() waits up to BUDGET for them and then
+    shows their last value for the directory. When a value that is on
+    screen changes later, the segment thread signals the main thread,
+    which redraws the prompt in place through readline.
+    """
+
+    def __init__(self, shell, budget=BUDGET):
+        self.shell = shell
+        self.budget = budget
+        self._cache = {}  # (segment name, cwd) -> last value
+        self._pending = set()
+        self._lock = threading.Condition()
+        self._queue = deque()
+        self._thread = None
+        self._rendered = None  # (parts, cwd) of the last prompt rendered
+        self._showing = None  # (parts, cwd, prompt) while it is on screen
+        self._redraw = None
+        if REFRESH_SIGNAL is not None and threading.current_thread() is threading.main_thread():
+            signal.signal(REFRESH_SIGNAL, self._refresh)
+
+    def _ps1(self):
+        value = self.shell.variables.get('PS1')
+        return DEFAULT_PS1 if value is None else value
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._lock.wait()
+                item, cwd = self._queue.popleft()
+            try:
+                value = item.function(self.shell, cwd)
+            except Exception:
+                value = ''
+            with self._lock:
+                key = (item.name, cwd)
+                changed = self._cache.get(key) != value
+                self._cache[key] = value
+                self._pending.discard(key)
+                self._lock.notify_all()
+                showing = self._showing
+            if changed and showing is not None and showing[1] == cwd:
+                try:
+                    signal.pthread_kill(threading.main_thread().ident, REFRESH_SIGNAL)
+                except (AttributeError, OSError, TypeError):
+                    pass
+
+    def _submit(self, item, cwd):
+        key = (item.name, cwd)
+        with self._lock:
+            if key in self._pending:
+                return key
+            self._pending.add(key)
+            self._queue.append((item, cwd))
+            self._lock.notify_all()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name='pyshell-prompt', daemon=True)
+            self._thread.start()
+        return key
+
+    def _expand(self, parts, cwd):
+        out = []
+        for part in parts:
+            if part.__class__ is str:
+                out.append(part)
+            elif part[0] == 'escape':
+                out.append(ESCAPES[part[1]](self.shell, cwd))
+            else:
+                item = segment(part[1])
+                if item.expensive:
+                    with self._lock:
+                        out.append(self._cache.get((item.name, cwd), ''))
+                else:
+                    try:
+                        out.append(item.function(self.shell, cwd))
+                    except Exception:
+                        pass
+        return ''.join(out)
+
+    def render(self):
+        """Return the prompt to show now, refreshing expensive segments"""
+        try:
+            cwd = os.getcwd()
+        except OSError:
+            cwd = ''
+        parts = compile_ps1(self._ps1())
+        keys = [self._submit(segment(part[1]), cwd) for part in parts
+                if part.__class__ is tuple and part[0] == 'segment' and segment(part[1]).expensive]
+        if keys:
+            deadline = time.monotonic() + self.budget
+            with self._lock:
+                while any(key in self._pending for key in keys):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+        self._rendered = (parts, cwd)
+        return self._expand(parts, cwd)
+
+    def input(self, prompt):
+        """input() with the prompt from render(), redrawn in place if one
+        of its segments changes while it is on screen"""
+        self._showing = (*self._rendered, prompt) if self._rendered else None
+        try:
+            return input(prompt)
+        finally:
+            self._showing = None
+
+    def _refresh(self, sig, frame):
+        showing = self._showing
+        if showing is None:
+            return
+        parts, cwd, old = showing
+        prompt = self._expand(parts, cwd)
+        if prompt == old:
+            return
+        self._showing = (parts, cwd, prompt)
+        redraw = self._redisplay()
+        if redraw is not None:
+            redraw(prompt)
+
+    def _redisplay(self):
+        """Return a function that swaps readline's prompt for a new one and
+        redraws the line, or None where readline cannot do that"""
+        if self._redraw is None:
+            self._redraw = False
+            rl = readline_setup.readline
+            if rl is not None and 'libedit' not in (rl.__doc__ or ''):
+                try:
+                    import ctypes
+                    lib = ctypes.CDLL(rl.__file__)
+                    set_prompt = lib.rl_set_prompt
+                    set_prompt.argtypes = [ctypes.c_char_p]
+                    update = lib.rl_forced_update_display
+                except (AttributeError, OSError):
+                    pass
+                else:
+                    encoding = sys.stdout.encoding or 'utf-8'
+
+                    def redraw(prompt):
+                        set_prompt(prompt.encode(encoding, 'replace'))
+                        update()
+                    self._redraw = redraw
+        return self._redraw or None
@@ -1,27 +1,46 @@
-import os
-import atexit
-try:
-    import readline
-    HAS_READLINE = True
-except Exception:
-    readline = None
-    HAS_READLINE = False
-
-
-def setup_readline(shell):
-    """Configure readline for history and autocompletion"""
-    if not HAS_READLINE:
-        return
+# readline is imported on first use by load_readline(), so batch shells and
+# the time to the first prompt do not pay for it.
+readline = None
+HAS_READLINE = None
+
 
-    if os.path.exists(shell.history_file):
+def load_readline():
+    """Import readline (or pyreadline3) once; return it, or None if unavailable"""
+    global readline, HAS_READLINE
+    if HAS_READLINE is None:
         try:
-            readline.read_history_file(shell.history_file)
+            import readline as _readline
+            readline = _readline
+            HAS_READLINE = True
         except Exception:
-            pass
+            HAS_READLINE = False
+    return readline
 
-    readline.set_history_length(1000)
 
-    atexit.register(lambda: save_history(shell))
+def load_history(shell):
+    """Load the shell's history store and hand its entries to readline"""
+    shell.history.load()
+    if readline is None:
+        return
+    # Reading the file in C is several times faster than add_history() per
+    # entry; set_history_length() then drops all but the newest entries.
+    try:
+        readline.clear_history()
+        readline.read_history_file(shell.history.path)
+        readline.set_history_length(shell.history.size)
+    except Exception:
+        pass
+
+
+def setup_readline(shell, deferred=None):
+    """Configure readline for history and autocompletion.
+
+    deferred, if given, is called along with loading the history file from
+    readline's pre-input hook, i.e. once the first prompt is on screen.
+    Where that hook is missing both happen immediately.
+    """
+    if load_readline() is None:
+        return
 
     readline.set_completer(lambda text, state: shell.completer(text, state))
     try:
@@ -34,18 +53,16 @@ def setup_readline(shell):
     except Exception:
         pass
 
+    def first_prompt():
+        readline.set_pre_input_hook(None)
+        load_history(shell)
+        if deferred is not None:
+            deferred()
+
+    try:
+        readline.set_pre_input_hook(first_prompt)
+    except Exception:
+        load_history(shell)
+        if deferred is not None:
+            deferred()
 
-def save_history(shell):
-    """Save command history to file"""
-    if HAS_READLINE and readline is not None:
-        try:
-            readline.write_history_file(shell.history_file)
-        except Exception:
-            pass
-    else:
-        try:
-            with open(shell.history_file, 'w') as f:
-                for cmd in getattr(shell, 'history', [])[-1000:]:
-                    f.write(cmd + '\n')
-        except Exception:
-            pass
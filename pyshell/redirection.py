@@ -0,0 +1,253 @@
+import os
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import parsing
+from . import streams
+
+# open(2) flags for each operator that opens a file
+OPEN_FLAGS = {
+    '<': os.O_RDONLY,
+    '>': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    '>>': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+    '&>': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    '&>>': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+}
+
+# Redirections may name fds 0-9, as POSIX requires. Fds the shell opens or
+# saves for them are moved to FIRST_PRIVATE_FD and above, out of their way.
+MAX_USER_FD = 9
+FIRST_PRIVATE_FD = 10
+
+# A here-string up to this size is written into a pipe, which never blocks;
+# a larger one goes through an unlinked temporary file.
+PIPE_CAPACITY = 64 * 1024
+
+
+class RedirectionError(Exception):
+    """Raised when a redirection cannot be performed"""
+
+
+def _private(fd):
+    """Move fd to FIRST_PRIVATE_FD or above (close-on-exec), returning it"""
+    if fd >= FIRST_PRIVATE_FD or fcntl is None:
+        return fd
+    try:
+        return _copy(fd)
+    finally:
+        os.close(fd)
+
+
+def _is_open(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def _here_string(text):
+    """Return a readable fd holding text"""
+    data = text.encode()
+    if len(data) <= PIPE_CAPACITY:
+        read_fd, write_fd = os.pipe()
+        try:
+            streams.write_all(write_fd, data)
+        finally:
+            os.close(write_fd)
+        return read_fd
+    import tempfile
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        fd = os.dup(f.fileno())
+    os.lseek(fd, 0, os.SEEK_SET)
+    return fd
+
+
+class Redirections:
+    """The fds a command runs with: which fd each of its fds is a copy of.
+
+    `fds` maps a target fd to the source fd it should refer to, or to None
+    for a closed fd; fds not in the map are inherited as they are. Sources
+    the shell opened are owned by this object and released by close().
+    """
+
+    def __init__(self, base=None, owned=()):
+        self.fds = dict(base or {})
+        self.owned = list(owned)
+
+    def source(self, fd):
+        """Return the fd that fd will be a copy of, or None if closed"""
+        return self.fds.get(fd, fd)
+
+    def _open(self, path, flags):
+        try:
+            fd = os.open(path, flags, 0o666)
+        except OSError as e:
+            raise RedirectionError(f"{path}: {e.strerror}") from None
+        fd = _private(fd)
+        self.owned.append(fd)
+        return fd
+
+    def add(self, redirect, shell):
+        """Apply one parsed Redirect on top of the ones before it"""
+        fd, op = redirect.fd, redirect.op
+        if fd > MAX_USER_FD:
+            raise RedirectionError(f"{fd}: bad file descriptor")
+        target = parsing.expand_word(redirect.target, shell)
+
+        if op in ('>&', '<&'):
+            if target == '-':
+                self.fds[fd] = None
+                return
+            if not target.isdigit():
+                if op == '<&':
+                    raise RedirectionError(f"{target}: ambiguous redirect")
+                op = '&>'
+            else:
+                source = int(target)
+                if source > MAX_USER_FD:
+                    raise RedirectionError(f"{source}: bad file descriptor")
+                resolved = self.source(source)
+                if resolved is None or (source not in self.fds and not _is_open(source)):
+                    raise RedirectionError(f"{source}: bad file descriptor")
+                self.fds[fd] = resolved
+                return
+
+        if op == '<<<':
+            source = _private(_here_string(target + '\n'))
+            self.owned.append(source)
+            self.fds[fd] = source
+            return
+        if not target:
+            raise RedirectionError("ambiguous redirect")
+        source = self._open(target, OPEN_FLAGS[op])
+        if op in ('&>', '&>>'):
+            self.fds[1] = self.fds[2] = source
+        else:
+            self.fds[fd] = source
+
+    def close(self):
+        """Release the fds the shell opened for these redirections"""
+        owned, self.owned = self.owned, []
+        for fd in owned:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def resolve(redirects, shell, base=None, owned=()):
+    """Build the Redirections for parsed Redirects applied in order.
+
+    base maps fds to the sources a pipeline gives the command, and owned
+    lists those of them that the result takes ownership of.  On error the
+    owned fds are closed and RedirectionError is raised.
+    """
+    result = Redirections(base, owned)
+    try:
+        for redirect in redirects:
+            result.add(redirect, shell)
+    except (RedirectionError, parsing.ExpansionError):
+        result.close()
+        raise
+    return result
+
+
+def _clobbered(fds):
+    """The sources in fds (target -> source) that a dup2 to another target
+    would overwrite before they are copied"""
+    moved = []
+    for target, source in fds.items():
+        if (source is not None and source != target and source in fds
+                and fds[source] != source and source not in moved):
+            moved.append(source)
+    return moved
+
+
+def dup_actions(fds):
+    """Order the dup2/close steps that make fds (target -> source) take effect
+    in a child that has just been created, as posix_spawn file actions.
+
+    A source that is itself a target changed by the map is first copied to
+    a spare fd above all the others, so `2>&1 1>file` and swaps like
+    `3>&1 1>&2 2>&3` see each fd as it was before any step. Returns a list
+    of ('dup2', source, target) and ('close', fd) steps.
+    """
+    spare = max([FIRST_PRIVATE_FD - 1, *fds, *(s for s in fds.values() if s is not None)]) + 1
+    moved = {}
+    actions = []
+    for source in _clobbered(fds):
+        moved[source] = spare
+        actions.append(('dup2', source, spare))
+        spare += 1
+    for target, source in fds.items():
+        source = moved.get(source, source)
+        if source is None:
+            actions.append(('close', target))
+        elif source != target:
+            actions.append(('dup2', source, target))
+    for fd in moved.values():
+        actions.append(('close', fd))
+    return actions
+
+
+def _copy(fd):
+    """Return a close-on-exec copy of fd numbered FIRST_PRIVATE_FD or above"""
+    if fcntl is None:
+        return os.dup(fd)
+    return fcntl.fcntl(fd, fcntl.F_DUPFD_CLOEXEC, FIRST_PRIVATE_FD)
+
+
+def apply(fds):
+    """Carry out fds (target -> source) on this process's own fds"""
+    moved = {source: _copy(source) for source in _clobbered(fds)}
+    try:
+        for target, source in fds.items():
+            source = moved.get(source, source)
+            if source is None:
+                try:
+                    os.close(target)
+                except OSError:
+                    pass
+            elif source != target:
+                os.dup2(source, target)
+    finally:
+        for fd in moved.values():
+            os.close(fd)
+
+
+def redirect_shell(redirections):
+    """Apply redirections to the shell itself, for builtins, functions and
+    compound commands; return what restore() needs to undo them"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = []
+    for target in redirections.fds:
+        try:
+            copy = _copy(target)
+        except OSError:
+            copy = None
+        saved.append((target, copy))
+    apply(redirections.fds)
+    return saved
+
+
+def restore(saved):
+    """Undo redirect_shell()"""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for target, copy in saved:
+        if copy is None:
+            try:
+                os.close(target)
+            except OSError:
+                pass
+        else:
+            os.dup2(copy, target)
+            os.close(copy)
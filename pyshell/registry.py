@@ -0,0 +1,157 @@
+import importlib
+import importlib.util
+import os
+import sys
+
+# Directories searched for plugin builtins, separated like PATH; each
+# NAME.py in them provides the builtin NAME.
+PLUGIN_PATH_VAR = 'PYSHELL_PLUGINS'
+DEFAULT_PLUGIN_PATH = '~/.pyshell/plugins'
+
+
+class BuiltinLoadError(Exception):
+    """Raised when the module providing a builtin cannot be loaded"""
+
+
+class Builtin:
+    """A builtin command, loaded from its module the first time it is needed.
+
+    Every builtin is called as function(shell, args, stdin, stdout, stderr)
+    and returns its exit status. A `stage` builtin only reads stdin and
+    writes stdout and stderr, so it can run on a thread as a pipeline stage;
+    any other builtin may change the shell and is forked in a pipeline.
+    """
+
+    __slots__ = ('name', 'module', 'attr', '_stage', '_function', '_path')
+
+    def __init__(self, name, module, attr, stage=None, path=None):
+        self.name = name
+        self.module = module
+        self.attr = attr
+        self._stage = stage
+        self._path = path
+        self._function = None
+
+    def load(self):
+        """Import the builtin's module, once, and return its function"""
+        if self._function is None:
+            try:
+                if self._path is not None:
+                    module = _load_file(self.module, self._path)
+                else:
+                    module = importlib.import_module(self.module, __package__)
+                function = getattr(module, self.attr)
+            except Exception as e:
+                raise BuiltinLoadError(f"{self.name}: cannot load builtin: {e}") from None
+            if self._stage is None:
+                self._stage = bool(getattr(module, 'STAGE', True))
+            self._function = function
+        return self._function
+
+    @property
+    def stage(self):
+        if self._stage is None:
+            self.load()
+        return self._stage
+
+    def __call__(self, shell, args, stdin=None, stdout=None, stderr=None):
+        return self.load()(shell, args,
+                           stdin=stdin if stdin is not None else sys.stdin,
+                           stdout=stdout if stdout is not None else sys.stdout,
+                           stderr=stderr if stderr is not None else sys.stderr)
+
+
+def _load_file(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+    return module
+
+
+class Registry:
+    """Every builtin by name: the single source for dispatch, `type` and
+    completion.
+
+    Plugin directories are listed the first time a name is looked up that
+    is not a core builtin, but a plugin's module is only imported when the
+    plugin is first run, so installed plugins cost nothing at start-up.
+    """
+
+    def __init__(self, core):
+        self._core = {builtin.name: builtin for builtin in core}
+        self._plugins = None
+
+    def _plugin_dirs(self):
+        path = os.environ.get(PLUGIN_PATH_VAR, DEFAULT_PLUGIN_PATH)
+        return [os.path.expanduser(d) for d in path.split(os.pathsep) if d]
+
+    def plugins(self):
+        """Return the plugin builtins, listing the plugin directories once"""
+        if self._plugins is None:
+            found = {}
+            for directory in self._plugin_dirs():
+                try:
+                    with os.scandir(directory) as it:
+                        names = sorted(entry.name for entry in it)
+                except OSError:
+                    continue
+                for filename in names:
+                    name, ext = os.path.splitext(filename)
+                    if ext != '.py' or name in found or name in self._core or name.startswith('_'):
+                        continue
+                    found[name] = Builtin(name, f'pyshell_plugin_{name}', 'run',
+                                          path=os.path.join(directory, filename))
+            self._plugins = found
+        return self._plugins
+
+    def rescan(self):
+        """Forget the plugin directory listing, so it is read again"""
+        self._plugins = None
+
+    def get(self, name):
+        """Return the Builtin called name, or None"""
+        builtin = self._core.get(name)
+        if builtin is None:
+            builtin = self.plugins().get(name)
+        return builtin
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def names(self):
+        """Return the sorted names of all builtins"""
+        return sorted({*self._core, *self.plugins()})
+
+
+# The core builtins; `stage` marks those that can run on a pipeline thread.
+table = Registry([
+    Builtin(':', '.builtins', 'builtin_true', stage=False),
+    Builtin('bg', '.builtins', 'builtin_bg', stage=False),
+    Builtin('break', '.builtins', 'builtin_break', stage=False),
+    Builtin('cat', '.builtins', 'builtin_cat', stage=True),
+    Builtin('cd', '.builtins', 'builtin_cd', stage=False),
+    Builtin('clear', '.builtins', 'builtin_clear', stage=False),
+    Builtin('continue', '.builtins', 'builtin_continue', stage=False),
+    Builtin('echo', '.builtins', 'builtin_echo', stage=True),
+    Builtin('exit', '.builtins', 'builtin_exit', stage=False),
+    Builtin('export', '.builtins', 'builtin_export', stage=False),
+    Builtin('false', '.builtins', 'builtin_false', stage=False),
+    Builtin('fg', '.builtins', 'builtin_fg', stage=False),
+    Builtin('hash', '.builtins', 'builtin_hash', stage=False),
+    Builtin('history', '.builtins', 'builtin_history', stage=True),
+    Builtin('jobs', '.builtins', 'builtin_jobs', stage=False),
+    Builtin('kill', '.builtins', 'builtin_kill', stage=False),
+    Builtin('ls', '.builtins', 'builtin_ls', stage=True),
+    Builtin('memo', '.memo', 'builtin_memo', stage=True),
+    Builtin('parallel', '.parallel', 'builtin_parallel', stage=True),
+    Builtin('pwd', '.builtins', 'builtin_pwd', stage=True),
+    Builtin('read', '.builtins', 'builtin_read', stage=False),
+    Builtin('return', '.builtins', 'builtin_return', stage=False),
+    Builtin('set', '.builtins', 'builtin_set', stage=False),
+    Builtin('tee', '.builtins', 'builtin_tee', stage=True),
+    Builtin('true', '.builtins', 'builtin_true', stage=False),
+    Builtin('type', '.builtins', 'builtin_type', stage=True),
+    Builtin('unset', '.builtins', 'builtin_unset', stage=False),
+    Builtin('wait', '.builtins', 'builtin_wait', stage=False),
+])
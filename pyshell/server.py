@@ -0,0 +1,238 @@
+import os
+import signal
+import socket
+import sys
+
+from . import client
+from . import redirection
+from .shell import Shell
+
+# Requests a worker serves before it is replaced by a fresh fork of the
+# server, bounding what leaks from one request to the next.
+MAX_REQUESTS = 1000
+LISTEN_BACKLOG = 128
+
+USAGE = "usage: main.py --server [-j workers] [socket]"
+
+
+def run_request(argv):
+    """Run argv as main.py would in batch mode; return the exit status"""
+    try:
+        if argv and argv[0] == '-c':
+            return Shell(interactive=False, argv=argv[2:]).run_string(argv[1])
+        if argv:
+            try:
+                script = open(argv[0])
+            except OSError as e:
+                print(f"pyshell: {argv[0]}: {e.strerror}", file=sys.stderr)
+                return 127
+            with script:
+                return Shell(interactive=False, argv=argv).run_script(script)
+        return Shell(interactive=False).run_script(sys.stdin)
+    except SystemExit as e:
+        return int(e.code or 0)
+    except KeyboardInterrupt:
+        return 128 + signal.SIGINT
+
+
+def _open_std(fd, mode, like):
+    """A new sys.stdin/stdout/stderr on fd, encoded like the one it replaces"""
+    line_buffered = like.line_buffering or ('w' in mode and os.isatty(fd))
+    return open(fd, mode, buffering=1 if line_buffered else -1, closefd=False,
+                encoding=like.encoding, errors=like.errors)
+
+
+def _reap_orphans():
+    """Reap finished children left behind by a request's background jobs"""
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+
+
+def serve_request(request, fds):
+    """Run one request with the client's fds as 0, 1 and 2, in its cwd and
+    environment, and put the worker back as it was afterwards"""
+    received = redirection.Redirections(dict(enumerate(fds)), fds)
+    saved_fds = redirection.redirect_shell(received)
+    received.close()
+    saved_std = sys.stdin, sys.stdout, sys.stderr
+    saved_env = dict(os.environ)
+    try:
+        sys.stdin = _open_std(0, 'r', saved_std[0])
+        sys.stdout = _open_std(1, 'w', saved_std[1])
+        sys.stderr = _open_std(2, 'w', saved_std[2])
+        os.environ.clear()
+        os.environ.update(request.get('env') or {})
+        try:
+            os.chdir(request.get('cwd') or '/')
+        except OSError as e:
+            print(f"pyshell: cd: {e.strerror}", file=sys.stderr)
+            return 1
+        return run_request(list(request.get('argv') or []))
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        sys.stdin, sys.stdout, sys.stderr = saved_std
+        redirection.restore(saved_fds)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        if hasattr(signal, 'SIGCHLD'):
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        _reap_orphans()
+
+
+def _handle(conn):
+    try:
+        request, fds = client.recv_request(conn)
+    except (OSError, EOFError, ValueError) as e:
+        print(f"pyshell server: bad request: {e}", file=sys.stderr)
+        return
+    if len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        print("pyshell server: bad request: expected 3 fds", file=sys.stderr)
+        return
+    conn.sendall(client.STATUS.pack(os.getpid()))
+    status = serve_request(request, fds)
+    conn.sendall(client.STATUS.pack(status))
+
+
+def worker(listener, max_requests=MAX_REQUESTS):
+    """Serve requests accepted on listener, then exit"""
+    # Lead a process group, so the client can signal the worker together
+    # with the commands it runs; stay out of the way of terminal job control.
+    os.setpgid(0, 0)
+    for name in ('SIGTTIN', 'SIGTTOU'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    served = 0
+    while served < max_requests:
+        try:
+            conn, _ = listener.accept()
+        except KeyboardInterrupt:
+            continue
+        served += 1
+        with conn:
+            try:
+                _handle(conn)
+            except (OSError, EOFError, KeyboardInterrupt):
+                pass
+
+
+def _listen(path):
+    """Bind a Unix socket at path, readable by this user only"""
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)  # stale socket left by a server that died
+        else:
+            raise OSError(f"a server is already listening on {path}")
+        finally:
+            probe.close()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(LISTEN_BACKLOG)
+    return listener
+
+
+def _fork_worker(listener, max_requests):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            worker(listener, max_requests)
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            print(f"pyshell server: worker {os.getpid()}: {e!r}", file=sys.stderr)
+            status = 1
+        finally:
+            os._exit(status)
+    return pid
+
+
+def serve(path, workers, max_requests=MAX_REQUESTS):
+    """Listen on path and keep `workers` pre-forked workers serving it.
+
+    Everything a request needs is imported here, once, before the workers
+    are forked, so each request costs a fresh Shell object rather than an
+    interpreter start-up. A worker that exits (after max_requests, or by
+    crashing) is replaced. Stops on SIGINT or SIGTERM.
+    """
+    from . import execute, parallel, timing  # noqa: F401 - warm the workers
+    listener = _listen(path)
+
+    def stop(sig, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    pids = set()
+    try:
+        for _ in range(workers):
+            pids.add(_fork_worker(listener, max_requests))
+        print(f"pyshell server: {len(pids)} workers on {path}", file=sys.stderr)
+        while True:
+            pid, _ = os.wait()
+            if pid in pids:
+                pids.discard(pid)
+                pids.add(_fork_worker(listener, max_requests))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listener.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return 0
+
+
+def main(argv):
+    """Entry point for `main.py --server`"""
+    workers = os.cpu_count() or 1
+    if argv[:1] == ['-j']:
+        try:
+            workers = int(argv[1])
+        except (IndexError, ValueError):
+            workers = 0
+        if workers < 1:
+            print(f"pyshell: -j: invalid number of workers\n{USAGE}", file=sys.stderr)
+            return 2
+        argv = argv[2:]
+    if len(argv) > 1:
+        print(USAGE, file=sys.stderr)
+        return 2
+    path = argv[0] if argv else client.default_socket_path()
+    try:
+        return serve(path, workers)
+    except OSError as e:
+        print(f"pyshell: {path}: {e.strerror or e}", file=sys.stderr)
+        return 1
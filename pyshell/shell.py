@@ -1,23 +1,46 @@
 import os
 import signal
-from .readline_setup import HAS_READLINE, setup_readline, save_history
+from .readline_setup import setup_readline
+from . import readline_setup
 from . import parsing
+from . import command_hash
 from . import completion
 from . import execute
+from . import jobs
+from . import history
+from . import variables
+from .startup import profile
+
+RC_FILE = "~/.pyshellrc"
+CONTINUATION_PROMPT = "> "
 
 
 class Shell:
-    def __init__(self):
+    def __init__(self, interactive=True, argv=None):
         self.history_file = os.path.expanduser("~/.pyshell_history")
         self.prompt = "$ "
         self.last_exit_code = 0
-
-        if HAS_READLINE:
-            setup_readline(self)
-        else:
-            self.history = []
-
-        self.setup_signal_handlers()
+        self.interactive = interactive
+        self.argv = list(argv) if argv else ['pyshell']
+        self.options = {'errexit': False, 'pipefail': False, 'noglob': False, 'globstar': False,
+                        'bigpipe': False}
+        self.pipestatus = [0]
+        self.jobs = jobs.JobTable()
+        self.last_background_pid = None
+        self.timer = None
+        self.substitution_status = 0
+        self.functions = {}
+        # Nesting of conditions (where `set -e` is ignored), loops and
+        # function calls being executed
+        self.condition_depth = 0
+        self.loop_depth = 0
+        self.function_depth = 0
+        self.history = history.HistoryStore(self.history_file)
+        self.variables = variables.Variables()
+
+        if interactive:
+            self.setup_signal_handlers()
+        profile.mark('shell constructed')
 
     def setup_signal_handlers(self):
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -46,54 +69,133 @@ class Shell:
         except SystemExit:
             raise
 
-    def run(self):
-        print("PyShell - A POSIX-compliant shell")
-        print("Type 'exit' to quit")
-
-        if HAS_READLINE:
-            print("[+] Tab completion enabled (press Tab)")
-            print("[+] Command history enabled (Up/Down arrows)")
-        else:
-            print("[-] readline not available - no Tab completion")
-            print("  On Windows: pip install pyreadline3")
-        print()
-
+    def load_rc(self):
+        """Run the commands in ~/.pyshellrc, if it exists"""
+        try:
+            rc = open(os.path.expanduser(RC_FILE))
+        except OSError:
+            return
+        with rc:
+            self.run_script(rc)
+        profile.mark('rc file')
+
+    def _after_first_prompt(self):
+        """Work deferred until the first prompt is on screen"""
+        profile.mark('history loaded')
+        completion.index.warm()
+        profile.mark('completion index started')
+        profile.report()
+
+    def run(self, quiet=False, norc=False):
+        """Interactive loop. quiet skips the banner and norc the rc file."""
+        if not norc:
+            self.load_rc()
+
+        setup_readline(self, deferred=self._after_first_prompt)
+        has_readline = readline_setup.readline is not None
+        if not has_readline:
+            self.history.load()
+        profile.mark('readline set up')
+
+        if not quiet:
+            print("PyShell - A POSIX-compliant shell")
+            print("Type 'exit' to quit")
+
+            if has_readline:
+                print("[+] Tab completion enabled (press Tab)")
+                print("[+] Command history enabled (Up/Down arrows)")
+            else:
+                print("[-] readline not available - no Tab completion")
+                print("  On Windows: pip install pyreadline3")
+            print()
+
+        from .prompt import PromptEngine
+        prompts = PromptEngine(self)
+
+        first = True
         while True:
             try:
-                cwd = os.getcwd()
-                home = os.path.expanduser('~')
-                if cwd.startswith(home):
-                    cwd = '~' + cwd[len(home):]
+                self.jobs.notify()
+                command_hash.table.expire()
 
-                self.prompt = f"{cwd} $ "
+                self.prompt = prompts.render()
 
-                line = input(self.prompt).strip()
+                if first:
+                    first = False
+                    profile.mark('first prompt')
+                    if not has_readline:
+                        profile.report()
+
+                line = prompts.input(self.prompt).strip()
 
                 if not line:
                     continue
 
-                if not HAS_READLINE:
-                    self.history.append(line)
+                line = self.read_continuation(line)
+                self.history.add(self.history_entry(line))
 
-                if '|' in line:
-                    commands = [cmd.strip() for cmd in line.split('|')]
-                    self.last_exit_code = self.execute_pipeline(commands)
-                else:
-                    self.last_exit_code = self.execute_command(line)
+                self.last_exit_code = execute.execute_line(self, line)
 
+            except execute.Errexit as e:
+                self.last_exit_code = e.status
+                break
             except EOFError:
                 print()
-                save_history(self)
                 break
             except KeyboardInterrupt:
                 print()
                 continue
-            except SystemExit:
-                save_history(self)
-                raise
             except Exception as e:
                 print(f"Error: {e}")
                 self.last_exit_code = 1
 
-        save_history(self)
-
+    def read_continuation(self, line):
+        """Read further lines with the continuation prompt until line holds
+        whole commands"""
+        while not parsing.is_complete(line):
+            try:
+                more = input(CONTINUATION_PROMPT)
+            except EOFError:
+                print()
+                break
+            line += '\n' + more
+        return line
+
+    @staticmethod
+    def history_entry(line):
+        """Return line as a single history entry"""
+        if '\n' not in line:
+            return line
+        try:
+            node = parsing.parse(line)
+        except parsing.ParseError:
+            return line.replace('\\\n', '').replace('\n', ' ')
+        return parsing.unparse(node) if node is not None else ''
+
+    def run_lines(self, lines):
+        """Execute an iterable of lines without prompts, readline or history.
+
+        Lines are gathered until they hold whole commands, so a loop or
+        function spanning several lines is parsed once and run as a unit.
+        With `set -e` execution stops at the first failing command. Returns
+        the exit status of the last command run.
+        """
+        pending = parsing.InputBuffer()
+        try:
+            for line in lines:
+                if pending.add(line):
+                    self.last_exit_code = execute.execute_line(self, pending.take())
+
+            if pending.text:
+                self.last_exit_code = execute.execute_line(self, pending.take())
+        except execute.Errexit as e:
+            self.last_exit_code = e.status
+        return self.last_exit_code
+
+    def run_script(self, stream):
+        """Execute commands read from a file object, one line at a time"""
+        return self.run_lines(stream)
+
+    def run_string(self, text):
+        """Execute commands given as a string, as for `-c`"""
+        return self.run_lines(text.splitlines())
@@ -0,0 +1,128 @@
+import os
+import signal
+import sys
+
+# Process launch backends. `posix_spawn` launches children with
+# os.posix_spawn and file actions for redirections; `subprocess` goes through
+# subprocess.Popen and is used wherever posix_spawn is unavailable.
+BACKENDS = ('posix_spawn', 'subprocess')
+HAS_POSIX_SPAWN = hasattr(os, 'posix_spawn')
+
+# Signals Python ignores that a child should get back at their defaults,
+# as subprocess does with restore_signals=True.
+_RESTORE_SIGNALS = tuple(
+    getattr(signal, name) for name in ('SIGPIPE', 'SIGXFZ', 'SIGXFSZ') if hasattr(signal, name)
+)
+
+
+def backend():
+    """Return the launcher selected by $PYSHELL_SPAWN (default: posix_spawn)"""
+    name = os.environ.get('PYSHELL_SPAWN', 'posix_spawn')
+    if name not in BACKENDS or (name == 'posix_spawn' and not HAS_POSIX_SPAWN):
+        return 'subprocess'
+    return name
+
+
+def exit_status(returncode):
+    """Map a subprocess-style return code to a shell exit status"""
+    return 128 - returncode if returncode < 0 else returncode
+
+
+class Process:
+    """A child started with posix_spawn, with a Popen-like wait().
+
+    Children are reaped with os.wait4, so `rusage` holds the child's
+    resource usage once it has exited.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self.rusage = None
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+                self.rusage = rusage
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            while True:
+                try:
+                    _, status, rusage = os.wait4(self.pid, 0)
+                    break
+                except InterruptedError:
+                    continue
+            self.returncode = os.waitstatus_to_exitcode(status)
+            self.rusage = rusage
+        return self.returncode
+
+
+def _fd(stream):
+    if stream is None or isinstance(stream, int):
+        return stream
+    return stream.fileno()
+
+
+def spawn(argv, stdin=None, stdout=None, stderr=None, env=None, using=None, pgroup=None, fds=None):
+    """Start argv[0] (a full path) with the given stdio.
+
+    stdin/stdout/stderr may be None (inherit), an fd or a file object.
+    fds maps further child fds to the parent fd they should be a copy of,
+    or to None to close them (see redirection.Redirections); it is applied
+    after stdin/stdout/stderr.
+    pgroup, if not None, is the process group to put the child in
+    (0 starts a new group led by the child).
+    Returns an object with Popen's pid, returncode, poll() and wait().
+    Raises OSError if the program cannot be started.
+    """
+    using = using or backend()
+    if env is None:
+        env = os.environ
+
+    mapping = {target: _fd(stream) for target, stream in enumerate((stdin, stdout, stderr))
+               if stream is not None}
+    if fds:
+        mapping.update(fds)
+
+    if using == 'subprocess':
+        import subprocess
+
+        kwargs = {}
+        if pgroup is not None and sys.version_info >= (3, 11):
+            kwargs['process_group'] = pgroup
+        if any(target > 2 or source is None for target, source in mapping.items()):
+            # Popen only maps stdio, so anything else is done before exec
+            from . import redirection
+
+            def prepare():
+                if pgroup is not None and 'process_group' not in kwargs:
+                    os.setpgid(0, pgroup)
+                redirection.apply(mapping)
+            return subprocess.Popen(argv, env=env, preexec_fn=prepare, close_fds=False, **kwargs)
+        if pgroup is not None and 'process_group' not in kwargs:
+            kwargs['preexec_fn'] = lambda: os.setpgid(0, pgroup)
+        return subprocess.Popen(argv, stdin=mapping.get(0), stdout=mapping.get(1),
+                                stderr=mapping.get(2), env=env, **kwargs)
+
+    file_actions = []
+    if mapping:
+        from . import redirection
+
+        for action in redirection.dup_actions(mapping):
+            if action[0] == 'dup2':
+                file_actions.append((os.POSIX_SPAWN_DUP2, action[1], action[2]))
+            else:
+                file_actions.append((os.POSIX_SPAWN_CLOSE, action[1]))
+
+    kwargs = {}
+    if pgroup is not None:
+        kwargs['setpgroup'] = pgroup
+    pid = os.posix_spawn(argv[0], argv, env,
+                         file_actions=file_actions,
+                         setsigdef=_RESTORE_SIGNALS,
+                         **kwargs)
+    return Process(pid)
@@ -0,0 +1,39 @@
+import sys
+import time
+
+
+class StartupProfile:
+    """Checkpoints of where start-up time goes, for --startup-profile.
+
+    Marks are cheap no-ops unless the profile is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.marks = []
+        self.reported = False
+
+    def start(self, origin=None):
+        """Enable profiling, measuring from origin (a perf_counter value)"""
+        self.enabled = True
+        self.marks = [('start', origin if origin is not None else time.perf_counter())]
+
+    def mark(self, name):
+        if self.enabled:
+            self.marks.append((name, time.perf_counter()))
+
+    def report(self, stream=None):
+        """Print each phase and its duration once, to stderr by default"""
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        stream = stream or sys.stderr
+        origin = self.marks[0][1]
+        previous = origin
+        print("startup profile (ms):", file=stream)
+        for name, at in self.marks[1:]:
+            print(f"  {name:<28} {(at - previous) * 1e3:8.2f}  (at {(at - origin) * 1e3:8.2f})", file=stream)
+            previous = at
+
+
+profile = StartupProfile()
@@ -0,0 +1,347 @@
+import os
+import stat
+import sys
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Size of the fallback read/write buffer and of each zero-copy request.
+BUFFER_SIZE = 128 * 1024
+ZERO_COPY_CHUNK = 1 << 30
+
+# The largest buffer an unprivileged process may give a pipe (Linux).
+PIPE_MAX_SIZE_FILE = '/proc/sys/fs/pipe-max-size'
+
+
+def stream_fd(stream):
+    """Return the OS-level fd behind stream, or None if it has none"""
+    if stream is None:
+        return None
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def write_all(fd: int, data):
+    """os.write() data to fd, retrying short writes"""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+@lru_cache(maxsize=None)
+def pipe_max_size():
+    """The system's limit on pipe buffer size, or 0 where it cannot be raised"""
+    if fcntl is None or not hasattr(fcntl, 'F_SETPIPE_SZ'):
+        return 0
+    try:
+        with open(PIPE_MAX_SIZE_FILE) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def pipe(size=0):
+    """os.pipe(), with its buffer grown to size bytes where the OS allows.
+
+    Growing fails once the user's pipes hold more than the kernel's
+    per-user allowance; the pipe then keeps its default buffer.
+    """
+    read_fd, write_fd = os.pipe()
+    if size and hasattr(fcntl, 'F_SETPIPE_SZ'):
+        try:
+            fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, size)
+        except OSError:
+            pass
+    return read_fd, write_fd
+
+
+def _splice(src: int, dst: int):
+    """Move src to dst through the kernel's pipe buffers until EOF.
+
+    One of the two must be a pipe. Returns early, leaving the rest to a
+    buffered copy, when the other end cannot splice (a terminal, or a file
+    opened for appending).
+    """
+    try:
+        while os.splice(src, dst, ZERO_COPY_CHUNK):
+            pass
+    except BrokenPipeError:
+        raise
+    except OSError:
+        pass
+
+
+def _zero_copy(src: int, dst: int):
+    """Copy src to dst inside the kernel for as long as the kernel allows.
+
+    Uses copy_file_range between regular files, sendfile from other files
+    and splice from a pipe. Returns once the kernel reports EOF or refuses
+    the fd pair; the caller finishes with a buffered copy, which also
+    covers files such as those in /proc that report a size of 0 but still
+    have content.
+    """
+    try:
+        src_st = os.fstat(src)
+        dst_st = os.fstat(dst)
+    except OSError:
+        return
+    if stat.S_ISFIFO(src_st.st_mode) and hasattr(os, 'splice'):
+        _splice(src, dst)
+        return
+    if not stat.S_ISREG(src_st.st_mode) or src_st.st_size == 0:
+        return
+
+    if stat.S_ISREG(dst_st.st_mode) and hasattr(os, 'copy_file_range'):
+        try:
+            while os.copy_file_range(src, dst, ZERO_COPY_CHUNK):
+                pass
+            return
+        except OSError:
+            pass
+
+    if hasattr(os, 'sendfile'):
+        try:
+            while os.sendfile(dst, src, None, ZERO_COPY_CHUNK):
+                pass
+        except BrokenPipeError:
+            raise
+        except OSError:
+            pass
+
+
+def copy_fd(src: int, dst: int):
+    """Copy everything readable from src to dst with constant memory use"""
+    _zero_copy(src, dst)
+    while True:
+        data = os.read(src, BUFFER_SIZE)
+        if not data:
+            return
+        write_all(dst, data)
+
+
+@lru_cache(maxsize=None)
+def _libc_tee():
+    """tee(2), which copies a pipe's contents to another pipe without
+    consuming them, or None; the os module does not wrap it"""
+    if not sys.platform.startswith('linux') or not hasattr(os, 'splice'):
+        return None
+    try:
+        import ctypes
+        tee = ctypes.CDLL(None, use_errno=True).tee
+    except (ImportError, OSError, AttributeError):
+        return None
+    tee.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    tee.restype = ctypes.c_ssize_t
+
+    def call(src, dst, size):
+        n = tee(src, dst, size, 0)
+        if n < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return n
+    return call
+
+
+def _read_exactly(fd: int, size: int):
+    chunks = []
+    while size:
+        data = os.read(fd, min(size, BUFFER_SIZE))
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+
+def _tee_spliced(src: int, dsts, failed):
+    """Fan a pipe out to a pipe and one other fd without copying through
+    user space: tee(2) duplicates what src holds into dsts[0], and splice
+    then moves the same bytes to dsts[1]. Returns True at EOF, or False to
+    have the caller carry on with a buffered copy."""
+    tee = _libc_tee()
+    try:
+        if (tee is None or not stat.S_ISFIFO(os.fstat(src).st_mode)
+                or not stat.S_ISFIFO(os.fstat(dsts[0]).st_mode)):
+            return False
+    except OSError:
+        return False
+    while True:
+        try:
+            size = tee(src, dsts[0], ZERO_COPY_CHUNK)
+        except BrokenPipeError:
+            raise
+        except OSError:
+            return False
+        if not size:
+            return True
+        try:
+            while size:
+                size -= os.splice(src, dsts[1], size)
+        except BrokenPipeError:
+            raise
+        except OSError:
+            # dsts[0] already has these bytes: give dsts[1] its share the slow way
+            data = _read_exactly(src, size)
+            try:
+                write_all(dsts[1], data)
+            except BrokenPipeError:
+                raise
+            except OSError as e:
+                failed[dsts[1]] = e
+            return False
+
+
+def tee_fd(src: int, dsts):
+    """Copy everything readable from src to every fd in dsts.
+
+    A pipe fanned out to a pipe and one more fd is copied inside the
+    kernel; otherwise each block is read once and the same buffer written
+    to every output. An output that fails is dropped while the others
+    carry on, except that a BrokenPipeError is raised. Returns a dict of
+    the failed fds and their errors.
+    """
+    failed = {}
+    outputs = list(dsts)
+    if len(outputs) == 2 and _tee_spliced(src, outputs, failed):
+        return failed
+    outputs = [fd for fd in outputs if fd not in failed]
+    while outputs:
+        data = os.read(src, BUFFER_SIZE)
+        if not data:
+            break
+        for fd in list(outputs):
+            try:
+                write_all(fd, data)
+            except BrokenPipeError:
+                raise
+            except OSError as e:
+                failed[fd] = e
+                outputs.remove(fd)
+    return failed
+
+
+def copy_stream(src, dst):
+    """Copy from a file object (text or binary) to a file object.
+
+    Used when one side has no fd, e.g. an io.StringIO standing in for stdout.
+    """
+    src = getattr(src, 'buffer', src)
+    dst_binary = getattr(dst, 'buffer', None)
+    while True:
+        data = src.read(BUFFER_SIZE)
+        if not data:
+            return
+        if dst_binary is not None:
+            if isinstance(data, str):
+                data = data.encode()
+            dst_binary.write(data)
+        else:
+            if isinstance(data, bytes):
+                data = data.decode(errors='replace')
+            dst.write(data)
+
+
+def read_lines(fd: int):
+    """Yield the lines of text read from fd, with fd's offset just past each
+    line while the caller handles it, so that `read` and the commands a
+    script runs read on from the next line, as in sh.
+
+    A seekable fd is read a block at a time and its offset moved back to the
+    end of each line; if something has read on from there by the time the
+    next line is wanted, the rest of the block is dropped. Anything else,
+    such as a pipe, is read a byte at a time.
+    """
+    try:
+        offset = os.lseek(fd, 0, os.SEEK_CUR)  # of the start of data
+    except OSError:
+        offset = None
+    size = BUFFER_SIZE if offset is not None else 1
+    data = b''
+    line = bytearray()
+    while True:
+        end = data.find(b'\n') + 1
+        if not end:
+            line += data
+            if offset is not None:
+                offset += len(data)
+                os.lseek(fd, offset, os.SEEK_SET)
+            try:
+                data = os.read(fd, size)
+            except InterruptedError:
+                data = b''
+                continue
+            if not data:
+                if line:
+                    yield line.decode(errors='replace')
+                return
+            continue
+
+        line += data[:end]
+        data = data[end:]
+        if offset is not None:
+            offset += end
+            os.lseek(fd, offset, os.SEEK_SET)
+        yield line.decode(errors='replace')
+        line = bytearray()
+        if offset is not None:
+            position = os.lseek(fd, 0, os.SEEK_CUR)
+            if position != offset:
+                offset, data = position, b''
+
+
+class OutputSink:
+    """Buffered text output for a builtin, written to an fd with os.write.
+
+    Text is gathered and encoded in chunks of about BUFFER_SIZE, so a
+    builtin printing many short lines makes a few large writes instead of
+    one per line, whether the fd is a terminal, file or pipe. A builtin
+    that writes to fileno() itself must flush() first.
+    """
+
+    def __init__(self, fd, closefd=False):
+        self.fd = fd
+        self.closefd = closefd
+        self._pending = []
+        self._size = 0
+
+    def write(self, text):
+        self._pending.append(text)
+        self._size += len(text)
+        if self._size >= BUFFER_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if not self._pending:
+            return
+        data = ''.join(self._pending).encode(errors='surrogateescape')
+        self._pending = []
+        self._size = 0
+        write_all(self.fd, data)
+
+    def fileno(self):
+        return self.fd
+
+    def isatty(self):
+        return os.isatty(self.fd)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pending = []
+            if self.closefd:
+                self.closefd = False
+                os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,128 @@
+import re
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Report formats for the `time` keyword, in bash TIMEFORMAT syntax.
+DEFAULT_FORMAT = '\nreal\t%3lR\nuser\t%3lU\nsys\t%3lS'
+POSIX_FORMAT = 'real %2R\nuser %2U\nsys %2S'
+
+# %[precision][l]R|U|S as in bash, %P cpu percentage, plus the GNU time
+# escapes %M (max RSS in KiB), %w/%c (voluntary/involuntary context
+# switches), %x (exit status) and %C (command).
+_ESCAPE = re.compile(r'%(?:(%)|([0-3])?(l)?([RUSP])|([MwcxC]))')
+
+# ru_maxrss is in KiB on Linux but in bytes on macOS.
+_RSS_SCALE = 1024 if sys.platform == 'darwin' else 1
+
+
+def _usage(who):
+    if resource is None:
+        return None
+    return resource.getrusage(who)
+
+
+class Timer:
+    """Wall-clock and rusage measurement of one timed pipeline.
+
+    CPU time and context switches are the growth of the shell's own usage
+    (covering in-process builtins) plus that of its reaped children, as
+    bash's `time` reports them. Max RSS comes from the per-child rusage
+    collected by os.wait4, or from the shell itself when nothing was spawned.
+    """
+
+    def __init__(self):
+        self.children = []
+        self._wall = time.perf_counter()
+        self._self = _usage(resource.RUSAGE_SELF) if resource else None
+        self._child = _usage(resource.RUSAGE_CHILDREN) if resource else None
+
+    def add_child(self, rusage):
+        """Record the rusage of a child reaped while timing"""
+        if rusage is not None:
+            self.children.append(rusage)
+
+    def stop(self, command, status):
+        """Return the measurements as a dict"""
+        report = {
+            'command': command,
+            'real': time.perf_counter() - self._wall,
+            'user': 0.0,
+            'sys': 0.0,
+            'max_rss_kb': 0,
+            'voluntary_ctx_switches': 0,
+            'involuntary_ctx_switches': 0,
+            'status': status,
+        }
+        if resource is None:
+            return report
+
+        now_self = _usage(resource.RUSAGE_SELF)
+        now_child = _usage(resource.RUSAGE_CHILDREN)
+        for before, after in ((self._self, now_self), (self._child, now_child)):
+            report['user'] += after.ru_utime - before.ru_utime
+            report['sys'] += after.ru_stime - before.ru_stime
+            report['voluntary_ctx_switches'] += after.ru_nvcsw - before.ru_nvcsw
+            report['involuntary_ctx_switches'] += after.ru_nivcsw - before.ru_nivcsw
+
+        if self.children:
+            max_rss = max(r.ru_maxrss for r in self.children)
+        elif now_child.ru_maxrss > self._child.ru_maxrss:
+            max_rss = now_child.ru_maxrss
+        else:
+            max_rss = now_self.ru_maxrss
+        report['max_rss_kb'] = max_rss // _RSS_SCALE
+        return report
+
+
+def _seconds(value, precision, long_format):
+    if long_format:
+        minutes, seconds = divmod(value, 60)
+        return f"{int(minutes)}m{seconds:.{precision}f}s"
+    return f"{value:.{precision}f}"
+
+
+def format_report(fmt, report):
+    """Expand TIMEFORMAT-style escapes in fmt from a Timer report"""
+    def replace(m):
+        if m.group(1):
+            return '%'
+        if m.group(4):
+            precision = int(m.group(2)) if m.group(2) else 3
+            if m.group(4) == 'P':
+                cpu = report['user'] + report['sys']
+                percent = cpu * 100 / report['real'] if report['real'] else 0.0
+                return f"{percent:.{min(precision, 2)}f}"
+            key = {'R': 'real', 'U': 'user', 'S': 'sys'}[m.group(4)]
+            return _seconds(report[key], precision, bool(m.group(3)))
+        return str(report[{
+            'M': 'max_rss_kb',
+            'w': 'voluntary_ctx_switches',
+            'c': 'involuntary_ctx_switches',
+            'x': 'status',
+            'C': 'command',
+        }[m.group(5)]])
+
+    return _ESCAPE.sub(replace, fmt)
+
+
+def render(report, options, timeformat=None):
+    """Render a report for the `time` keyword options (-p, -j).
+
+    timeformat is the value of $TIMEFORMAT, None if unset. Returns None
+    when it is set to the empty string.
+    """
+    if '-j' in options:
+        import json
+        return json.dumps(report)
+    if '-p' in options:
+        fmt = POSIX_FORMAT
+    else:
+        fmt = DEFAULT_FORMAT if timeformat is None else timeformat
+        if not fmt:
+            return None
+    return format_report(fmt.replace('\\n', '\n').replace('\\t', '\t'), report)
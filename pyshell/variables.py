@@ -0,0 +1,89 @@
+import os
+
+# posix_spawn and exec take the environment as bytes; Windows wants str.
+_encode = os.fsencode if os.name == 'posix' else str
+
+
+class Variables:
+    """Shell variables, each either local to the shell or exported.
+
+    Exported variables are mirrored into os.environ so in-process lookups
+    such as PATH searches see them. Child processes get `environ()`, a
+    snapshot of the exported variables already encoded for exec, which is
+    rebuilt only after an exported variable changes (tracked by `version`).
+    """
+
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        self._values = dict(environ)
+        self._exported = set(environ)
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = None
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def is_exported(self, name):
+        return name in self._exported
+
+    def items(self):
+        return sorted(self._values.items())
+
+    def exported(self):
+        return sorted((name, self._values[name]) for name in self._exported if name in self._values)
+
+    def _changed(self, name):
+        if name in self._exported:
+            self.version += 1
+            if name in self._values:
+                os.environ[name] = self._values[name]
+            else:
+                os.environ.pop(name, None)
+
+    def set(self, name, value):
+        """Assign value, keeping the variable's exported flag"""
+        if self._values.get(name) == value:
+            return
+        self._values[name] = value
+        self._changed(name)
+
+    def export(self, name, value=None):
+        """Mark name exported, assigning value if given (bash: export NAME[=value])"""
+        if value is not None:
+            self._values[name] = value
+        if name not in self._exported:
+            self._exported.add(name)
+            if name in self._values:
+                self._changed(name)
+        elif value is not None:
+            self._changed(name)
+
+    def unset(self, name):
+        if name not in self._values and name not in self._exported:
+            return
+        self._values.pop(name, None)
+        self._changed(name)
+        self._exported.discard(name)
+
+    def environ(self, assignments=()):
+        """Return the environment for a child process.
+
+        assignments are (name, value) pairs given in front of the command,
+        which go into a copy of the snapshot for that child only.
+        """
+        if self._snapshot_version != self.version:
+            self._snapshot = {
+                _encode(name): _encode(self._values[name])
+                for name in self._exported if name in self._values
+            }
+            self._snapshot_version = self.version
+        if not assignments:
+            return self._snapshot
+        env = dict(self._snapshot)
+        for name, value in assignments:
+            env[_encode(name)] = _encode(value)
+        return env
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+
+@pytest.fixture
+def sh(tmp_path):
+    """Run a command string with `main.py -c` in tmp_path, with HOME there too;
+    returns the subprocess.CompletedProcess"""
+    def run(command, *args, env=None):
+        environ = dict(os.environ, HOME=str(tmp_path), **(env or {}))
+        return subprocess.run([sys.executable, MAIN, '-c', command, 'pyshell', *args],
+                              cwd=tmp_path, env=environ, capture_output=True, text=True,
+                              timeout=60)
+    return run
+
+
+@pytest.fixture
+def piped(tmp_path):
+    """Run main.py in tmp_path with a script as its stdin, given either as
+    text to pipe in or as an open file; returns the subprocess.CompletedProcess"""
+    def run(script):
+        environ = dict(os.environ, HOME=str(tmp_path))
+        stdin = {'input': script} if isinstance(script, str) else {'stdin': script}
+        return subprocess.run([sys.executable, MAIN], cwd=tmp_path, env=environ,
+                              capture_output=True, text=True, timeout=60, **stdin)
+    return run
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from pyshell import command_hash
+
+
+def _executable(directory, name, text='echo'):
+    path = directory / name
+    path.write_text(f'#!/bin/sh\n{text} {directory.name}\n')
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    found = [tmp_path / f'dir{i}' for i in range(3)]
+    for directory in found:
+        directory.mkdir()
+    monkeypatch.setenv('PATH', os.pathsep.join(map(str, found)))
+    return found
+
+
+def test_hit_makes_no_system_calls(dirs, monkeypatch):
+    table = command_hash.CommandHash()
+    target = _executable(dirs[2], 'target')
+    assert table.lookup('target') == target
+    assert table.lookup('target') == target  # checks the directories once
+
+    def fail(*args, **kwargs):
+        raise AssertionError('stat on a hashed lookup')
+    monkeypatch.setattr(os, 'stat', fail)
+    assert table.lookup('target') == target
+
+
+def test_shadowing_is_seen_after_expire(dirs):
+    table = command_hash.CommandHash()
+    _executable(dirs[2], 'target')
+    table.lookup('target')
+    shadow = _executable(dirs[0], 'target')
+    table.expire()
+    assert table.lookup('target') == shadow
+
+
+def test_rehash_finds_moved_command(dirs):
+    table = command_hash.CommandHash()
+    old = _executable(dirs[0], 'target')
+    table.lookup('target')
+    os.unlink(old)
+    new = _executable(dirs[1], 'target')
+    assert table.rehash('target') == new
+    assert table.rehash('unhashed') is None
+
+
+def test_shell_runs_command_moved_in_path(sh, dirs):
+    first = _executable(dirs[0], 'target')
+    second = _executable(dirs[1], 'target')
+    os.rename(second, second + '.new')
+    # the second run is a hit that no longer checks the directories
+    script = f'target; target; rm {first}; mv {second}.new {second}; target'
+    result = sh(script, env={'PATH': os.pathsep.join([os.environ['PATH'], os.defpath])})
+    assert result.stdout == 'dir0\ndir0\ndir1\n'
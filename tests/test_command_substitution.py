@@ -0,0 +1,50 @@
+def test_builtin_piped_into_command(sh, tmp_path):
+    (tmp_path / 'version').write_text('1.2.3\n')
+    for _ in range(10):
+        result = sh('echo "[$(echo a | cat)] [$(cat version 2>/dev/null)]"')
+        assert result.stdout == '[a] [1.2.3]\n'
+        assert result.stderr == ''
+
+
+def test_builtin_stderr_to_stdout(sh):
+    for _ in range(10):
+        result = sh('echo "[$(ls /nonexist 2>&1)]"')
+        assert 'No such file or directory' in result.stdout
+        assert result.stderr == ''
+
+
+def test_trailing_newlines_are_removed(sh):
+    assert sh('echo "[$(printf "a\\n\\n\\n")]"').stdout == '[a]\n'
+
+
+def test_nested_and_backquoted(sh):
+    assert sh('echo $(echo $(echo deep)) `echo back`').stdout == 'deep back\n'
+
+
+def test_word_splitting(sh):
+    assert sh('for w in $(echo a b c); do echo $w; done').stdout == 'a\nb\nc\n'
+    assert sh('for w in "$(echo a b c)"; do echo $w; done').stdout == 'a b c\n'
+
+
+def test_assignment_status(sh):
+    assert sh('x=$(false); echo $?; x=$(sh -c "exit 3"); echo $?').stdout == '1\n3\n'
+
+
+def test_builtin_output_in_process(sh, tmp_path):
+    (tmp_path / 'VERSION').write_text('2.0\n')
+    assert sh('echo "v$(cat VERSION) in $(pwd)"').stdout == f'v2.0 in {tmp_path}\n'
+
+
+def test_compound_command_and_function(sh):
+    result = sh('f() { echo fn; }; echo "$(f) $(for i in 1 2; do echo $i; done)"')
+    assert result.stdout == 'fn 1\n2\n'
+
+
+def test_large_output(sh):
+    result = sh('x=$(seq 200000); echo "$x" | tail -1')
+    assert result.stdout == '200000\n'
+
+
+def test_does_not_change_the_shell(sh, tmp_path):
+    result = sh('x=1; y=$(x=2; cd /; echo $x); echo $x $y; pwd')
+    assert result.stdout == f'1 2\n{tmp_path}\n'
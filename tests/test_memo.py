@@ -0,0 +1,52 @@
+import pytest
+
+
+@pytest.fixture
+def memo(sh, tmp_path):
+    env = {'PYSHELL_MEMO_DIR': str(tmp_path / 'memo')}
+    return lambda command: sh(command, env=env)
+
+
+def _hits(memo):
+    stats = memo('memo --stats').stdout
+    return int(stats.split('hits')[1].split()[0])
+
+
+def test_builtin_output_is_stored_and_replayed(memo, tmp_path):
+    (tmp_path / 'version').write_text('1.2.3\n')
+    for _ in range(3):
+        result = memo('memo echo hello; echo $?; memo cat version; echo $?')
+        assert result.stdout == 'hello\n0\n1.2.3\n0\n'
+        assert result.stderr == ''
+    assert _hits(memo) == 4
+
+
+def test_external_command_status_is_replayed(memo):
+    for _ in range(2):
+        result = memo("memo sh -c 'echo out; exit 3'; echo $?")
+        assert result.stdout == 'out\n3\n'
+    assert _hits(memo) == 1
+
+
+def test_failed_write_is_not_stored(memo):
+    result = memo('memo echo closed >&-; echo $?')
+    assert result.stdout == '1\n'
+    assert 'write error' in result.stderr
+    assert memo('memo echo closed').stdout == 'closed\n'
+    assert _hits(memo) == 0
+
+
+def test_input_file_change_is_a_miss(memo, tmp_path):
+    data = tmp_path / 'data'
+    data.write_text('one\n')
+    assert memo('memo -i data cat data').stdout == 'one\n'
+    data.write_text('two two\n')
+    assert memo('memo -i data cat data').stdout == 'two two\n'
+    assert memo('memo -i data cat data').stdout == 'two two\n'
+    assert _hits(memo) == 1
+
+
+def test_clear(memo):
+    memo('memo echo x')
+    memo('memo --clear')
+    assert 'entries    0' in memo('memo --stats').stdout
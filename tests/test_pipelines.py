@@ -0,0 +1,13 @@
+def test_state_changing_builtin_stage_runs_in_subshell(sh):
+    result = sh('export X=1 | cat; echo "[$X]"; cd / | cat; pwd')
+    assert result.stdout.splitlines()[0] == '[]'
+    assert result.stdout.splitlines()[1] != '/'
+
+
+def test_jobs_in_pipeline_lists_parent_jobs(sh):
+    result = sh('sleep 1 & jobs | cat; echo "[$(jobs)]"; wait')
+    assert result.stdout.count('sleep 1 &') == 2
+
+
+def test_output_builtin_stage(sh):
+    assert sh('echo a b | cat | cat').stdout == 'a b\n'
@@ -0,0 +1,79 @@
+from pyshell import redirection
+
+
+def test_output_and_append(sh, tmp_path):
+    sh('echo one > f; echo two >> f; pwd >> f')
+    assert (tmp_path / 'f').read_text() == f'one\ntwo\n{tmp_path}\n'
+
+
+def test_input(sh, tmp_path):
+    (tmp_path / 'in').write_text('b\na\n')
+    assert sh('sort < in').stdout == 'a\nb\n'
+    assert sh('read x < in; echo $x').stdout == 'b\n'
+
+
+def test_stderr_to_stdout_order(sh, tmp_path):
+    result = sh('ls /nonexist > out 2>&1')
+    assert result.stderr == ''
+    assert 'No such file' in (tmp_path / 'out').read_text()
+    result = sh('ls /nonexist 2>&1 > out')
+    assert 'No such file' in result.stdout
+    assert (tmp_path / 'out').read_text() == ''
+
+
+def test_both_streams(sh, tmp_path):
+    sh("sh -c 'echo out; echo err >&2' &> f")
+    assert sorted((tmp_path / 'f').read_text().split()) == ['err', 'out']
+    sh("sh -c 'echo again >&2' &>> f")
+    assert (tmp_path / 'f').read_text().endswith('again\n')
+
+
+def test_swap_stdout_and_stderr(sh):
+    result = sh("sh -c 'echo out; echo err >&2' 3>&1 1>&2 2>&3")
+    assert result.stdout == 'err\n'
+    assert result.stderr == 'out\n'
+
+
+def test_builtin_redirections_are_undone(sh, tmp_path):
+    result = sh('echo a >&2 2>/dev/null; echo b 2>/dev/null >&2; echo c')
+    assert result.stdout == 'c\n'
+    assert result.stderr == 'a\n'  # b went to fd 2, which was /dev/null by then
+
+
+def test_closed_stdout_is_a_write_error(sh):
+    result = sh('echo closed >&-; echo $?')
+    assert result.stdout == '1\n'
+    assert 'write error' in result.stderr
+
+
+def test_here_string(sh):
+    assert sh('read a b <<< "x y"; echo $b$a').stdout == 'yx\n'
+    assert sh('cat <<< hello | tr a-z A-Z').stdout == 'HELLO\n'
+
+
+def test_compound_command_redirection(sh, tmp_path):
+    sh('for i in 1 2; do echo $i; done > f; { echo x; echo y; } >> f')
+    assert (tmp_path / 'f').read_text() == '1\n2\nx\ny\n'
+
+
+def test_pipeline_stage_redirections(sh, tmp_path):
+    result = sh('echo hi | tee copy 2>/dev/null | cat > out')
+    assert result.stdout == ''
+    assert (tmp_path / 'copy').read_text() == (tmp_path / 'out').read_text() == 'hi\n'
+
+
+def test_errors(sh):
+    result = sh('echo x > /nonexist/f; echo $?')
+    assert result.stdout.endswith('No such file or directory\n1\n')
+    result = sh('echo x >&7; echo $?')
+    assert 'bad file descriptor' in result.stdout + result.stderr
+
+
+def test_dup_actions_use_a_spare_for_clobbered_sources():
+    # 2>&1 1>f: fd 2 must copy the old fd 1 before fd 1 is replaced
+    actions = redirection.dup_actions({2: 1, 1: 20})
+    assert actions == [('dup2', 1, 21), ('dup2', 21, 2), ('dup2', 20, 1), ('close', 21)]
+
+
+def test_dup_actions_close():
+    assert redirection.dup_actions({1: None}) == [('close', 1)]
@@ -0,0 +1,64 @@
+import os
+import time
+
+from pyshell import parsing, streams
+
+
+def _chunks(lines):
+    """The command texts an InputBuffer gathers from lines"""
+    buffer = parsing.InputBuffer()
+    chunks = []
+    for line in lines:
+        if buffer.add(line):
+            chunks.append(buffer.take())
+    if buffer.text:
+        chunks.append(buffer.take())
+    return chunks
+
+
+def test_long_loop_body_is_parsed_once(sh):
+    body = '\n'.join(f'  : line {i}' for i in range(2000))
+    start = time.monotonic()
+    result = sh(f'for i in 1 2; do\n{body}\n  echo $i\ndone\necho end')
+    assert result.stdout == '1\n2\nend\n'
+    assert time.monotonic() - start < 10
+
+
+def test_buffer_splits_whole_commands():
+    assert _chunks(['if true; then', 'echo a', 'fi', 'echo b']) == ['if true; then\necho a\nfi\n', 'echo b\n']
+    assert _chunks(['case x in', 'if) echo;;', '(a|b) echo', 'esac']) == ['case x in\nif) echo;;\n(a|b) echo\nesac\n']
+    assert _chunks(['f() {', 'echo done fi', '}', 'g']) == ['f() {\necho done fi\n}\n', 'g\n']
+    assert _chunks(['echo "a', 'fi"', 'echo \\', 'if']) == ['echo "a\nfi"\n', 'echo \\\nif\n']
+    assert _chunks(['echo a |', 'cat', '( echo', ')']) == ['echo a |\ncat\n', '( echo\n)\n']
+
+
+def test_buffer_reports_syntax_error_inside_construct():
+    assert _chunks(['while true; do', 'fi', 'echo a']) == ['while true; do\nfi\n', 'echo a\n']
+
+
+def test_read_takes_next_line_of_piped_script(piped):
+    result = piped('read x\necho got:$x\nhello\necho "x=$x"\n')
+    assert result.stdout == 'hello: command not found\nx=echo got:$x\n'
+
+
+def test_commands_read_on_from_script_file_on_stdin(piped, tmp_path):
+    script = tmp_path / 'script.sh'
+    script.write_text('read x\necho got:$x\nhead -n 1\nfrom head\necho "x=$x"\n')
+    with open(script) as stdin:
+        result = piped(stdin)
+    assert result.stdout == 'from head\nx=echo got:$x\n'
+
+
+def test_read_lines_leaves_offset_after_each_line(tmp_path):
+    path = tmp_path / 'lines'
+    path.write_bytes(b'a\nbcd\n\ne')
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        seen = []
+        for line in streams.read_lines(fd):
+            seen.append((line, os.lseek(fd, 0, os.SEEK_CUR)))
+            if line == 'a\n':
+                os.read(fd, 2)
+        assert seen == [('a\n', 2), ('d\n', 6), ('\n', 7), ('e', 8)]
+    finally:
+        os.close(fd)
@@ -0,0 +1,20 @@
+def test_tee_writes_stdout_and_files(sh, tmp_path):
+    result = sh('seq 3 | tee a b | cat')
+    assert result.stdout == '1\n2\n3\n'
+    assert (tmp_path / 'a').read_text() == (tmp_path / 'b').read_text() == '1\n2\n3\n'
+
+
+def test_tee_append(sh, tmp_path):
+    (tmp_path / 'a').write_text('first\n')
+    sh('echo second | tee -a a > /dev/null')
+    assert (tmp_path / 'a').read_text() == 'first\nsecond\n'
+
+
+def test_tee_in_substitution_keeps_split_characters(sh, tmp_path):
+    # 131071 ASCII bytes put the first é across the 128 KiB read boundary
+    text = 'x' * 131071 + 'é' * 10
+    (tmp_path / 'in').write_text(text)
+    # a lone builtin in $(...) writes into a buffer with no fd
+    sh('{ v="$(tee copy)"; echo "$v" > out; } < in')
+    assert (tmp_path / 'out').read_text() == text + '\n'
+    assert (tmp_path / 'copy').read_text() == text